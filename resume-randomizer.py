@@ -15,6 +15,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+# Version 34 10/18/2026: Compiles the template (with its file fragments) once, and caches it until the template or a fragment changes, instead of re-reading it for every resume.  Can be run from the command line without asking any questions, and can generate batches in several processes (--workers), from a saved seed (--seed, --regenerate), or again from saved choices (--replay).  Adds weights for the sub-points of Random sections, a search for choices that obey every Match and Repeat setting (--assignment search), and a SQLite ledger that applies Max Selections Per Sub-Point and Match Only One Ever across runs (--ledger).  Writes the collated csv one row at a time, so pandas is no longer required.
 # Version 33 07/22/2022: Upgrade to Python 3.11.4.  Fixes bug in interaction between MatchDifferent and "Non-uniform chance for immediate repeat" that could cause crash. Replaces deprecated distutils and pandas.DataFrame.append. Logs console outputs and debugging info to file. isort & black formatting. Adds requirements file. Adds __main__ block.
 # Version 32 12/19/2019: Fixes SyntaxWarning about "is" with a literal. Removed numpy import.
 # Version 31 8/25/2019: Fixes pandas Warning about sorting of appended dataframes.
@@ -58,67 +59,193 @@
 # pathlib.Path
 
 
-Version = 33
-Date = "July 30, 2024"
+Version = 34
+Date = "October 18, 2026"
 
+import argparse
+import bisect
+import codecs
+import collections
+import concurrent.futures
+import csv
 import glob
+import hashlib
 import io
+import itertools
 import json
 import locale
 import logging
 import math
+import multiprocessing
 import os
+import pickle
+import random
 import re
-import shutil
+import sqlite3
 import sys
 import tempfile
+import threading
+from array import array
 from functools import reduce
-from random import random, randrange, shuffle
 from time import strftime
 
-import pandas
 from chardet.universaldetector import UniversalDetector
 
-globalDelayedWrite = []
-globalMemory = {}
-globalThisResumeNumber = 0
-globalThisResumeNumberString = "globalThisResumeNumberString"
-globalThisResumeNumberPaddedString = "globalThisResumeNumberPaddedString"
-globalBatchString = "globalBatchString"
-globalBatchPaddedString = "globalBatchPaddedString"
-globalNumberOfBatchesString = "globalNumberOfBatchesString"
-globalNumberOfResumesPerBatchString = "globalNumberOfResumesPerBatchString"
-globalResumeCountOverBatchesString = "globalResumeCountOverBatchesString"
-globalResumeCountOverBatchesPaddedString = "globalResumeCountOverBatchesPaddedString"
-globalTotalNumberOfResumesString = "globalTotalNumberOfResumesString"
-globalCsvNames = ""
-globalCsvData = ""
-globalDictRangeChoices = {}
-globalInputEncodings = []
-globalOutputEncoding = None
+try:
+    import numpy
+except ImportError:  # numpy is only needed for --random-mode vectorized
+    numpy = None
+
+# the folder within the user's cache folder (see userCacheDirectory) in which compiled templates are cached
+templateCacheDirectory = "resume-randomizer"
+# increment whenever the compiled template classes or cached contents change
+templateCacheFormat = 5
+randomModeDescriptions = {
+    "stream": "the choices of each text file share its random stream",
+    "counter": "each choice has its own random stream, from the text file's stream "
+    "and the choice's variable name",
+    "vectorized": "the choices of Random sections without Match or Repeat settings "
+    "are drawn for a block of text files at once, from the block's random stream, "
+    "and the other choices share the text file's random stream",
+}
+assignmentDescriptions = {
+    "greedy": "each choice is made in turn, and a choice that cannot obey the Match "
+    "and Repeat settings is an error",
+    "search": "the choices of each batch are searched for, before its files are "
+    "written, so that they all obey the Match and Repeat settings",
+}
+collatedFirstColumns = [
+    "filename",
+    "batch",
+    "numberOfBatches",
+    "resume",
+    "numberOfResumesPerBatch",
+    "yearMonthDayHourMinuteSecond",
+    "seed",
+]
 debugLogging = False
+# the number of resumes whose unconstrained choices are drawn at once with --random-mode vectorized
+vectorizedBlockSize = 1024
+# sections that can be visited more often than this in one resume are not drawn in blocks, to bound the memory used
+vectorizedMaxVisits = 1000
+# weighted choices are drawn from the alias table this many times before picking from the weights of the choices left
+weightedDrawAttempts = 4
+# --assignment search gives up on a batch after generating its choices this many times
+searchMaxAttempts = 100000
+# seconds to wait for the other processes using a --ledger before giving up
+ledgerTimeout = 600.0
+# output encodings whose bytes for a piece of text depend on the text written before it, so Leaf text is not encoded ahead of time
+statefulEncodings = {
+    "iso2022_jp",
+    "iso2022_jp_1",
+    "iso2022_jp_2",
+    "iso2022_jp_2004",
+    "iso2022_jp_3",
+    "iso2022_jp_ext",
+    "iso2022_kr",
+    "hz",
+    "utf-7",
+}
+
+
+class ThreadLogFilter(logging.Filter):
+    """
+    Drops the log records below the level set for the thread that logged them, see setThreadLogLevel.
+    """
 
+    def __init__(self):
+        super().__init__()
+        self.levels = {}  # thread id -> the lowest level logged
 
-def openInputFile(filename):
+    def filter(self, record):
+        return record.levelno >= self.levels.get(record.thread, logging.NOTSET)
+
+
+threadLogFilter = ThreadLogFilter()
+
+
+def setThreadLogLevel(level):
     """
-    Opens a file for reading, trying different encodings.
+    Only logs the records of at least level from this thread, so a run can log less without changing what the runs in other threads log.
 
-    Returns the open file and the encoding used to open it.
-    The encoding is a best-guess.
+    Returns the level it replaces, to set back when the run is done (logging.NOTSET logs everything).
+    """
+    rootLogger = logging.getLogger()
+    if threadLogFilter not in rootLogger.filters:
+        rootLogger.addFilter(threadLogFilter)
+    thread = threading.get_ident()
+    previousLevel = threadLogFilter.levels.pop(thread, logging.NOTSET)
+    if level > logging.NOTSET:
+        threadLogFilter.levels[thread] = level
+    return previousLevel
+
+
+def getThreadLogLevel():
+    """
+    Returns the level set for this thread by setThreadLogLevel.
+    """
+    return threadLogFilter.levels.get(threading.get_ident(), logging.NOTSET)
+
+
+def threadLogsLevel(level):
+    """
+    Returns whether a record of this level logged by this thread would be logged.
+    """
+    return logging.getLogger().isEnabledFor(level) and (level >= getThreadLogLevel())
+
+
+class InputFileInfo:
+    """
+    What has been found out about an input file with a given path, size, and modification time, so it is not found out again (see inputFileCache).
+    """
+
+    def __init__(self, contentHash):
+        self.contentHash = contentHash  # sha256 of the file's bytes
+        self.encoding = None  # the encoding it was decoded with, None until decoded
+        self.firstLine = (
+            None  # its first line once decoded, e.g., to check for *fragment*
+        )
+
+
+# (absolute path, size, modification time) -> InputFileInfo of each input file already read
+inputFileCache = {}
+
+
+def inputFileKey(filename):
+    """
+    Returns the key of the file in inputFileCache, which changes whenever the file is changed.  Raises OSError if the file does not exist.
+    """
+    fileStat = os.stat(filename)
+    return (os.path.abspath(filename), fileStat.st_size, fileStat.st_mtime_ns)
+
+
+def readInputFile(filename):
     """
+    Reads a file once as bytes, and decodes it with the encoding cached for it, or else with the system default encoding, or else with chardet's best guess.
+
+    Returns the text (None on failure, which is logged) and the file's InputFileInfo.
+    """
+    key = inputFileKey(filename)
+    with open(filename, "rb") as file:
+        data = file.read()
+    info = inputFileCache.get(key)
+    if info is None:
+        info = InputFileInfo(hashlib.sha256(data).hexdigest())
+        inputFileCache[key] = info
+    if info.encoding is not None:
+        return data.decode(info.encoding), info
 
-    detector = UniversalDetector()
     encoding = locale.getpreferredencoding()
     try:
-        with open(filename, "rt") as file:
-            lines = file.readlines()
+        text = data.decode(encoding)
     except UnicodeError:
         logging.debug(
             "Unable to read file %s with the system default encoding: %s.",
             filename,
             encoding,
         )
-        for line in open(filename, "rb"):
+        detector = UniversalDetector()
+        for line in data.splitlines(keepends=True):
             detector.feed(line)
             if detector.done:
                 break
@@ -126,9 +253,8 @@ def openInputFile(filename):
         encoding = detector.result["encoding"]
 
         try:
-            with open(filename, "rt", encoding=encoding) as file:
-                lines = file.readlines()
-        except UnicodeError:
+            text = data.decode(encoding)
+        except (UnicodeError, LookupError, TypeError):
             logging.error(
                 "Error! Unable to read file %s with either the system default "
                 "encoding %s or the best guess %s.\n"
@@ -137,12 +263,27 @@ def openInputFile(filename):
                 locale.getpreferredencoding(),
                 encoding,
             )
-            return False, None, "FAILED_TO_OPEN"
+            return None, info
 
     logging.debug(
         "\tSuccessfully opened file %s with the encoding: %s.", filename, encoding
     )
-    return True, open(filename, "rt", encoding=encoding), encoding
+    info.encoding = encoding
+    info.firstLine = io.StringIO(text, newline=None).readline()
+    return text, info
+
+
+def openInputFile(filename):
+    """
+    Opens a file for reading, trying different encodings.
+
+    Returns the open file and the encoding used to open it.
+    The encoding is a best-guess.  The file is read and decoded once (see readInputFile), and the returned file reads the decoded text from memory, with any line endings read as "\\n".
+    """
+    text, info = readInputFile(filename)
+    if text is None:
+        return False, None, "FAILED_TO_OPEN"
+    return True, io.StringIO(text, newline=None), info.encoding
 
 
 def frange(limit1, limit2=None, increment=1.0):
@@ -203,10 +344,16 @@ def makeNameArrays(numDifferent, initName, iString, matchedPair):
     return [docArray, savArray, txtArray, csvArray]
 
 
-def createFilenames(name, myTime, numberLength, numDifferent, matchedPair, i=1):
+def createFilenames(
+    name, myTime, numberLength, numDifferent, matchedPair, i=1, claimedFilenames=None
+):
     """
     Creates all the filenames for a batch of files from a template filename.
+
+    Filenames in claimedFilenames are treated as existing files, and the new filenames are added to it, so the filenames of every batch can be created before any files are written.
     """
+    if claimedFilenames is None:
+        claimedFilenames = set()
 
     tempName = name[:-4] + myTime
     iString = str(i).zfill(numberLength)
@@ -214,1457 +361,562 @@ def createFilenames(name, myTime, numberLength, numDifferent, matchedPair, i=1):
         numDifferent, tempName, iString, matchedPair
     )
     while reduce(
-        lambda x, y: x or os.path.exists(y), [False] + docArray + savArray + txtArray
+        lambda x, y: x or (y in claimedFilenames) or os.path.exists(y),
+        [False] + docArray + savArray + txtArray,
     ):
         i += 1
         iString = str(i).zfill(numberLength)
         [docArray, savArray, txtArray, csvArray] = makeNameArrays(
             numDifferent, tempName, iString, matchedPair
         )
-    return zip(docArray, savArray, txtArray, csvArray)
+    claimedFilenames.update(docArray + savArray + txtArray)
+    return list(zip(docArray, savArray, txtArray, csvArray))
 
 
-def replaceFragments(inFile_strings):
+fragmentRegex = r"""%file%(.*)%"""
+fragmentTags = [
+    "*" + tag + "*"
+    for tag in ["leaf", "random", "constant", "dependent"]
+    + ["end_leaf", "end_random", "end_constant", "end_dependent"]
+]
+
+
+class FragmentState:
     """
-    Replaces file fragment special text with the text from the fragment.
+    The state of inserting the file fragments into a template in a single pass.
     """
-    fragment_regex = r"""%file%(.*)%"""
-    num_fragments_replaced = 0
-    for line_number in range(len(inFile_strings) - 1, -1, -1):
-        match_object = re.match(fragment_regex, inFile_strings[line_number])
-        if match_object is not None:
-            num_fragments_replaced += 1
-            logging.info(
-                "Inserting file fragment, line #%d: %s",
-                line_number,
-                inFile_strings[line_number].rstrip("\n"),
-            )
-            if not os.path.isfile(match_object.group(1)):
-                logging.error(
-                    "Error! Found the tag for a file fragment, but was unable to find "
-                    "the file it names.\nThe tag is in line #%d: %s\nThe tag names the "
-                    'file "%s"...is it in the same directory as this program?  '
-                    "Is the filename spelled correctly?",
-                    line_number,
-                    inFile_strings[line_number],
-                    match_object.group(1),
-                )
-                return -62, "", ""
-            success, fragmentFile, encoding = openInputFile(match_object.group(1))
-            if not success:
-                logging.error(
-                    "Error! Found the tag for a file fragment, but was unable to open "
-                    "the file it names. The tag is in line #%d: %s\nThe tag names the "
-                    'file "%s"\nTo avoid this error, convert all the input files to a '
-                    "specific text encoding, e.g., utf-8.",
-                    line_number,
-                    inFile_strings[line_number],
-                    match_object.group(1),
-                )
-                return -63, "", ""
 
-            global globalInputEncodings
-            globalInputEncodings.append((match_object.group(1), encoding))
-            with (
-                fragmentFile
-            ):  # the file will be closed by the compound "with" statement
-                fragment_strings = fragmentFile.readlines()
+    def __init__(self):
+        self.outStrings = []  # the template, with the fragments inserted so far
+        self.fragments = {}  # fragment filename -> [encoding, lines of the leaves]
+        self.insertedFragments = []  # [depth, line number, filename] of each insert
+        self.activeFragments = []  # fragments being inserted, to detect loops
+        self.repeatingLabel = None  # most recent repeating Random section, for %next%
+        self.numInserted = 0
 
-            if fragment_strings[0].find("*fragment*") != 0:
-                logging.warning(
-                    '\nWarning! While updating the file fragment "%s" for line #%d: %s\n'
-                    'The file is supposed to start with "*fragment*" on the first '
-                    "line...are you sure this is a fragment?\n",
-                    match_object.group(1),
-                    line_number,
-                    inFile_strings[line_number],
-                )
-            # remove lines between leaves
-            outside_leaf = True
-            for line_number_fragment in range(len(fragment_strings) - 1, -1, -1):
-                currentLine = fragment_strings[line_number_fragment]
-                temp = currentLine.rstrip("\n").split(" ")
-                myText = temp[0]
-                if outside_leaf:
-                    if "*end_leaf*" in myText:
-                        outside_leaf = False
-                        continue
-                    fragment_strings = (
-                        fragment_strings[0:line_number_fragment]
-                        + fragment_strings[(line_number_fragment + 1) :]
-                    )
-                if not outside_leaf:
-                    if "*leaf*" in myText:
-                        outside_leaf = True
-
-            # march up to find the leaf to get the section ID, and determine how far up to remove
-            found_leaf = False
-            for i in range(line_number - 1, -1, -1):
-                currentLine = inFile_strings[i]
-                temp = currentLine.rstrip("\n").split(" ")
-                myText = temp[0]
-                if "*leaf*" in myText:
-                    found_leaf = True
-                    first_added_label = temp[1]
-                    leaf_line_number = i
-                    break
-            if not found_leaf:
-                logging.error(
-                    'Error! While updating the file fragment "%s" for line #%d: %s\n'
-                    "This program tried to find the enclosing *leaf* tag, but failed.",
-                    match_object.group(1),
-                    line_number,
-                    inFile_strings[line_number],
-                )
-                return -42, "", ""
 
-            # march down to find the end_leaf, and determine how far down to remove
-            found_end_leaf = False
+def replaceFragments(inFile_strings, inputEncodings):
+    """
+    Replaces file fragment special text with the text from the fragment, in a single pass over the template.
+
+    Fragments inside fragments are inserted as they are reached, each fragment file is read only once, and the labels (and %next% and *master* references) after each fragment are renumbered as the template is copied.
+    The encodings of the fragment files are appended to inputEncodings.
+    Returns the error code (negative on failure), the template with the fragments inserted, and the number of fragments inserted.
+    """
+    state = FragmentState()
+    labelShifts = {}  # parent label -> [[replaced leaf numbers], [total added]]
+    firstTagWithLabel = {}  # label -> index in state.outStrings of its first tag
+    pendingEndTags = {}  # parent label -> subsections to add to its end tag
+    leafStart = None  # [index in state.outStrings, label] of the latest *leaf*
+    line_number = 0
+    while line_number < len(inFile_strings):
+        currentLine = inFile_strings[line_number]
+        match_object = re.match(fragmentRegex, currentLine)
+        if (match_object is not None) and (leafStart is None):
+            logging.error(
+                'Error! While updating the file fragment "%s" for line #%d: %s\n'
+                "This program tried to find the enclosing *leaf* tag, but failed.",
+                match_object.group(1),
+                line_number,
+                currentLine,
+            )
+            return -42, "", ""
+        if match_object is not None:
+            # find the end of the enclosing leaf, unless a later fragment in the same leaf will replace it
+            end_leaf_line_number = None
             for i in range(line_number + 1, len(inFile_strings)):
-                currentLine = inFile_strings[i]
-                temp = currentLine.rstrip("\n").split(" ")
-                myText = temp[0]
-                if "*end_leaf*" in myText:
-                    found_end_leaf = True
-                    if first_added_label != temp[1]:
-                        logging.error(
-                            'Error! While updating the file fragment "%s" for line #%d: %s\n'
-                            "This program tried to find the enclosing *leaf* and *end_leaf* "
-                            "tags, but they had different labels: %s vs %s.  Is the "
-                            "template correct above and below the special text that inserts "
-                            "the file fragment?",
-                            match_object.group(1),
-                            line_number,
-                            inFile_strings[line_number],
-                            first_added_label,
-                            temp[1],
-                        )
-                        return -43, "", ""
+                if re.match(fragmentRegex, inFile_strings[i]) is not None:
+                    break
+                temp = inFile_strings[i].rstrip("\n").split(" ")
+                if "*end_leaf*" in temp[0]:
                     end_leaf_line_number = i
                     break
-            if not found_leaf:
+            else:
                 logging.error(
                     'Error! While updating the file fragment "%s" for line #%d: %s\n'
                     "This program tried to find the enclosing *end_leaf* tag, but "
                     "failed.",
                     match_object.group(1),
                     line_number,
-                    inFile_strings[line_number],
+                    currentLine,
                 )
                 return -44, "", ""
+        if (match_object is not None) and (end_leaf_line_number is not None):
+            [leaf_out_index, first_added_label] = leafStart
+            if (len(temp) < 2) or (first_added_label != temp[1]):
+                logging.error(
+                    'Error! While updating the file fragment "%s" for line #%d: %s\n'
+                    "This program tried to find the enclosing *leaf* and *end_leaf* "
+                    "tags, but they had different labels: %s vs %s.  Is the "
+                    "template correct above and below the special text that inserts "
+                    "the file fragment?",
+                    match_object.group(1),
+                    line_number,
+                    currentLine,
+                    first_added_label,
+                    inFile_strings[end_leaf_line_number].rstrip("\n"),
+                )
+                return -43, "", ""
 
-            # now fix all the section IDs in the fragment_strings...and the %next% special text
-            # first, what is the nearest parent repeating section, if any?
-            found_parent_repeating = False
-            for i in range(line_number - 1, -1, -1):
-                currentLine = inFile_strings[i]
-                temp = currentLine.rstrip("\n").split(" ")
-                myText = temp[0]
-                if ("*random*" in myText) and ("*repeat*" in currentLine):
-                    found_parent_repeating = True
-                    nextLabel = temp[1]
-                    break
-            num_added_sections = -1
-            myLabel = first_added_label
-            for i in range(len(fragment_strings)):
-                currentLine = fragment_strings[i]
-                temp = currentLine.rstrip("\n").split(" ")
-                myText = temp[0]
-                if "*leaf*" in myText:
-                    fragment_strings[i] = "*leaf* " + myLabel + "\n"
-                    continue
-                if "*end_leaf*" in myText:
-                    fragment_strings[i] = "*end_leaf* " + myLabel + "\n"
-                    myLabel_split = myLabel.split("-")
-                    myLabel_split[-1] = str(int(myLabel_split[-1]) + 1)
-                    myLabel = "-".join(myLabel_split)
-                    num_added_sections += 1
-                    continue
-                if "%next%" in currentLine:
-                    if not found_parent_repeating:
-                        logging.error(
-                            'Error! While updating the file fragment "%s" for line #%d: %s\n'
-                            "This program tried to replace the %%next%% special text, but "
-                            "the fragment does not appear after a repeating random section.  "
-                            "Inside a file fragment, the special text %%next%% will reference "
-                            "the most recent section that is both random and repeating.",
-                            match_object.group(1),
-                            line_number,
-                            inFile_strings[line_number],
-                        )
-                        return -45, "", ""
-                    fragment_strings[i] = fragment_strings[i].replace(
-                        "%next%", "%next%" + nextLabel + "%"
-                    )
-                    continue
+            # the fragment's leaves replace the whole enclosing leaf
+            del state.outStrings[leaf_out_index:]
+            if firstTagWithLabel.get(first_added_label, -1) >= leaf_out_index:
+                del firstTagWithLabel[first_added_label]
+            leafStart = None
+            logging.info(
+                "Inserting file fragment, line #%d: %s",
+                line_number,
+                currentLine.rstrip("\n"),
+            )
+            insertedLabel = shiftLabel(first_added_label, labelShifts)[0]
+            retval, numLeaves = insertFragment(
+                state,
+                match_object.group(1),
+                insertedLabel,
+                1,
+                line_number,
+                currentLine,
+            )
+            if retval < 0:
+                return retval, "", ""
+            num_added_sections = numLeaves - 1
 
-            # now find the enclosing constant or random section and fix its number of subsections
-            parentLabel_strings = myLabel.split("-")[0:-1]
-            parentLabel = "-".join(parentLabel_strings)
-            found_parent = False
-            for i in range(line_number):
-                currentLine = inFile_strings[i]
-                temp = currentLine.rstrip("\n").split(" ")
-                if (len(temp) > 1) and (temp[1] == parentLabel):
-                    found_parent = True
-                    temp[2] = str(int(temp[2]) + num_added_sections)
-                    inFile_strings[i] = " ".join(temp) + "\n"
-                    break
-            if not found_parent:
+            # fix the enclosing constant or random section's number of subsections
+            parentLabel = "-".join(first_added_label.split("-")[0:-1])
+            if parentLabel not in firstTagWithLabel:
                 logging.error(
                     'Error! While updating the file fragment "%s" for line #%d: %s\n\n'
                     "This program tried to correct the parent's number of subsections "
                     "(top, opening tag) but did not find the parent's ID: %s",
                     match_object.group(1),
                     line_number,
-                    inFile_strings[line_number],
+                    currentLine,
                     parentLabel,
                 )
                 return -46, "", ""
+            parentIndex = firstTagWithLabel[parentLabel]
+            temp = state.outStrings[parentIndex].rstrip("\n").split(" ")
+            shareFragmentWeight(
+                temp, int(temp[2]), int(insertedLabel.split("-")[-1]) - 1, numLeaves
+            )
+            temp[2] = str(int(temp[2]) + num_added_sections)
+            state.outStrings[parentIndex] = " ".join(temp) + "\n"
+            pendingEndTags[parentLabel] = (
+                pendingEndTags.get(parentLabel, 0) + num_added_sections
+            )
 
-            found_parent = False
-            for i in range(line_number, len(inFile_strings)):
-                currentLine = inFile_strings[i]
-                temp = currentLine.rstrip("\n").split(" ")
-                if (len(temp) > 1) and (temp[1] == parentLabel):
-                    found_parent = True
-                    temp[2] = str(int(temp[2]) + num_added_sections)
-                    inFile_strings[i] = " ".join(temp) + "\n"
-                    break
-            if not found_parent:
-                logging.error(
-                    'Error! While updating the file fragment "%s" for line #%d: %s\n'
-                    "This program tried to correct the parent's number of subsections "
-                    "(bottom, closing tag) but did not find the parent's ID: %s",
-                    match_object.group(1),
-                    line_number,
-                    inFile_strings[line_number],
-                    parentLabel,
-                )
-                return -47, "", ""
-
-            # work down through the inFile_strings and fix any sibling subsections
-            first_added_label_strings = first_added_label.split("-")
-            tags = ["leaf", "random", "constant", "dependent"]
-            tags.extend(["end_" + tag for tag in tags])
-            tags = ["*" + tag + "*" for tag in tags]
-            for i in range(end_leaf_line_number + 1, len(inFile_strings)):
-                currentLine = inFile_strings[i]
-                temp = currentLine.rstrip("\n").split(" ")
-                myText = temp[0]
-                if myText in tags:
-                    if len(temp) < 2:
+            # any later sibling subsections (and their subsections) are renumbered as they are copied
+            parentShifts = labelShifts.setdefault(parentLabel, [[], []])
+            leafNumber = int(first_added_label.split("-")[-1])
+            index = bisect.bisect_right(parentShifts[0], leafNumber)
+            parentShifts[0].insert(index, leafNumber)
+            parentShifts[1].insert(
+                index, (parentShifts[1][index - 1] if index > 0 else 0)
+            )
+            for i in range(index, len(parentShifts[1])):
+                parentShifts[1][i] += num_added_sections
+            line_number = end_leaf_line_number + 1
+            continue
+
+        temp = currentLine.rstrip("\n").split(" ")
+        myText = temp[0]
+        myLabel = temp[1] if len(temp) > 1 else None
+        if len(labelShifts) > 0:
+            if myText in fragmentTags:
+                if len(temp) < 2:
+                    logging.error(
+                        "Error! While inserting file fragments, this program is "
+                        "scanning through each line in the template, and expects to "
+                        "find an ID as the second token on this line #%d: %s\nbut "
+                        "there are only %d tokens on the line.",
+                        line_number,
+                        currentLine,
+                        len(temp),
+                    )
+                    return -48, "", ""
+                temp[1], shifted = shiftLabel(temp[1], labelShifts)
+                if myText == "*dependent*":
+                    if len(temp) < 5:
                         logging.error(
-                            'Error! While updating the file fragment "%s" for line #%d: %s\n'
-                            "This program is scanning through each line in the template, and "
-                            "expects to find an ID as the second token on this line "
-                            "#%d: %s\nbut there are only %d tokens on the line.",
-                            match_object.group(1),
+                            "Error! While inserting file fragments, this program is "
+                            "scanning through each line in the template, and expects "
+                            "to find the ID of the master section as the fifth token "
+                            "on this line #%d: %s\nbut there are only %d tokens on the "
+                            "line.",
                             line_number,
-                            inFile_strings[line_number],
-                            i,
                             currentLine,
                             len(temp),
                         )
-                        return -48, "", ""
-                    myLabel = temp[1]
-                    myLabel_strings = myLabel.split("-")
-                    if (
-                        len(myLabel_strings) > len(parentLabel_strings)
-                        and (
-                            all(
-                                [
-                                    myLabel_strings[j] == parentLabel_strings[j]
-                                    for j in range(len(parentLabel_strings))
-                                ]
-                            )
-                        )
-                        and (
-                            myLabel_strings[len(parentLabel_strings)]
-                            > first_added_label_strings[len(parentLabel_strings)]
-                        )
-                    ):
-                        myLabel_strings[len(parentLabel_strings)] = str(
-                            int(myLabel_strings[len(parentLabel_strings)])
-                            + num_added_sections
-                        )
-                        temp[1] = "-".join(myLabel_strings)
-                        inFile_strings[i] = " ".join(temp) + "\n"
-                    if myText == "*dependent*":
-                        if len(temp) < 5:
-                            logging.error(
-                                'Error! While updating the file fragment "%s" for line '
-                                "#%d: %s\nThis program is scanning through each line in the "
-                                "template, and expects to find the ID of the master section "
-                                "as the fifth token on this line #%d: %s\n"
-                                "but there are only %d tokens on the line.",
-                                match_object.group(1),
-                                line_number,
-                                inFile_strings[line_number],
-                                i,
-                                currentLine,
-                                len(temp),
-                            )
-                            return -49, "", ""
-                        master = temp[4]
-                        master_strings = master.split("-")
-                        if (
-                            len(master_strings) > len(parentLabel_strings)
-                            and (
-                                all(
-                                    [
-                                        master_strings[j] == parentLabel_strings[j]
-                                        for j in range(len(parentLabel_strings))
-                                    ]
-                                )
-                            )
-                            and (
-                                master_strings[len(parentLabel_strings)]
-                                > first_added_label_strings[len(parentLabel_strings)]
-                            )
-                        ):
-                            master_strings[len(parentLabel_strings)] = str(
-                                int(master_strings[len(parentLabel_strings)])
-                                + num_added_sections
-                            )
-                            temp[4] = "-".join(master_strings)
-                            inFile_strings[i] = " ".join(temp) + "\n"
-                else:
-                    if "%next%" in currentLine:
-                        next_strings = currentLine.split("%")
-                        for next_index in range(len(next_strings) - 1):
-                            if next_strings[next_index] == "next":
-                                myLabel = next_strings[next_index + 1]
-                                myLabel_strings = myLabel.split("-")
-                                if (
-                                    len(myLabel_strings) > len(parentLabel_strings)
-                                    and (
-                                        all(
-                                            [
-                                                myLabel_strings[j]
-                                                == parentLabel_strings[j]
-                                                for j in range(len(parentLabel_strings))
-                                            ]
-                                        )
-                                    )
-                                    and (
-                                        myLabel_strings[len(parentLabel_strings)]
-                                        > first_added_label_strings[
-                                            len(parentLabel_strings)
-                                        ]
-                                    )
-                                ):
-                                    myLabel_strings[len(parentLabel_strings)] = str(
-                                        int(myLabel_strings[len(parentLabel_strings)])
-                                        + num_added_sections
-                                    )
-                                    next_strings[next_index + 1] = "-".join(
-                                        myLabel_strings
-                                    )
-                        inFile_strings[i] = "%".join(next_strings)
-
-            inFile_strings = (
-                inFile_strings[0:leaf_line_number]
-                + fragment_strings
-                + inFile_strings[(end_leaf_line_number + 1) :]
-            )
-    return 1, inFile_strings, num_fragments_replaced
-
-
-def printCodebookToTempFile(inFile):
-    """
-    Prints the codebook to a temporary file.
-    """
-    global globalOutputEncoding
-    try:
-        tempFile = tempfile.TemporaryFile("w+t", encoding=globalOutputEncoding)
-    except:
-        logging.error(
-            "Error creating a temporary file to hold the codebook! Encoding is: %s",
-            globalOutputEncoding,
-        )
-        return -68, None
-    logging.debug("Saving codebook to temporary file.\n")
-    inFile.seek(0)
-    theLine = inFile.readline()  # skip gui version
-    theLine = inFile.readline()
-    makeCodeBook = True
-    startString = "%start%"
-    endString = "%end%"
-    currentString = "%current%"
-    currentPlusIntervalString = "%currentPlusInterval%"
-    print("Parent Section\tLeaf\tText", file=tempFile)
-    lineNumber = 2
-    while theLine:  # readline returns an empty string when it reaches EOF
-        currentLine = theLine
-        temp = currentLine.rstrip("\n").split(" ")
-        logging.debug("%s%s", currentLine, temp)
-        if len(temp) < 2:
-            logging.error(
-                "\nPortion of template (after inserting fragments), with line numbers:"
-            )
-            inFile.seek(0)
-            theLine = inFile.readline()
-            outputLineNumber = 1
-            while theLine:
-                if (outputLineNumber + 7 > lineNumber) and (
-                    lineNumber + 7 > outputLineNumber
-                ):
-                    logging.error("%d:%s", outputLineNumber, theLine)
-                theLine = inFile.readline()
-                outputLineNumber += 1
-            logging.error(
-                "\nError!  While reading through the template to print the codebook, "
-                "the software expected a start tag (e.g., *random* 3-2 4) on line "
-                "number %d (see print out with line numbers above) but got: %s\n"
-                "Make sure the lines (in the template file) that contain start tags "
-                "for Random and Constant and Dependent sections specify the correct "
-                "number of subsections listed after the label (following the second "
-                "space in the line), that each end tag is directly followed by either "
-                "a start tag or an end tag, that there are no blank lines in the "
-                "template file outside of Leaf sections, and that all fragments use "
-                'the start/end tag texts "*leaf*" and "*end_leaf*" exactly and with '
-                "no spaces on the same lines. Also look at the surrounding lines to "
-                "see if a fragment does not have the correct text for a start/end "
-                "tag.",
-                lineNumber,
-                currentLine,
-            )
-            return -38, tempFile
-
-        myText = temp[0]
-        myLabel = temp[1]
+                        return -49, "", ""
+                    temp[4], shiftedMaster = shiftLabel(temp[4], labelShifts)
+                    shifted = shifted or shiftedMaster
+                if shifted:
+                    currentLine = " ".join(temp) + "\n"
+            elif "%next%" in currentLine:
+                next_strings = currentLine.split("%")
+                for next_index in range(len(next_strings) - 1):
+                    if next_strings[next_index] == "next":
+                        next_strings[next_index + 1] = shiftLabel(
+                            next_strings[next_index + 1], labelShifts
+                        )[0]
+                currentLine = "%".join(next_strings)
+        if myText in fragmentTags:
+            if myLabel in pendingEndTags:
+                temp = currentLine.rstrip("\n").split(" ")
+                if len(temp) < 3:
+                    logging.error(
+                        "Error! While inserting file fragments, this program tried to "
+                        "correct the number of subsections in the end tag on line "
+                        "#%d, but the end tag does not list it: %s",
+                        line_number,
+                        currentLine,
+                    )
+                    return -47, "", ""
+                temp[2] = str(int(temp[2]) + pendingEndTags.pop(myLabel))
+                currentLine = " ".join(temp) + "\n"
+            if myLabel not in firstTagWithLabel:
+                firstTagWithLabel[myLabel] = len(state.outStrings)
+        if ("*random*" in myText) and ("*repeat*" in currentLine):
+            state.repeatingLabel = currentLine.rstrip("\n").split(" ")[1]
         if "*leaf*" in myText:
-            splitLabel = myLabel.split("-")
-            myParent = "-".join(splitLabel[:-1])
-            parentString = "v" + myParent.replace("-", "_")
-            if parentString == "v":
-                parentString = "-"
-            print(parentString + "\t" + splitLabel[-1] + "\t", file=tempFile, end="")
-            logging.debug("leaf text:")
-            retval = writeLeaf(
-                inFile,
-                tempFile,
-                currentLine,
-                myLabel,
-                startString,
-                endString,
-                currentString,
-                currentPlusIntervalString,
-                makeCodeBook,
-            )
-            if retval < 1:
-                return retval
-            lineNumber += retval
-            print("", file=tempFile)
-            if myParent == "":
-                break  # We've come to the end of the template...the top level section was a Leaf.
+            leafStart = [len(state.outStrings), myLabel]
+        state.outStrings.append(currentLine)
+        line_number += 1
 
-        if (
-            "*end_" in myText and myLabel == "1"
-        ):  # We've come to the end of the template
-            break
-        theLine = inFile.readline()
-        lineNumber += 1
+    for parentLabel in pendingEndTags:
+        logging.error(
+            "Error! While inserting file fragments, this program tried to correct "
+            "the parent's number of subsections (bottom, closing tag) but did not "
+            "find the parent's ID: %s",
+            parentLabel,
+        )
+        return -47, "", ""
 
-    return 1, tempFile
+    # record the encodings in the order the fragments used to be inserted, outermost and last first
+    for depth, position, fragmentFilename in sorted(
+        state.insertedFragments, key=lambda x: (x[0], -x[1])
+    ):
+        encodingPair = (fragmentFilename, state.fragments[fragmentFilename][0])
+        if encodingPair not in inputEncodings[1:]:
+            inputEncodings.append(encodingPair)
+    return 1, state.outStrings, state.numInserted
 
 
-def printCodebook(inFile, filename):
+def shareFragmentWeight(tagTokens, numChoices, choiceIndex, numLeaves):
     """
-    Prints the codebook, if it does not exist or has changed.
+    Replaces the *weights* weight of a sub-point that a file fragment replaced with an equal share of it for each of the fragment's leaves, so the fragment is chosen as often as the sub-point was.
+
+    tagTokens is the split start tag of the enclosing section, with numChoices sub-points before the fragment was inserted.  Weights that are missing or not numbers are left for parseRandomOptions to report.
     """
-    logging.info("Checking whether codebook already exists.")
+    if "*weights*" not in tagTokens:
+        return
+    first = tagTokens.index("*weights*") + 1 + choiceIndex
+    if (choiceIndex >= numChoices) or (
+        len(tagTokens) < first + numChoices - choiceIndex
+    ):
+        return
+    try:
+        weight = float(tagTokens[first])
+    except ValueError:
+        return
+    shares = [] if numLeaves == 0 else ["{:.15g}".format(weight / numLeaves)]
+    tagTokens[first : first + 1] = shares * numLeaves
 
-    returnVal, tempFile = printCodebookToTempFile(inFile)
-    if returnVal < 0:
-        return returnVal
 
-    # is this codebook the same as the latest one?
-    codebookPrefix = filename + "_codebook-"
-    prevCodebookNames = glob.glob(codebookPrefix + "*.xls")
-    saveCodebook = True
-    logging.info("\n")
-    if len(prevCodebookNames) == 0:
-        logging.info("No previous codebook was found in the folder.")
-    else:
-        latestCodebookName = max(prevCodebookNames, key=os.path.getmtime)
-        success, latestCodebook, encoding = openInputFile(latestCodebookName)
-        if not success:
-            logging.warning(
-                "\nWarning, failed to compare previous codebook with new codebook!  "
-                "Saving new codebook even though it might have the same content."
-            )
-        else:
-            saveCodebook = False
-            tempFile.flush()
-            tempFile.seek(0)
-            aLine = tempFile.readline()
-            while aLine:
-                if aLine != latestCodebook.readline():
-                    saveCodebook = True
-                    break
-                aLine = tempFile.readline()
-            if not saveCodebook:
-                # If the new set of leaf texts is exactly the same as before except missing lines at the end, the previous check won't find the difference.  We must compare the other way so a shortened codebook is noticed.
-                tempFile.seek(0)
-                latestCodebook.seek(0)
-                aLine = latestCodebook.readline()
-                while aLine:
-                    otherLine = tempFile.readline()
-                    if aLine != otherLine:
-                        saveCodebook = True
-                        break
-                    aLine = latestCodebook.readline()
-            latestCodebook.close()
-            if saveCodebook:
-                logging.warning(
-                    "\nWarning! The template does not match the latest codebook file: %s\n"
-                    "One (or both) of the template or the codebook have been modified.\n"
-                    "A new codebook file will be created for the files being generated "
-                    "now.",
-                    latestCodebookName,
-                )
-                input("Press return to continue")
+def shiftLabel(label, labelShifts):
+    """
+    Renumbers a label to account for the fragments inserted earlier in the template.
 
-    if saveCodebook:
-        codebookNumber = 1
-        while True:
-            codebookFilename = codebookPrefix + str(codebookNumber) + ".xls"
-            if not os.path.isfile(codebookFilename):
-                break
-            codebookNumber += 1
-        logging.info("Saving new codebook in a file named %s", codebookFilename)
-        try:
-            codebookFile = open(codebookFilename, "wt", encoding=globalOutputEncoding)
-        except IOError as e:
-            logging.error(
-                "\nError creating codebook file named %s\n%s", codebookFilename, e
-            )
-            return -52
-        tempFile.seek(0)
-        try:
-            shutil.copyfileobj(tempFile, codebookFile)
-        except UnicodeError:
-            logging.error(
-                "\nError! Failed to copy the codebook into the file due to encoding "
-                "issues.\n%s",
-                e,
+    Returns the new label, and whether a fragment was inserted before it in one of its enclosing sections.
+    """
+    labelStrings = label.split("-")
+    newLabelStrings = list(labelStrings)
+    shifted = False
+    for depth in range(len(labelStrings)):
+        parentShifts = labelShifts.get("-".join(labelStrings[:depth]))
+        if (parentShifts is None) or (not labelStrings[depth].isdigit()):
+            continue
+        index = bisect.bisect_left(parentShifts[0], int(labelStrings[depth]))
+        if index > 0:
+            shifted = True
+            newLabelStrings[depth] = str(
+                int(labelStrings[depth]) + parentShifts[1][index - 1]
             )
-            return -66
-
-        tempFile.close()
-        codebookFile.close()
-        logging.info("Done saving the codebook.\n")
-    else:
-        logging.info(
-            "The codebook for this template already exists in %s\n", latestCodebookName
-        )
-
-    return 1
+    return "-".join(newLabelStrings), shifted
 
 
-def createResumes(file_name, current_time):
+def insertFragment(state, fragmentFilename, firstLabel, depth, line_number, tagLine):
     """
-    Creates resumes from the template filename.
+    Appends the leaves of a file fragment to the template, labeled starting at firstLabel, and inserts any fragments inside those leaves.
+
+    Returns the error code (negative on failure) and the number of leaves appended.
     """
-    success, inFile, encoding = openInputFile(file_name)
-    if not success:
-        logging.error("\nError! Failed to open the template file!")
-        return -67
-    global globalInputEncodings
-    globalInputEncodings = [(file_name, encoding)]
-    matchedPair = False
-    guiVersion = inFile.readline()
-    guiVersion_text = " ".join(guiVersion.split(" ")[1:4])
-    if guiVersion_text.rstrip("\n") != "gui version number":
+    if fragmentFilename in state.activeFragments:
         logging.error(
-            "Error! The file selected as a template %s does not have the correct "
-            'text starting its first line: "%s gui version number"\n'
-            'Instead, the first line is "%s"',
-            file_name,
-            Version,
-            guiVersion,
+            'Error! The file fragment "%s" inserts itself, through this chain of '
+            "file fragments: %s\nThe tag is in line #%d: %s\nVerify that the file "
+            "fragments do not contain %%file%% special texts that reference each "
+            "other, causing an infinite loop.",
+            fragmentFilename,
+            " -> ".join(state.activeFragments + [fragmentFilename]),
+            line_number,
+            tagLine,
         )
-        return -53
-
-    for line in inFile:
-        if (
-            ("*matchDifferent*" in line)
-            or ("*matchSame*" in line)
-            or ("*matchOnlyOneEver*" in line)
-            or ("*matchMaxSelectionsPerSubPoint*" in line)
-        ):
-            matchedPair = True
-            break
-    numDifferent = 1
-    if matchedPair:
-        while True:
-            try:
-                numDifferent = int(
-                    input(
-                        'This template file contains random sections for Matched "pairs".  How many files should be matched in each batch? (0 to cancel) '
-                    )
+        return -72, 0
+    retval, fragment_strings = readFragment(
+        state, fragmentFilename, line_number, tagLine
+    )
+    if retval < 0:
+        return retval, 0
+    state.numInserted += 1
+    state.insertedFragments.append([depth, len(state.outStrings), fragmentFilename])
+    state.activeFragments.append(fragmentFilename)
+
+    myLabel_split = firstLabel.split("-")
+    labelNumber = int(myLabel_split[-1])
+    numLeaves = 0
+    leafStrings = []
+    for currentLine in fragment_strings:
+        temp = currentLine.rstrip("\n").split(" ")
+        myText = temp[0]
+        if "*leaf*" in myText:
+            state.outStrings.extend(leafStrings)
+            myLabel_split[-1] = str(labelNumber)
+            leafStrings = ["*leaf* " + "-".join(myLabel_split) + "\n"]
+            continue
+        if "*end_leaf*" in myText:
+            myLabel_split[-1] = str(labelNumber)
+            leafStrings.append("*end_leaf* " + "-".join(myLabel_split) + "\n")
+            fragmentLines = [
+                i
+                for i in range(len(leafStrings))
+                if re.match(fragmentRegex, leafStrings[i]) is not None
+            ]
+            if len(fragmentLines) == 0:
+                state.outStrings.extend(leafStrings)
+                numAdded = 1
+            else:
+                # the last fragment in the leaf replaces the whole leaf
+                nestedLine = leafStrings[fragmentLines[-1]]
+                logging.info(
+                    'Inserting file fragment from "%s": %s',
+                    fragmentFilename,
+                    nestedLine.rstrip("\n"),
                 )
-            except ValueError:
-                logging.warning("Please enter a positive integer.")
-                continue
-            if numDifferent < 1:
-                logging.warning("Canceled")
-                return -1
-            break
-
-    while True:
-        try:
-            if matchedPair:
-                numToMake = int(
-                    input(
-                        "How many batches of matched resumes should be generated? (0 to cancel) "
-                    )
+                retval, numAdded = insertFragment(
+                    state,
+                    re.match(fragmentRegex, nestedLine).group(1),
+                    "-".join(myLabel_split),
+                    depth + 1,
+                    line_number,
+                    nestedLine,
                 )
-            else:
-                numToMake = int(
-                    input("How many resumes should be generated? (0 to cancel) ")
+                if retval < 0:
+                    return retval, 0
+            leafStrings = []
+            labelNumber += numAdded
+            numLeaves += numAdded
+            continue
+        if "%next%" in currentLine:
+            if state.repeatingLabel is None:
+                logging.error(
+                    'Error! While updating the file fragment "%s" for line #%d: %s\n'
+                    "This program tried to replace the %%next%% special text, but "
+                    "the fragment does not appear after a repeating random section.  "
+                    "Inside a file fragment, the special text %%next%% will reference "
+                    "the most recent section that is both random and repeating.",
+                    fragmentFilename,
+                    line_number,
+                    tagLine,
                 )
-            break
-        except ValueError:
-            logging.warning("Please enter an integer.")
+                return -45, 0
+            currentLine = currentLine.replace(
+                "%next%", "%next%" + state.repeatingLabel + "%"
+            )
+        leafStrings.append(currentLine)
+    state.outStrings.extend(leafStrings)
+    state.activeFragments.pop()
+    return 1, numLeaves
+
+
+def readFragment(state, fragmentFilename, line_number, tagLine):
+    """
+    Reads the leaves of a file fragment, reading each fragment file only once.
+
+    Returns the error code (negative on failure) and the lines of the leaves in the fragment.
+    """
+    if fragmentFilename in state.fragments:
+        return 1, state.fragments[fragmentFilename][1]
+    if not os.path.isfile(fragmentFilename):
+        logging.error(
+            "Error! Found the tag for a file fragment, but was unable to find "
+            "the file it names.\nThe tag is in line #%d: %s\nThe tag names the "
+            'file "%s"...is it in the same directory as this program?  '
+            "Is the filename spelled correctly?",
+            line_number,
+            tagLine,
+            fragmentFilename,
+        )
+        return -62, None
+    success, fragmentFile, encoding = openInputFile(fragmentFilename)
+    if not success:
+        logging.error(
+            "Error! Found the tag for a file fragment, but was unable to open "
+            "the file it names. The tag is in line #%d: %s\nThe tag names the "
+            'file "%s"\nTo avoid this error, convert all the input files to a '
+            "specific text encoding, e.g., utf-8.",
+            line_number,
+            tagLine,
+            fragmentFilename,
+        )
+        return -63, None
+    with fragmentFile:  # the file will be closed by the compound "with" statement
+        fragment_strings = fragmentFile.readlines()
+
+    if (len(fragment_strings) == 0) or (fragment_strings[0].find("*fragment*") != 0):
+        logging.warning(
+            '\nWarning! While updating the file fragment "%s" for line #%d: %s\n'
+            'The file is supposed to start with "*fragment*" on the first '
+            "line...are you sure this is a fragment?\n",
+            fragmentFilename,
+            line_number,
+            tagLine,
+        )
+    # remove lines between leaves
+    outside_leaf = True
+    leaf_strings = []
+    for line_number_fragment in range(len(fragment_strings) - 1, -1, -1):
+        currentLine = fragment_strings[line_number_fragment]
+        temp = currentLine.rstrip("\n").split(" ")
+        myText = temp[0]
+        if outside_leaf:
+            if "*end_leaf*" in myText:
+                outside_leaf = False
+                leaf_strings.append(currentLine)
             continue
-    if numToMake < 1:
-        logging.warning("Canceled")
-        return -1
+        leaf_strings.append(currentLine)
+        if "*leaf*" in myText:
+            outside_leaf = True
+    leaf_strings.reverse()
+    state.fragments[fragmentFilename] = [encoding, leaf_strings]
+    return 1, leaf_strings
 
-    time_in_file_name = ""
-    withTime = input(
-        "\nWould you like the date & time in each resume filename? (Y/n, anything else to cancel) "
-    )
-    if (not withTime) or (withTime.lower() == "y") or (withTime.lower() == "yes"):
-        time_in_file_name = "_" + current_time
-    elif (withTime.lower() != "n") and (withTime.lower() != "no"):
-        logging.warning("Canceled")
-        return -1
-    logging.info("")
 
-    inFile.seek(0)
-    inFile_strings = inFile.readlines()
-    replaced_fragments = 1
-    num_fragments = -1
-    have_printed_warning = False
-    while replaced_fragments > 0:
-        num_fragments += replaced_fragments
-        if (num_fragments > 1000) and not have_printed_warning:
-            have_printed_warning = True
-            logging.warning(
-                "Warning! This program has so far replaced %d file fragments. Verify "
-                "that the file fragments do not contain %%file%% special texts that "
-                "reference each other, causing an infinite loop.",
-                num_fragments,
-            )
-            input("Press return to continue")
-        retval, inFile_strings, replaced_fragments = replaceFragments(inFile_strings)
-        if retval < 0:
-            return retval
+class DelayedWrite:
+    """
+    The text of a resume that is waiting to be written because it (or some text before it) contains %next% special text, whose value is not known until its Random section moves on to the next value.
+    """
 
-    global globalOutputEncoding
-    [filenames, encodings] = list(zip(*globalInputEncodings))
-    if num_fragments == 0:
-        globalOutputEncoding = encodings[0]
-        logging.info("")
-        if globalOutputEncoding != locale.getpreferredencoding():
-            logging.info(
-                "Saving the codebook and all other outputs in an encoding (%s) that "
-                "is not the system default (%s) because the template was encoded in "
-                "(%s).",
-                globalOutputEncoding,
-                locale.getpreferredencoding(),
-                globalOutputEncoding,
-            )
-        else:
-            logging.debug(
-                "Saving the codebook and all other outputs using system preferred "
-                "encoding (%s).",
-                globalOutputEncoding,
-            )
-    else:
-        inFile.close()
-        for encoding in encodings:
-            try:
-                inFile = tempfile.TemporaryFile("w+t", encoding=encoding)
-            except:
-                logging.error(
-                    "\nError! After inserting file fragments into the template, this "
-                    "program failed to create a temporary file to store the new "
-                    "template."
-                )
-                return -50
+    def __init__(self):
+        self.pieces = []  # text, or None for %next% special text not yet replaced
+        self.start = 0  # position (counting every piece ever delayed) of pieces[0]
+        self.flushed = 0  # position of the first piece not yet written
+        self.slots = (
+            {}
+        )  # label -> positions of its %next% special texts not yet replaced
+        self.pendingLabels = {}  # position -> label, for every piece that is None
 
-            success = True
-            try:
-                inFile.writelines(inFile_strings)
-            except UnicodeError:
-                success = False
 
-            if success:
-                globalOutputEncoding = encoding
-                break
+class LeafNode:
+    """
+    A Leaf section of a compiled template: the lines of text that it writes out.
+    """
 
-        # If none of the encodings work, try utf-8.
-        if not success:
-            logging.warning(
-                "Warning! Failed to encode the codebook with any of the encodings "
-                "used for the template and any fragment files: %s. Going to try utf-8.",
-                globalInputEncodings,
-            )
-            globalOutputEncoding = "utf-8"
-            try:
-                inFile = tempfile.TemporaryFile("w+t", encoding=globalOutputEncoding)
-            except:
-                logging.error(
-                    "\nError creating a utf-8 temporary file to hold the codebook!"
-                )
-                return -64
+    def __init__(self, label, startLine, lines):
+        self.label = label
+        self.startLine = startLine
+        self.lines = lines
+        self.pieces = compileLeafLines(lines)
+        # the plain text pieces already encoded in the output encoding, see encodeLeaves
+        self.encodedPieces = None
 
-            try:
-                inFile.writelines(inFile_strings)
-            except UnicodeError:
-                logging.error(
-                    "\nError! Failed to encode the codebook with any encoding (including "
-                    "utf-8).\nIf using fragment files, try converting all of the input "
-                    "files (i.e., the template and any fragments) into the same "
-                    "encoding."
-                )
-                return -65
 
-        if globalOutputEncoding != locale.getpreferredencoding():
-            logging.info(
-                "Saving the codebook and all other outputs in an encoding (%s) that "
-                "is not the system default (%s) because the template and/or fragment "
-                "files used a different encoding.",
-                globalOutputEncoding,
-                locale.getpreferredencoding(),
-            )
-        else:
-            logging.debug(
-                "Saving the codebook and all other outputs using system preferred "
-                "encoding (%s).",
-                globalOutputEncoding,
-            )
+class LeafLine:
+    """
+    A line of a Leaf section that contains special text, split into literal text and the slots (indexes into leafSpecialTexts) of the special texts it uses.
+    """
 
-    inFile.seek(0)
-    inFile_strings = (
-        inFile.readlines()
-    )  # This looks extraneous...the strings haven't changed since they were loaded, they were just written to a TemporaryFile.
+    def __init__(self, text, segments, requiredSlots, hasNext, usesMemory):
+        self.text = text
+        self.segments = segments
+        self.requiredSlots = requiredSlots
+        self.hasNext = hasNext
+        self.usesMemory = usesMemory
 
-    returnVal = printCodebook(inFile, file_name)
-    if returnVal < 0:
-        return returnVal
 
-    inFile.seek(0)
-    global globalThisResumeNumber
-    global globalThisResumeNumberString
-    global globalThisResumeNumberPaddedString
-    global globalBatchString
-    global globalBatchPaddedString
-    global globalNumberOfBatchesString
-    global globalNumberOfResumesPerBatchString
-    global globalResumeCountOverBatchesString
-    global globalResumeCountOverBatchesPaddedString
-    global globalTotalNumberOfResumesString
-    globalNumberOfBatchesString = str(numToMake)
-    globalNumberOfResumesPerBatchString = str(numDifferent)
-    globalTotalNumberOfResumesString = str(numToMake * numDifferent)
-    global globalResume
-    resumeCountOverBatches = 0
-    dfAllChoices = pandas.DataFrame()
-    for batchOfResumes in range(numToMake):
-        filenames = createFilenames(
-            file_name,
-            time_in_file_name,
-            len(str(numToMake)),
-            numDifferent,
-            matchedPair,
-            batchOfResumes + 1,
-        )
-        dictionaryMatchSame = {}
-        dictionaryMatchDifferent = {}
-        dictionaryMatchOnlyOneEver = {}
-        dictionaryMaxSelectionsPerSubPoint = {}
-        globalThisResumeNumber = 0
-        globalBatchString = str(batchOfResumes + 1)
-        globalBatchPaddedString = globalBatchString.zfill(
-            len(globalNumberOfBatchesString)
-        )
-        for [
-            outputFilename,
-            saveChoicesFilename,
-            txtChoicesFilename,
-            csvChoicesFilename,
-        ] in filenames:
-            globalThisResumeNumber += 1
-            globalThisResumeNumberString = str(globalThisResumeNumber)
-            globalThisResumeNumberPaddedString = globalThisResumeNumberString.zfill(
-                len(globalNumberOfResumesPerBatchString)
-            )
-            resumeCountOverBatches += 1
-            globalResumeCountOverBatchesString = str(resumeCountOverBatches)
-            globalResumeCountOverBatchesPaddedString = (
-                globalResumeCountOverBatchesString.zfill(
-                    len(globalTotalNumberOfResumesString)
-                )
-            )
-            saveChoicesFile = open(
-                saveChoicesFilename, "wt", encoding=globalOutputEncoding
-            )
-            print(
-                outputFilename + " is the text file that these choices created.",
-                file=saveChoicesFile,
-            )
-            print(file_name + " is the template file being used.", file=saveChoicesFile)
-            print(
-                current_time
-                + " is the current time as year, month, day, hour (out of 24), minute, second.",
-                file=saveChoicesFile,
-            )
-            print(
-                str(Version) + " is the version of the Python program.",
-                file=saveChoicesFile,
-            )
-            print(guiVersion.rstrip("\n"), file=saveChoicesFile)
-            print(
-                str(numDifferent) + " is the number of text files being Matched.",
-                file=saveChoicesFile,
-            )
-            print(
-                globalThisResumeNumberString
-                + " is the index of this text file within a matched set.",
-                file=saveChoicesFile,
-            )
-            print(
-                "Read the following lines in pairs.  The first line is the start tag (from the template file) that required a choice.  The start tag line contains the type of section that required a decision (currently only 'Random' sections require decisions), then the label of this section as shown in the outline in the web-based meta-program, then the number of subsections to choose from, and then any settings for this section (e.g., repeating or matched files).  The second line is the index of the subsection that was randomly chosen.  The indices run from 0 through n-1, inclusive, where n is the number of choices listed in the start tag line.  All of the choices are also stored in the .txt file, and in the .csv file with variable names based on the section IDs.",
-                file=saveChoicesFile,
-            )
-            txtChoicesFile = open(
-                txtChoicesFilename, "wt", encoding=globalOutputEncoding
-            )
-            print(outputFilename, file=txtChoicesFile, end="")
-            csvChoicesFile = open(
-                csvChoicesFilename, "wt", encoding=globalOutputEncoding
-            )
-            global globalCsvNames, globalCsvData
-            globalCsvNames = "filename,batch,numberOfBatches,resume,numberOfResumesPerBatch,yearMonthDayHourMinuteSecond"
-            globalCsvData = outputFilename
-            if "," in globalCsvData:
-                globalCsvData.replace(",", "")
-                logging.warning(
-                    "\nWarning! the filename contained a comma, which is a delimiter in "
-                    "csv (comma-separated-variables) files.  So in the csv file (and "
-                    "only inside the csv file), the comma has been removed from the "
-                    "filename.\n\n"
-                )
-            globalCsvData += (
-                ","
-                + globalBatchString
-                + ","
-                + globalNumberOfBatchesString
-                + ","
-                + globalThisResumeNumberString
-                + ","
-                + globalNumberOfResumesPerBatchString
-                + ","
-                + current_time
-            )
-            outputFile = open(outputFilename, "wt", encoding=globalOutputEncoding)
-            # reset the store/recall variables for each file
-            global globalMemory
-            globalMemory = {}
-            global globalDictRangeChoices
-            globalDictRangeChoices = {}
-            inFile.seek(0)
-            inFile.readline()  # skip gui version
-            retval = recursiveGenerate(
-                inFile,
-                outputFile,
-                saveChoicesFile,
-                txtChoicesFile,
-                "",
-                {},
-                {},
-                dictionaryMatchSame,
-                dictionaryMatchDifferent,
-                dictionaryMatchOnlyOneEver,
-                dictionaryMaxSelectionsPerSubPoint,
-                "",
-                "",
-                "",
-                "",
-                {},
-            )
-            if (retval >= 0) and (len(globalDelayedWrite) > 0):
-                logging.error(
-                    'Error! A Leaf contains special text that refers to the "next" '
-                    "value of a repeating section, but the section to which it refers "
-                    "is not repeating:\n%s",
-                    globalDelayedWrite[0],
-                )
-                retval = -40
-            outputFile.close()
-            if retval < 0:
-                print(
-                    str(retval)
-                    + " is the error code...this template file had a problem",
-                    file=saveChoicesFile,
-                )
-                print("\t" + str(retval), file=txtChoicesFile)
-                print(
-                    "\nError! Problem with the template file.  Error code "
-                    + str(retval)
-                )
-                saveChoicesFile.close()
-                txtChoicesFile.close()
-                csvChoicesFile.close()
-                return retval
-            saveChoicesFile.close()
-            txtChoicesFile.close()
-            csvChoicesFile.writelines([globalCsvNames, "\n", globalCsvData])
-            csvChoicesFile.close()
-            dfGlobal = pandas.read_csv(
-                io.StringIO("\n".join([globalCsvNames, globalCsvData]))
-            )
-            dfAllChoices = pandas.concat(
-                [dfAllChoices, dfGlobal], ignore_index=True, sort=False
-            )
-            logging.info("Done with resume %s", outputFilename)
-
-    sortedColumns = dfAllChoices.columns.values.tolist()
-    sortedColumns.sort(key=sortColumnName)
-    firstColumns = [
-        "filename",
-        "batch",
-        "numberOfBatches",
-        "resume",
-        "numberOfResumesPerBatch",
-        "yearMonthDayHourMinuteSecond",
-    ]
-    newColumns = firstColumns + [
-        col for col in sortedColumns if col not in firstColumns
-    ]
-    dfAllChoices = dfAllChoices[newColumns]
-    collatedFilename = file_name[:-4] + "_collated_" + current_time + ".csv"
-    logging.info("Saving the collated data in a file named %s", collatedFilename)
-    dfAllChoices.to_csv(collatedFilename, index=False)
-    inFile.close()
-    return 1
+class ConstantNode:
+    """
+    A Constant section of a compiled template: every subsection is written out, in order.
+    """
 
+    def __init__(self, label, startLine, children):
+        self.label = label
+        self.startLine = startLine
+        self.children = children
 
-def sortColumnName(text):
+
+class RandomNode:
     """
-    Given a column name in the collated csv, returns a key for sorting.
+    A Random section of a compiled template, with its start tag options already parsed.
     """
-    result = [text]
-    if len(text) > 2 and text[0:3] == "v1_":
-        # If it is a section id, separate the numbers from the underscores and "iter"
-        result = ["v"]
-        split = text[1:].split("_")
-        for token in split:
-            if token.startswith("iter"):
-                token = token[4:]
-            number = json.loads(token)
-            result.append(number)
-    return result
+
+    def __init__(self, label, startLine, numChoices, options, children):
+        self.label = label
+        self.startLine = startLine
+        self.numChoices = numChoices
+        self.options = options
+        self.children = children
 
 
-def skipElement(inFile, currentLine):
+class DependentNode:
     """
-    Skips an element in the template file, based on finding an end tag that matches the start tag on the next readline().
+    A Dependent section of a compiled template, which follows the choice of its master Random section.
     """
-    theLine = inFile.readline()
-    if theLine == "":
-        logging.error(
-            "\nError!  The skipElement function reached the end of the file "
-            "unexpectedly.\nThe program chose which subsection to follow for the "
-            "Random or Dependent section on this line: %s\nThe program was trying "
-            "to move down in the template file to that subsection, but did not find "
-            "it before reaching the end of the file.  Make sure the line above has "
-            "the correct number of subsections listed after the label (following "
-            "the second space in the line).  Make sure each subsection has a "
-            "correct start tag (e.g., *leaf* 1-3-2) and end tag (e.g., "
-            "*end_leaf* 1-3-2) in the template file.",
-            currentLine,
-        )
-        return -2
-    currentLine = theLine
-    splitLine = currentLine.split(" ")
-    if len(splitLine) < 2:
-        logging.error(
-            "\nError!  The skipElement function expected a start tag (e.g., "
-            "*random* 1-3-2 4) but got: %s\nThe program chose which subsection to "
-            "follow for a Random or Dependent section, and was trying to move down "
-            "in the template file to that subsection, but the template was not "
-            "correctly formed.\nMake sure each start tag is followed by the correct "
-            "end tag, that each end tag is directly followed by either a start tag "
-            "or an end tag, and that there are no blank lines in the template file "
-            "outside of Leaf sections.",
-            currentLine,
-        )
-        return -3
-    endTag = "*end_" + splitLine[0][1:] + " " + splitLine[1].rstrip("\n") + " "
-    next_line = ""
-    while not endTag in next_line:
-        next_line = inFile.readline()
-        if not next_line:  # readline returns an empty string when it reaches EOF
-            logging.error(
-                "\nError!  The skipElement function reached the end of the file "
-                "unexpectedly while looking for the stop tag for: %s\nThe program "
-                "chose which subsection to follow for a Random or Dependent section, "
-                "and was trying to move down in the template file to that subsection, "
-                "but the template was not correctly formed.\nMake sure that the stop "
-                "tag exists in the template file (e.g., *end_random* 1-3-2)",
-                currentLine,
-            )
-            return -4
-        next_line = next_line.rstrip("\n") + " "
-    return 1
 
+    def __init__(self, label, startLine, numChoices, masterLabel, children):
+        self.label = label
+        self.startLine = startLine
+        self.numChoices = numChoices
+        self.masterLabel = masterLabel
+        self.children = children
 
-def recursiveGenerate(
-    inFile,
-    outFile,
-    saveChoicesFile,
-    txtChoicesFile,
-    myVariableName,
-    dictionaryRepeatSame,
-    dictionaryRepeatNever,
-    dictionaryMatchSame,
-    dictionaryMatchDifferent,
-    dictionaryMatchOnlyOneEver,
-    dictionaryMaxSelectionsPerSubPoint,
-    startString,
-    endString,
-    currentString,
-    currentPlusIntervalString,
-    dictionaryLastChoice,
-):
+
+class RandomOptions:
     """
-    Recersively generates a 'resume' file, making all decisions and generating all outputs.
+    The settings from a Random section's start tag (e.g., *repeat*, *matchSame*).
     """
 
-    theLine = inFile.readline()
-    if not theLine:  # readline returns an empty string when it reaches EOF
-        logging.error(
-            "\nError!  The recursiveGenerate function was looking for a new section "
-            "when it reached the end of the file unexpectedly.  It expected to find "
-            "a start tag (e.g., *random* 1-3-1 7).\nMake sure the lines (in the "
-            "template file) that contain start tags for Random and Constant and "
-            "Dependent sections specify the correct number of subsections listed "
-            "after the label (following the second space in the line).  Why did the "
-            "function not find an end tag as the last line in the file?"
-        )
-        return -5
-    currentLine = theLine
-    logging.debug(currentLine)
-    temp = currentLine.rstrip("\n").split(" ")
-    if len(temp) < 2:
-        logging.error(
-            "\nError!  The recursiveGenerate function was looking for a new section "
-            "and expected a start tag (e.g., *random* 3-2 4) but got: %s\nMake sure "
-            "the lines (in the template file) that contain start tags for Random "
-            "and Constant and Dependent sections specify the correct number of "
-            "subsections listed after the label (following the second space in the "
-            "line), that each end tag is directly followed by either a start tag or "
-            "an end tag, and that there are no blank lines in the template file "
-            "outside of Leaf sections.",
-            currentLine,
-        )
-        return -6
-    myText = temp[0]
-    myLabel = temp[1]
-    if not myVariableName:
-        myVariableName = myLabel
-    myNumChoices = ""
-    if ("*random*" in myText) or ("*constant*" in myText) or ("*dependent*" in myText):
-        if len(temp) < 3:
-            logging.error(
-                "\nError!  The recursiveGenerate function found a non-Leaf start tag, "
-                "but the start tag did not contain the number of subsections: %s\n"
-                "The start tags for Random and Constant and Dependent sections should "
-                "list the type of the section, then a space, then the label for the "
-                "section, then a space, then the number of the subsections.  (e.g., "
-                "*random* 1-1-5-6 8)",
-                currentLine,
-            )
-            return -7
-        temp[2] = temp[2].rstrip("\n")
-        if temp[2].isdigit() == False:
-            logging.error(
-                "\nError!  The recursiveGenerate function found a non-Leaf start tag, "
-                "for which the number of subsections should be the second item, but "
-                "on this line that is not a number: %s\nThe start tags for Random and "
-                "Constant and Dependent sections should list the type of the section, "
-                "then a space, then the label for the section, then a space, then the "
-                "number of the subsections (e.g., *random* 1-1-5-6 8).",
-                currentLine,
-            )
-            return -8
-        myNumChoices = int(temp[2])
+    def __init__(self):
+        self.repeat = False
+        self.repeatStart = 0
+        self.repeatEnd = 0
+        self.repeatInterval = 0
+        self.repeatRange = []
+        self.repeatSame = False
+        self.repeatNever = False
+        self.repeatNoDoubles = False
+        self.repeatDifferentDouble = False
+        self.repeatDifferentDoublePercentage = 0
+        self.matchMaxSelectionsPerSubPoint = False
+        self.maxSelectionsPerSubPointInteger = 0
+        self.nonUniformFirstSubPoint = False
+        self.nonUniformFirstSubPointPercentage = 0
+        self.weights = None
+        self.aliasTable = None
+        self.zeroWeights = 0
+        self.matchSame = False
+        self.matchDifferent = False
+        self.matchOnlyOneEver = False
+        self.minimumNumberOfEntries = 0
+        self.maximumNumberOfEntries = 0
+
+
+def parseRandomOptions(temp, myLabel, currentLine):
+    """
+    Parses the settings listed after the number of subsections in a Random section's start tag.
 
-    makeCodeBook = False
-    if "*leaf*" in myText:
-        return writeLeaf(
-            inFile,
-            outFile,
-            currentLine,
-            myLabel,
-            startString,
-            endString,
-            currentString,
-            currentPlusIntervalString,
-            makeCodeBook,
-        )
-
-    if "*random*" in myText:
-        return writeRandom(
-            temp,
-            inFile,
-            myVariableName,
-            myNumChoices,
-            currentLine,
-            saveChoicesFile,
-            txtChoicesFile,
-            outFile,
-            myLabel,
-            dictionaryRepeatSame,
-            dictionaryRepeatNever,
-            dictionaryMatchSame,
-            dictionaryMatchDifferent,
-            dictionaryMatchOnlyOneEver,
-            dictionaryMaxSelectionsPerSubPoint,
-            startString,
-            endString,
-            currentString,
-            currentPlusIntervalString,
-            dictionaryLastChoice,
-        )
-
-    if "*dependent*" in myText:
-        return writeDependent(
-            temp,
-            inFile,
-            myVariableName,
-            myNumChoices,
-            currentLine,
-            saveChoicesFile,
-            txtChoicesFile,
-            outFile,
-            myLabel,
-            dictionaryRepeatSame,
-            dictionaryRepeatNever,
-            dictionaryMatchSame,
-            dictionaryMatchDifferent,
-            dictionaryMatchOnlyOneEver,
-            dictionaryMaxSelectionsPerSubPoint,
-            startString,
-            endString,
-            currentString,
-            currentPlusIntervalString,
-            dictionaryLastChoice,
-        )
-
-    if "*constant*" in myText:
-        return writeConstant(
-            myNumChoices,
-            myLabel,
-            currentLine,
-            inFile,
-            outFile,
-            saveChoicesFile,
-            txtChoicesFile,
-            myVariableName,
-            dictionaryRepeatSame,
-            dictionaryRepeatNever,
-            dictionaryMatchSame,
-            dictionaryMatchDifferent,
-            dictionaryMatchOnlyOneEver,
-            dictionaryMaxSelectionsPerSubPoint,
-            startString,
-            endString,
-            currentString,
-            currentPlusIntervalString,
-            dictionaryLastChoice,
-        )
-
-    logging.error(
-        "\nError!  The recursiveGenerate function found a start tag that it does "
-        "not recognize: %s\nThe recognizable start tags are *leaf*, *random*, "
-        "*dependent*, and *constant*.  If the line above is not supposed to be a "
-        "start tag, make sure in the template file it is not directly after a "
-        "start tag for a Random or Constant or Dependent section, and that it "
-        "does not directly follow an end tag.",
-        currentLine,
-    )
-    return -9
-
-
-def writeLeaf(
-    inFile,
-    outFile,
-    currentLine,
-    myLabel,
-    startString,
-    endString,
-    currentString,
-    currentPlusIntervalString,
-    makeCodeBook,
-):
-    """
-    Writes out the text in a Leaf section.
-    """
-
-    theLine = inFile.readline()
-    lineNumber = 1
-    if not theLine:  # readline returns an empty string when it reaches EOF
-        logging.error(
-            "\nError!  The last line in the file is %s\nSo there is no "
-            "*end_leaf* for that tag.",
-            currentLine,
-        )
-        return -10
-    firstRun = True
-    global globalThisResumeNumberString
-    global globalThisResumeNumberPaddedString
-    global globalBatchString
-    global globalBatchPaddedString
-    global globalNumberOfBatchesString
-    global globalNumberOfResumesPerBatchString
-    global globalResumeCountOverBatchesString
-    global globalResumeCountOverBatchesPaddedString
-    global globalTotalNumberOfResumesString
-    while not "*end_leaf* " + myLabel in theLine + " ":
-        if firstRun:
-            firstRun = False
-            myLineBreak = ""
-        else:
-            myLineBreak = "\n"
-        if (
-            (("%start%" in theLine) and (startString == ""))
-            or (("%end%" in theLine) and (endString == ""))
-            or (("%current%" in theLine) and (currentString == ""))
-            or (
-                ("%currentPlusInterval%" in theLine)
-                and (currentPlusIntervalString == "")
-            )
-            or (("%next%" in theLine) and (startString == ""))
-        ):
-            logging.error(
-                "\nError!  In section %s, this line contains a special text "
-                "(%%start%%, %%end%%, %%current%%, %%currentPlusInterval%%, or "
-                "%%next%%), but it is not inside a Random section that Repeats:\n%s",
-                myLabel,
-                theLine,
-            )
-            return -29
-        tempString = myLineBreak + theLine.rstrip("\n")
-        if makeCodeBook:
-            logging.debug("%s", tempString.replace("\n", " ").replace("\t", " "))
-            print(
-                tempString.replace("\n", " ").replace("\t", " "), file=outFile, end=""
-            )
-        else:
-            tempString = (
-                tempString.replace("%start%", startString)
-                .replace("%end%", endString)
-                .replace("%current%", currentString)
-                .replace("%currentPlusInterval%", currentPlusIntervalString)
-                .replace("%batch%", globalBatchString)
-                .replace("%batchpadded%", globalBatchPaddedString)
-                .replace("%numberofbatches%", globalNumberOfBatchesString)
-                .replace("%resume%", globalThisResumeNumberString)
-                .replace("%resumepadded%", globalThisResumeNumberPaddedString)
-                .replace(
-                    "%numberofresumesperbatch%", globalNumberOfResumesPerBatchString
-                )
-                .replace("%resumecountoverbatches%", globalResumeCountOverBatchesString)
-                .replace(
-                    "%resumecountoverbatchespadded%",
-                    globalResumeCountOverBatchesPaddedString,
-                )
-                .replace("%totalnumberofresumes%", globalTotalNumberOfResumesString)
-            )
-            global globalMemory
-            if "%store%" in tempString:
-                tempString_strings = tempString.split("%")
-                for temp_index in range(len(tempString_strings) - 3, -1, -1):
-                    # must check length of the list because if the line only contains store commands they will all be stripped out, and the list will be empty on the last iteration (when temp_index is 0)
-                    if (len(tempString_strings) > temp_index) and (
-                        tempString_strings[temp_index] == "store"
-                    ):
-                        tempString_strings[temp_index + 2] = (
-                            tempString_strings[temp_index + 2]
-                            .replace("\\n", "\n")
-                            .replace("\\t", "\t")
-                        )
-                        globalMemory[
-                            tempString_strings[temp_index + 1]
-                        ] = tempString_strings[temp_index + 2]
-                        logging.debug(
-                            "%%store%% special text.  %s --> %s",
-                            tempString_strings[temp_index + 1],
-                            tempString_strings[temp_index + 2],
-                        )
-                        # if the store special text comes at the beginning or end of the line, it will leave an empty string when splitting, which will make a '%' when joining
-                        start_index = temp_index
-                        if (temp_index == 1) and (tempString_strings[0] == ""):
-                            start_index = temp_index - 1
-                        end_index = temp_index + 3
-                        if (temp_index == len(tempString_strings) - 4) and (
-                            tempString_strings[temp_index + 3] == ""
-                        ):
-                            end_index = temp_index + 4
-                        tempString_strings = (
-                            tempString_strings[:start_index]
-                            + tempString_strings[end_index:]
-                        )
-                tempString = "%".join(tempString_strings)
-            if "%recall%" in tempString:
-                tempString_strings = tempString.split("%")
-                for temp_index in range(len(tempString_strings) - 2, -1, -1):
-                    if tempString_strings[temp_index] == "recall":
-                        try:
-                            tempString = (
-                                "%".join(tempString_strings[:temp_index])
-                                + globalMemory[tempString_strings[temp_index + 1]]
-                                + "%".join(tempString_strings[temp_index + 2 :])
-                            )
-                            logging.debug(
-                                "%%recall%% special text.  %s --> %s",
-                                tempString_strings[temp_index + 1],
-                                globalMemory[tempString_strings[temp_index + 1]],
-                            )
-                        except KeyError:
-                            logging.error(
-                                "\nError!  In section %s, this line contains a special text "
-                                '(%%recall%%), but the variable being recalled "%s" has not '
-                                "been stored (using %%store%%):\n%s",
-                                myLabel,
-                                tempString_strings[temp_index + 1],
-                                theLine,
-                            )
-                            return -34
-                        tempString_strings = tempString.split("%")
-                tempString = "%".join(tempString_strings)
-            global globalDelayedWrite
-            if len(globalDelayedWrite) > 0 or "%next%" in tempString:
-                globalDelayedWrite += [tempString]
-            else:
-                print(tempString, file=outFile, end="")
-        theLine = inFile.readline()
-        lineNumber += 1
-        if not theLine:  # readline returns an empty string when it reaches EOF
-            logging.error(
-                "\nError!  Could not find *end_leaf* %s\nThe program was processing a "
-                "Leaf section and never found the end tag for that section.  Make "
-                "sure the end tag is in the file.",
-                myLabel,
-            )
-            return -11
-
-    return lineNumber
-
-
-def writeConstant(
-    myNumChoices,
-    myLabel,
-    currentLine,
-    inFile,
-    outFile,
-    saveChoicesFile,
-    txtChoicesFile,
-    myVariableName,
-    dictionaryRepeatSame,
-    dictionaryRepeatNever,
-    dictionaryMatchSame,
-    dictionaryMatchDifferent,
-    dictionaryMatchOnlyOneEver,
-    dictionaryMaxSelectionsPerSubPoint,
-    startString,
-    endString,
-    currentString,
-    currentPlusIntervalString,
-    dictionaryLastChoice,
-):
-    """
-    Writes out a Constant section, calling recursiveGenerate.
-    """
-
-    for i in range(myNumChoices):
-        retval = recursiveGenerate(
-            inFile,
-            outFile,
-            saveChoicesFile,
-            txtChoicesFile,
-            myVariableName + "-" + str(i + 1),
-            dictionaryRepeatSame,
-            dictionaryRepeatNever,
-            dictionaryMatchSame,
-            dictionaryMatchDifferent,
-            dictionaryMatchOnlyOneEver,
-            dictionaryMaxSelectionsPerSubPoint,
-            startString,
-            endString,
-            currentString,
-            currentPlusIntervalString,
-            dictionaryLastChoice,
-        )
-        if retval < 0:
-            return retval
-    theLine = inFile.readline()
-    if not theLine:  # readline returns an empty string when it reaches EOF
-        logging.error(
-            "\nError!  Reached the end of the file looking for the *end_constant* "
-            "corresponding to this start tag %s\nThe program was processing a "
-            "Constant section and had finished going through the subsections but in "
-            "doing so it got to the end of the file.  Make sure the end tag is in "
-            "the correct place and that the Constant section has the correct number "
-            "of subsections.",
-            currentLine,
-        )
-        return -12
-    if "*end_constant*" + myLabel + " " in theLine:
-        logging.error(
-            "\nError!  While processing a Constant section, and after processing the "
-            "subsections, the next line was not *end_constant* corresponding to "
-            "this start tag %s\nMake sure the end tag is in the correct location "
-            "and that the Constant section has the correct number of subsections.",
-            currentLine,
-        )
-        return -13
-    return 1
-
-
-def writeRandom(
-    temp,
-    inFile,
-    myVariableName,
-    myNumChoices,
-    currentLine,
-    saveChoicesFile,
-    txtChoicesFile,
-    outFile,
-    myLabel,
-    dictionaryRepeatSame,
-    dictionaryRepeatNever,
-    dictionaryMatchSame,
-    dictionaryMatchDifferent,
-    dictionaryMatchOnlyOneEver,
-    dictionaryMaxSelectionsPerSubPoint,
-    startString,
-    endString,
-    currentString,
-    currentPlusIntervalString,
-    dictionaryLastChoice,
-):
-    """
-    Writes out a Random section, calling enterRandomSection.
-    """
+    Returns the error code (negative on failure) and a RandomOptions.
+    """
 
     repeat = False
     repeatSame = False
@@ -1676,6 +928,7 @@ def writeRandom(
     maxSelectionsPerSubPointInteger = 0
     nonUniformFirstSubPoint = False
     nonUniformFirstSubPointPercentage = 0
+    weights = None
     matchSame = False
     matchDifferent = False
     matchOnlyOneEver = False
@@ -1698,7 +951,7 @@ def writeRandom(
                         myLabel,
                         temp[countSplit + 1],
                     )
-                    return -30
+                    return -30, None
             try:
                 repeatEnd = int(temp[countSplit + 2])
             except ValueError:
@@ -1712,7 +965,7 @@ def writeRandom(
                         myLabel,
                         temp[countSplit + 2],
                     )
-                    return -31
+                    return -31, None
             try:
                 repeatInterval = int(temp[countSplit + 3])
             except ValueError:
@@ -1726,7 +979,7 @@ def writeRandom(
                         myLabel,
                         temp[countSplit + 3],
                     )
-                    return -32
+                    return -32, None
             if repeatInterval == 0:
                 logging.error(
                     '\nError!  For Repeating section "%s", the interval value "%s" '
@@ -1734,7 +987,7 @@ def writeRandom(
                     myLabel,
                     temp[countSplit + 3],
                 )
-                return -61
+                return -61, None
         elif temp[countSplit] == "*repeatSame*":
             repeatSame = True
         elif temp[countSplit] == "*repeatNever*":
@@ -1760,7 +1013,7 @@ def writeRandom(
                     "greater than zero.",
                     currentLine,
                 )
-                return -56
+                return -56, None
             if maxSelectionsPerSubPointInteger <= 0:
                 logging.error(
                     "\nError! This Random start tag: %s\nspecifies Match Max Selections "
@@ -1769,7 +1022,7 @@ def writeRandom(
                     "integer greater than zero.",
                     currentLine,
                 )
-                return -57
+                return -57, None
         elif temp[countSplit] == "*nonUniformFirstSubPoint*":
             nonUniformFirstSubPoint = True
             try:
@@ -1782,7 +1035,39 @@ def writeRandom(
                     "number.",
                     currentLine,
                 )
-                return -58
+                return -58, None
+        elif temp[countSplit] == "*weights*":
+            myNumChoices = int(temp[2])
+            try:
+                weights = [
+                    float(weightText)
+                    for weightText in temp[
+                        countSplit + 1 : countSplit + 1 + myNumChoices
+                    ]
+                ]
+            except ValueError:
+                weights = []
+            if len(weights) < myNumChoices:
+                logging.error(
+                    "\nError! This Random start tag: %s\nspecifies weights, but *weights* "
+                    "is not followed by a number for each of its %d sub-points.  Fix the "
+                    "template file by removing the tag or following it with one decimal "
+                    "number per sub-point.",
+                    currentLine,
+                    myNumChoices,
+                )
+                return -82, None
+            if (not all(math.isfinite(w) and w >= 0 for w in weights)) or (
+                sum(weights) <= 0
+            ):
+                logging.error(
+                    "\nError! This Random start tag: %s\nspecifies weights that are "
+                    "negative, or that are all zero.  Fix the template file by using "
+                    "weights that are zero or greater, with at least one greater than "
+                    "zero.",
+                    currentLine,
+                )
+                return -83, None
         elif (temp[countSplit] == "*minimumNumberOfEntries*") and (
             len(temp) > countSplit + 1
         ):
@@ -1795,7 +1080,7 @@ def writeRandom(
                     "file by removing the tag or following it with an integer.",
                     currentLine,
                 )
-                return -59
+                return -59, None
         elif (temp[countSplit] == "*maximumNumberOfEntries*") and (
             len(temp) > countSplit + 1
         ):
@@ -1808,7 +1093,7 @@ def writeRandom(
                     "file by removing the tag or following it with an integer.",
                     currentLine,
                 )
-                return -60
+                return -60, None
         elif temp[countSplit] == "*matchSame*":
             matchSame = True
         elif temp[countSplit] == "*matchDifferent*":
@@ -1822,7 +1107,7 @@ def writeRandom(
             "template file by removing one of the two constraints.",
             currentLine,
         )
-        return -35
+        return -35, None
     if matchDifferent and matchSame:
         logging.error(
             "\nError! This Random start tag: %s\nspecifies both Match Different and "
@@ -1830,7 +1115,7 @@ def writeRandom(
             "file by removing one of the two constraints.",
             currentLine,
         )
-        return -20
+        return -20, None
     if matchMaxSelectionsPerSubPoint and matchSame:
         logging.error(
             "\nError! This Random start tag: %s\nspecifies both Match Max Selections "
@@ -1838,7 +1123,7 @@ def writeRandom(
             "Fix the template file by removing one of the two constraints.",
             currentLine,
         )
-        return -54
+        return -54, None
     if matchMaxSelectionsPerSubPoint and matchDifferent:
         logging.error(
             "\nError! This Random start tag: %s\nspecifies both Match Max Selections "
@@ -1847,7 +1132,7 @@ def writeRandom(
             "constraints.",
             currentLine,
         )
-        return -55
+        return -55, None
     if matchMaxSelectionsPerSubPoint and matchOnlyOneEver:
         logging.warning(
             "\nWarning! This Random start tag: %s\nspecifies both Match Max "
@@ -1864,6 +1149,15 @@ def writeRandom(
             currentLine,
         )
         matchDifferent = False
+    if nonUniformFirstSubPoint and (weights is not None):
+        logging.error(
+            "\nError! This Random start tag: %s\nspecifies both a non-uniform first "
+            "sub-point percentage and weights, but the two settings are exclusive.  "
+            "Fix the template file by removing one of the two settings (the weights "
+            "can give the first sub-point any percentage).",
+            currentLine,
+        )
+        return -84, None
     if repeatSame and repeatNever:
         logging.error(
             "\nError! This Random start tag: %s\nspecifies both Repeat Same and "
@@ -1871,7 +1165,7 @@ def writeRandom(
             "file by removing one of the two constraints.",
             currentLine,
         )
-        return -21
+        return -21, None
     if repeatSame and repeatDifferentDouble:
         logging.error(
             "\nError! This Random start tag: %s\nspecifies both Repeat Same and "
@@ -1880,7 +1174,7 @@ def writeRandom(
             "removing one of the two constraints.",
             currentLine,
         )
-        return -22
+        return -22, None
     if repeatNever and repeatDifferentDouble:
         logging.error(
             "\nError! This Random start tag: %s\nspecifies both Repeat Never and "
@@ -1889,7 +1183,7 @@ def writeRandom(
             "removing one of the two constraints.",
             currentLine,
         )
-        return -23
+        return -23, None
     if repeatSame and (minimumNumberOfEntries > 1):
         logging.error(
             "\nError! This Random start tag: %s\nspecifies both Repeat Same and a "
@@ -1898,11 +1192,10 @@ def writeRandom(
             "constraints.",
             currentLine,
         )
-        return -37
+        return -37, None
 
-    global globalDictRangeChoices
+    options = RandomOptions()
     if repeat:
-        currentPosition = inFile.tell()
         if repeatIndicesAreIntegers:
             myRange = range(repeatStart, repeatEnd, repeatInterval)
         else:
@@ -1916,127 +1209,3004 @@ def writeRandom(
                 "the end value (the second value after *repeat*).",
                 currentLine,
             )
-            return -25
-        if (minimumNumberOfEntries > 0) or (maximumNumberOfEntries > 0):
-            globalDictRangeChoices[myLabel] = [len(myRange), 0, 0]
-        for myIteration in myRange:
-            inFile.seek(currentPosition)
-            startString = str(repeatStart)
-            endString = str(repeatEnd)
+            return -25, None
+        options.repeat = True
+        options.repeatStart = repeatStart
+        options.repeatEnd = repeatEnd
+        options.repeatInterval = repeatInterval
+        options.repeatRange = list(myRange)
+    options.repeatSame = repeatSame
+    options.repeatNever = repeatNever
+    options.repeatNoDoubles = repeatNoDoubles
+    options.repeatDifferentDouble = repeatDifferentDouble
+    options.repeatDifferentDoublePercentage = repeatDifferentDoublePercentage
+    options.matchMaxSelectionsPerSubPoint = matchMaxSelectionsPerSubPoint
+    options.maxSelectionsPerSubPointInteger = maxSelectionsPerSubPointInteger
+    options.nonUniformFirstSubPoint = nonUniformFirstSubPoint
+    options.nonUniformFirstSubPointPercentage = nonUniformFirstSubPointPercentage
+    if weights is not None:
+        options.weights = weights
+        options.aliasTable = makeAliasTable(weights)
+        options.zeroWeights = choiceBits(i for i, w in enumerate(weights) if w == 0)
+    options.matchSame = matchSame
+    options.matchDifferent = matchDifferent
+    options.matchOnlyOneEver = matchOnlyOneEver
+    options.minimumNumberOfEntries = minimumNumberOfEntries
+    options.maximumNumberOfEntries = maximumNumberOfEntries
+    return 1, options
+
+
+leafSpecialTexts = [
+    "%start%",
+    "%end%",
+    "%current%",
+    "%currentPlusInterval%",
+    "%batch%",
+    "%batchpadded%",
+    "%numberofbatches%",
+    "%resume%",
+    "%resumepadded%",
+    "%numberofresumesperbatch%",
+    "%resumecountoverbatches%",
+    "%resumecountoverbatchespadded%",
+    "%totalnumberofresumes%",
+]
+
+
+def compileLeafLines(lines):
+    """
+    Compiles the lines of a Leaf section into the pieces that writeLeaf writes out.
+
+    Each run of lines without special text becomes a single string, with the line breaks between lines included.  Every other line becomes a LeafLine.
+    """
+    pieces = []
+    for lineNumber in range(len(lines)):
+        theLine = lines[lineNumber]
+        text = ("\n" if lineNumber > 0 else "") + theLine.rstrip("\n")
+        requiredSlots = []
+        if ("%start%" in theLine) or ("%next%" in theLine):
+            requiredSlots.append(0)
+        if "%end%" in theLine:
+            requiredSlots.append(1)
+        if "%current%" in theLine:
+            requiredSlots.append(2)
+        if "%currentPlusInterval%" in theLine:
+            requiredSlots.append(3)
+        # Splitting each special text in the same order as the old chain of str.replace calls gives the same text, because the values are numbers and so can never form (or break up) another special text.
+        segments = [text]
+        for slot in range(len(leafSpecialTexts)):
+            newSegments = []
+            for segment in segments:
+                if isinstance(segment, int) or (leafSpecialTexts[slot] not in segment):
+                    newSegments.append(segment)
+                    continue
+                splitSegment = segment.split(leafSpecialTexts[slot])
+                for i in range(len(splitSegment)):
+                    if i > 0:
+                        newSegments.append(slot)
+                    if splitSegment[i] != "":
+                        newSegments.append(splitSegment[i])
+            segments = newSegments
+        literalText = "".join([x for x in segments if isinstance(x, str)])
+        hasNext = "%next%" in literalText
+        usesMemory = ("%store%" in literalText) or ("%recall%" in literalText)
+        if (
+            (len(segments) == 1)
+            and isinstance(segments[0], str)
+            and (len(requiredSlots) == 0)
+            and not hasNext
+            and not usesMemory
+        ):
+            if (len(pieces) > 0) and isinstance(pieces[-1], str):
+                pieces[-1] += text
+            else:
+                pieces.append(text)
+        else:
+            pieces.append(
+                LeafLine(theLine, segments, requiredSlots, hasNext, usesMemory)
+            )
+    return pieces
+
+
+def logTemplatePortion(inFile_strings, lineNumber):
+    """
+    Logs the lines of the template (after inserting fragments) near lineNumber, to aid in debugging.
+    """
+    logging.error(
+        "\nPortion of template (after inserting fragments), with line numbers:"
+    )
+    for outputLineNumber in range(
+        max(0, lineNumber - 7), min(len(inFile_strings), lineNumber + 8)
+    ):
+        logging.error("%d:%s", outputLineNumber + 1, inFile_strings[outputLineNumber])
+
+
+def indexTemplate(inFile_strings):
+    """
+    Indexes the sections of the template (after inserting fragments) in a single pass.
+
+    Returns the error code (negative on failure) and a dictionary that maps the line number of each start tag to a list containing the line numbers of its subsections' start tags and the line number of its end tag.
+    Only the first (top-level) section is indexed, starting on the line after the gui version.
+    """
+    sectionIndex = {}
+    openSections = []  # [lineNumber, label, endText] of each enclosing section
+    lineNumber = 1
+    while lineNumber < len(inFile_strings):
+        currentLine = inFile_strings[lineNumber]
+        temp = currentLine.rstrip("\n").split(" ")
+        myText = temp[0]
+        if myText.startswith("*end_") and len(openSections) > 0:
+            [startLineNumber, myLabel, endText] = openSections.pop()
+            if (myText != endText) or (len(temp) < 2) or (temp[1] != myLabel):
+                logTemplatePortion(inFile_strings, lineNumber)
+                logging.error(
+                    "\nError!  While indexing the template, the program expected the "
+                    "end tag %s %s on line number %d (see print out with line numbers "
+                    "above) but got: %s\nMake sure each start tag has a matching end "
+                    "tag with the same label, and that the Random and Constant and "
+                    "Dependent sections have the correct number of subsections.",
+                    endText,
+                    myLabel,
+                    lineNumber + 1,
+                    currentLine,
+                )
+                return -70, sectionIndex
+            sectionIndex[startLineNumber][1] = lineNumber
+            if len(openSections) == 0:
+                return 1, sectionIndex
+            lineNumber += 1
+            continue
+
+        # any other line at this level is the start of a subsection, even if it is malformed
+        if len(openSections) > 0:
+            sectionIndex[openSections[-1][0]][0].append(lineNumber)
+        elif lineNumber > 1:
+            return 1, sectionIndex
+        if len(temp) < 2:
+            sectionIndex[lineNumber] = [[], None]
+            lineNumber += 1
+            if len(openSections) == 0:
+                return 1, sectionIndex
+            continue
+        myLabel = temp[1]
+        sectionIndex[lineNumber] = [[], None]
+        if "*leaf*" in myText:
+            endTag = "*end_leaf* " + myLabel
+            startLineNumber = lineNumber
+            lineNumber += 1
+            while lineNumber < len(inFile_strings):
+                if endTag in inFile_strings[lineNumber] + " ":
+                    break
+                lineNumber += 1
+            else:
+                logging.error(
+                    "\nError!  Could not find *end_leaf* %s\nThe program was indexing "
+                    "a Leaf section and never found the end tag for that section.  "
+                    "Make sure the end tag is in the file.",
+                    myLabel,
+                )
+                return -11, sectionIndex
+            sectionIndex[startLineNumber][1] = lineNumber
+            if len(openSections) == 0:
+                return 1, sectionIndex
+        elif (
+            ("*random*" in myText)
+            or ("*constant*" in myText)
+            or ("*dependent*" in myText)
+        ):
+            openSections.append([lineNumber, myLabel, "*end_" + myText[1:]])
+        elif len(openSections) == 0:
+            return 1, sectionIndex
+        lineNumber += 1
+
+    if len(openSections) > 0:
+        [startLineNumber, myLabel, endText] = openSections[-1]
+        logging.error(
+            "\nError!  Reached the end of the file looking for the %s corresponding "
+            "to this start tag: %s\nMake sure the end tag is in the file, and that the "
+            "Random and Constant and Dependent sections have the correct number of "
+            "subsections.",
+            endText,
+            inFile_strings[startLineNumber],
+        )
+        return {"*end_random*": -18, "*end_dependent*": -27}.get(
+            endText, -12
+        ), sectionIndex
+    return 1, sectionIndex
+
+
+def compileTemplate(inFile_strings):
+    """
+    Compiles the template (after inserting fragments) into a tree of Leaf, Random, Constant, and Dependent nodes.
+
+    The first line (the gui version) is skipped, and any lines after the end tag of the first (top-level) section are ignored.
+    Returns the error code (negative on failure) and the top-level node.
+    """
+    if len(inFile_strings) < 2:
+        logging.error(
+            "\nError!  The template does not contain any sections after the gui "
+            "version line.  It expected to find a start tag (e.g., *random* 1 7)."
+        )
+        return -5, None
+    retval, sectionIndex = indexTemplate(inFile_strings)
+    if retval < 0:
+        return retval, None
+    return compileSection(inFile_strings, sectionIndex, 1)
+
+
+def compileSection(inFile_strings, sectionIndex, lineNumber):
+    """
+    Compiles the section whose start tag is on lineNumber, recursing into its subsections.
+
+    Returns the error code (negative on failure) and the node.
+    """
+    currentLine = inFile_strings[lineNumber]
+    temp = currentLine.rstrip("\n").split(" ")
+    if len(temp) < 2:
+        logTemplatePortion(inFile_strings, lineNumber)
+        logging.error(
+            "\nError!  While compiling the template, the program was looking for a "
+            "new section and expected a start tag (e.g., *random* 3-2 4) on line "
+            "number %d (see print out with line numbers above) but got: %s\nMake "
+            "sure the lines (in the template file) that contain start tags for "
+            "Random and Constant and Dependent sections specify the correct number "
+            "of subsections listed after the label (following the second space in "
+            "the line), that each end tag is directly followed by either a start tag "
+            "or an end tag, that there are no blank lines in the template file "
+            "outside of Leaf sections, and that all fragments use the start/end tag "
+            'texts "*leaf*" and "*end_leaf*" exactly and with no spaces on the same '
+            "lines.",
+            lineNumber + 1,
+            currentLine,
+        )
+        return -6, None
+    myText = temp[0]
+    myLabel = temp[1]
+    [subsectionLineNumbers, endLineNumber] = sectionIndex[lineNumber]
+    myNumChoices = 0
+    if ("*random*" in myText) or ("*constant*" in myText) or ("*dependent*" in myText):
+        if len(temp) < 3:
+            logging.error(
+                "\nError!  While compiling the template, the program found a non-Leaf "
+                "start tag, but the start tag did not contain the number of "
+                "subsections: %s\nThe start tags for Random and Constant and "
+                "Dependent sections should list the type of the section, then a "
+                "space, then the label for the section, then a space, then the number "
+                "of the subsections.  (e.g., *random* 1-1-5-6 8)",
+                currentLine,
+            )
+            return -7, None
+        temp[2] = temp[2].rstrip("\n")
+        if temp[2].isdigit() == False:
+            logging.error(
+                "\nError!  While compiling the template, the program found a non-Leaf "
+                "start tag, for which the number of subsections should be the second "
+                "item, but on this line that is not a number: %s\nThe start tags for "
+                "Random and Constant and Dependent sections should list the type of "
+                "the section, then a space, then the label for the section, then a "
+                "space, then the number of the subsections (e.g., *random* 1-1-5-6 8).",
+                currentLine,
+            )
+            return -8, None
+        myNumChoices = int(temp[2])
+        if len(subsectionLineNumbers) < myNumChoices:
+            logTemplatePortion(inFile_strings, endLineNumber)
+            logging.error(
+                "\nError!  This start tag lists %d subsections, but the section only "
+                "contains %d before its end tag on line number %d (see print out with "
+                "line numbers above): %s\nMake sure the lines (in the template file) "
+                "that contain start tags for Random and Constant and Dependent "
+                "sections specify the correct number of subsections listed after the "
+                "label (following the second space in the line).",
+                myNumChoices,
+                len(subsectionLineNumbers),
+                endLineNumber + 1,
+                currentLine,
+            )
+            return -71, None
+
+    if "*leaf*" in myText:
+        return 1, LeafNode(
+            myLabel, currentLine, inFile_strings[lineNumber + 1 : endLineNumber]
+        )
+
+    if (
+        ("*random*" not in myText)
+        and ("*dependent*" not in myText)
+        and ("*constant*" not in myText)
+    ):
+        logging.error(
+            "\nError!  While compiling the template, the program found a start tag "
+            "that it does not recognize: %s\nThe recognizable start tags are *leaf*, "
+            "*random*, *dependent*, and *constant*.  If the line above is not "
+            "supposed to be a start tag, make sure in the template file it is not "
+            "directly after a start tag for a Random or Constant or Dependent "
+            "section, and that it does not directly follow an end tag.",
+            currentLine,
+        )
+        return -9, None
+
+    # only the listed number of subsections are used, any extras before the end tag are ignored
+    children = []
+    for subsectionLineNumber in subsectionLineNumbers[:myNumChoices]:
+        retval, child = compileSection(
+            inFile_strings, sectionIndex, subsectionLineNumber
+        )
+        if retval < 0:
+            return retval, None
+        children.append(child)
+
+    if "*random*" in myText:
+        retval, options = parseRandomOptions(temp, myLabel, currentLine)
+        if retval < 0:
+            return retval, None
+        return 1, RandomNode(myLabel, currentLine, myNumChoices, options, children)
+
+    if "*dependent*" in myText:
+        masterLabel = None
+        for countSplit in range(3, len(temp) - 1):
+            if temp[countSplit] == "*master*":
+                masterLabel = temp[countSplit + 1]
+        if masterLabel is None:
+            logging.error(
+                "\nError! This Dependent section start tag does not name the section it "
+                "depends upon: %s\nThe start tag should list *master* followed by the "
+                "label of a Random section (e.g., *dependent* 1-3 2 *master* 1-1).",
+                currentLine,
+            )
+            return -69, None
+        return 1, DependentNode(
+            myLabel, currentLine, myNumChoices, masterLabel, children
+        )
+
+    return 1, ConstantNode(myLabel, currentLine, children)
+
+
+def makeCodebookText(templateTree):
+    """
+    Returns the text of the codebook, with one line for each Leaf in the template.
+
+    If any Random section has *weights*, the codebook has a Weight column with each Leaf's weight in its (weighted) parent section.
+    """
+    hasWeights = sectionHasWeights(templateTree)
+    codebookLines = [
+        "Parent Section\tLeaf\tText" + ("\tWeight" if hasWeights else "") + "\n"
+    ]
+    makeCodebookSection(templateTree, codebookLines, hasWeights, "")
+    return "".join(codebookLines)
+
+
+def sectionHasWeights(node):
+    """
+    Returns whether this section or any of its subsections is a Random section with *weights*.
+    """
+    if isinstance(node, LeafNode):
+        return False
+    if isinstance(node, RandomNode) and node.options.weights is not None:
+        return True
+    return any(sectionHasWeights(child) for child in node.children)
+
+
+def makeCodebookSection(node, codebookLines, hasWeights, weightText):
+    """
+    Appends one line to the codebook for each Leaf in this section, in the order they appear in the template.
+    """
+    if isinstance(node, LeafNode):
+        splitLabel = node.label.split("-")
+        myParent = "-".join(splitLabel[:-1])
+        parentString = "v" + myParent.replace("-", "_")
+        if parentString == "v":
+            parentString = "-"
+        codebookLines.append(
+            parentString
+            + "\t"
+            + splitLabel[-1]
+            + "\t"
+            + leafCodebookText(node)
+            + ("\t" + weightText if hasWeights else "")
+            + "\n"
+        )
+        return
+    weights = None
+    if isinstance(node, RandomNode):
+        weights = node.options.weights
+    for i, child in enumerate(node.children):
+        makeCodebookSection(
+            child,
+            codebookLines,
+            hasWeights,
+            "" if weights is None else "{:.15g}".format(weights[i]),
+        )
+
+
+def makeColumnSchema(templateTree):
+    """
+    Returns the names of every column the collated csv can have, in the order they are written.
+
+    The names come from the start tags and repeat ranges in the template, so they are known before any resume is generated.
+    The filename and batch columns come first, then the sections' variables sorted by sortColumnName.
+    """
+    variableNames = []
+    makeColumnSchemaSection(templateTree, templateTree.label, variableNames)
+    columns = sorted(
+        set("v" + name.replace("-", "_") for name in variableNames),
+        key=sortColumnName,
+    )
+    return collatedFirstColumns + [
+        col for col in columns if col not in collatedFirstColumns
+    ]
+
+
+def makeColumnSchemaSection(node, myVariableName, variableNames):
+    """
+    Appends the variable name of every decision this section (and its subsections) can make, named the same way as during generation.
+    """
+    if isinstance(node, LeafNode):
+        return
+    decisionNames = [myVariableName]
+    if isinstance(node, ConstantNode):
+        decisionNames = []
+    elif isinstance(node, RandomNode) and node.options.repeat:
+        decisionNames = [
+            myVariableName + "-iter" + str(myIteration)
+            for myIteration in node.options.repeatRange
+        ]
+    variableNames.extend(decisionNames)
+    for i in range(len(node.children)):
+        for name in decisionNames or [myVariableName]:
+            makeColumnSchemaSection(
+                node.children[i], name + "-" + str(i + 1), variableNames
+            )
+
+
+def printCodebook(codebookText, filename, outputEncoding, codebookPolicy="ask"):
+    """
+    Prints the codebook, if it does not exist or has changed.
+
+    codebookPolicy says what to do when the codebook has changed: "ask" waits for the user before saving a new codebook, "new" saves a new codebook without waiting, and "error" stops without generating anything.
+    """
+    logging.info("Checking whether codebook already exists.")
+    # the lines of the codebook as they would be read back from its file
+    codebookLines = io.StringIO(codebookText, newline=None).readlines()
+
+    # is this codebook the same as the latest one?
+    codebookPrefix = filename + "_codebook-"
+    prevCodebookNames = glob.glob(codebookPrefix + "*.xls")
+    saveCodebook = True
+    logging.info("\n")
+    if len(prevCodebookNames) == 0:
+        logging.info("No previous codebook was found in the folder.")
+    else:
+        latestCodebookName = max(prevCodebookNames, key=os.path.getmtime)
+        success, latestCodebook, encoding = openInputFile(latestCodebookName)
+        if not success:
+            logging.warning(
+                "\nWarning, failed to compare previous codebook with new codebook!  "
+                "Saving new codebook even though it might have the same content."
+            )
+        else:
+            # comparing all of the lines also notices a codebook that is only shorter or longer
+            saveCodebook = codebookLines != latestCodebook.readlines()
+            latestCodebook.close()
+            if saveCodebook:
+                logging.warning(
+                    "\nWarning! The template does not match the latest codebook file: %s\n"
+                    "One (or both) of the template or the codebook have been modified.\n"
+                    "A new codebook file will be created for the files being generated "
+                    "now.",
+                    latestCodebookName,
+                )
+                if codebookPolicy == "error":
+                    logging.error(
+                        "\nError! Stopping because the codebook has changed, instead "
+                        "of creating a new codebook."
+                    )
+                    return -75
+                if codebookPolicy == "ask":
+                    input("Press return to continue")
+
+    if saveCodebook:
+        codebookNumber = 1
+        while True:
+            codebookFilename = codebookPrefix + str(codebookNumber) + ".xls"
+            if not os.path.isfile(codebookFilename):
+                break
+            codebookNumber += 1
+        logging.info("Saving new codebook in a file named %s", codebookFilename)
+        try:
+            codebookFile = open(codebookFilename, "wt", encoding=outputEncoding)
+        except IOError as e:
+            logging.error(
+                "\nError creating codebook file named %s\n%s", codebookFilename, e
+            )
+            return -52
+        try:
+            with codebookFile:
+                codebookFile.writelines(codebookLines)
+        except UnicodeError as e:
+            logging.error(
+                "\nError! Failed to copy the codebook into the file due to encoding "
+                "issues.\n%s",
+                e,
+            )
+            return -66
+
+        logging.info("Done saving the codebook.\n")
+    else:
+        logging.info(
+            "The codebook for this template already exists in %s\n", latestCodebookName
+        )
+
+    return 1
+
+
+def hashFile(filename):
+    """
+    Returns the sha256 hash of the file's contents, or None if the file cannot be read.
+
+    The hash is cached with the file's size and modification time, so an unchanged file is only read once.
+    """
+    try:
+        key = inputFileKey(filename)
+        info = inputFileCache.get(key)
+        if info is None:
+            with open(filename, "rb") as file:
+                info = InputFileInfo(hashlib.sha256(file.read()).hexdigest())
+            inputFileCache[key] = info
+    except OSError:
+        return None
+    return info.contentHash
+
+
+def userCacheDirectory():
+    """
+    Returns the folder in which the current user's programs keep their caches.
+    """
+    if sys.platform == "win32":
+        cacheDirectory = os.environ.get("LOCALAPPDATA") or os.path.join(
+            os.path.expanduser("~"), "AppData", "Local"
+        )
+    elif sys.platform == "darwin":
+        cacheDirectory = os.path.join(os.path.expanduser("~"), "Library", "Caches")
+    else:
+        cacheDirectory = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+            os.path.expanduser("~"), ".cache"
+        )
+    return os.path.join(cacheDirectory, templateCacheDirectory)
+
+
+def templateCacheFilename(file_name):
+    """
+    Returns the name of the file in which the compiled template is cached, or None if the template cannot be read.
+
+    The name is a hash of the template's path and contents, the program version, and the system default encoding, so any change to them uses a different cache file.  The cache is kept in the user's own cache folder, not next to the template, because loading it can run any code that was written into it.
+    """
+    templateHash = hashFile(file_name)
+    if templateHash is None:
+        return None
+    cacheKey = "\n".join(
+        [
+            os.path.abspath(file_name),
+            templateHash,
+            str(Version),
+            str(templateCacheFormat),
+            locale.getpreferredencoding(),
+        ]
+    )
+    return os.path.join(
+        userCacheDirectory(),
+        hashlib.sha256(cacheKey.encode("utf-8")).hexdigest() + ".pickle",
+    )
+
+
+def loadTemplateCache(cacheFilename):
+    """
+    Loads the compiled template and codebook text from the cache.
+
+    Returns None if there is no cache for this template, if the cache belongs to another user, or if any of the file fragments it uses have changed since it was cached.
+    """
+    if (cacheFilename is None) or (not os.path.isfile(cacheFilename)):
+        return None
+    try:
+        with open(cacheFilename, "rb") as cacheFile:
+            # never unpickle a file that another user could have written
+            if hasattr(os, "getuid") and (
+                os.fstat(cacheFile.fileno()).st_uid != os.getuid()
+            ):
+                logging.warning(
+                    "\nWarning! Ignoring the template cache %s because it belongs to "
+                    "another user.",
+                    cacheFilename,
+                )
+                return None
+            cachedTemplate = pickle.load(cacheFile)
+    except Exception as e:
+        logging.debug("Ignoring unreadable template cache %s: %s", cacheFilename, e)
+        return None
+    for fragmentFilename, fragmentHash in cachedTemplate["fragmentHashes"]:
+        if hashFile(fragmentFilename) != fragmentHash:
+            logging.debug(
+                "Ignoring template cache %s because the file fragment %s changed.",
+                cacheFilename,
+                fragmentFilename,
+            )
+            return None
+    logging.info(
+        "Using the compiled template from %s (the template and its %d file fragments "
+        "are unchanged).  Saving all outputs in the encoding %s.",
+        cacheFilename,
+        len(cachedTemplate["fragmentHashes"]),
+        cachedTemplate["outputEncoding"],
+    )
+    return cachedTemplate
+
+
+def saveTemplateCache(
+    cacheFilename,
+    context,
+    guiVersion,
+    matchedPair,
+    templateTree,
+    codebookText,
+    columnSchema,
+):
+    """
+    Saves the compiled template, codebook text, and collated csv columns to the cache, along with hashes of the file fragments it uses.
+
+    Failing to save the cache is not an error, the template will just be compiled again next time.
+    """
+    if cacheFilename is None:
+        return
+    fragmentFilenames = dict.fromkeys(
+        fragmentFilename for fragmentFilename, encoding in context.inputEncodings[1:]
+    )
+    cachedTemplate = {
+        "guiVersion": guiVersion,
+        "matchedPair": matchedPair,
+        "inputEncodings": context.inputEncodings,
+        "outputEncoding": context.outputEncoding,
+        "templateTree": templateTree,
+        "codebookText": codebookText,
+        "columnSchema": columnSchema,
+        "fragmentHashes": [
+            (fragmentFilename, hashFile(fragmentFilename))
+            for fragmentFilename in fragmentFilenames
+        ],
+    }
+    try:
+        os.makedirs(os.path.dirname(cacheFilename), mode=0o700, exist_ok=True)
+        cacheFile = tempfile.NamedTemporaryFile(
+            "wb", dir=os.path.dirname(cacheFilename), delete=False
+        )
+    except OSError as e:
+        logging.debug("Failed to save the template cache %s: %s", cacheFilename, e)
+        return
+    # write to a temporary file first so that a concurrent run never loads a partial cache
+    try:
+        with cacheFile:
+            pickle.dump(cachedTemplate, cacheFile, pickle.HIGHEST_PROTOCOL)
+        os.replace(cacheFile.name, cacheFilename)
+    except Exception as e:
+        logging.debug("Failed to save the template cache %s: %s", cacheFilename, e)
+        try:
+            os.remove(cacheFile.name)
+        except OSError:
+            pass
+        return
+    logging.debug("Saved the compiled template to %s", cacheFilename)
+
+
+def canEncodeLines(lines, encoding):
+    """
+    Returns whether all of the lines can be written in the encoding, without writing them anywhere.
+    """
+    try:
+        for _ in codecs.iterencode(lines, encoding):
+            pass
+    except (UnicodeError, LookupError):
+        return False
+    return True
+
+
+def prepareTemplate(context, inFile):
+    """
+    Inserts the file fragments into the template, chooses the output encoding, and compiles the template.
+
+    The expanded template is kept in memory: the output encoding is the first encoding of the input files that can encode all of it.
+
+    Returns the error code (negative on failure) and the top-level node.
+    """
+    inFile.seek(0)
+    retval, inFile_strings, num_fragments = replaceFragments(
+        inFile.readlines(), context.inputEncodings
+    )
+    inFile.close()
+    if retval < 0:
+        return retval, None
+
+    [filenames, encodings] = list(zip(*context.inputEncodings))
+    if num_fragments == 0:
+        context.outputEncoding = encodings[0]
+        logging.info("")
+        if context.outputEncoding != locale.getpreferredencoding():
+            logging.info(
+                "Saving the codebook and all other outputs in an encoding (%s) that "
+                "is not the system default (%s) because the template was encoded in "
+                "(%s).",
+                context.outputEncoding,
+                locale.getpreferredencoding(),
+                context.outputEncoding,
+            )
+        else:
+            logging.debug(
+                "Saving the codebook and all other outputs using system preferred "
+                "encoding (%s).",
+                context.outputEncoding,
+            )
+    else:
+        # the first of the input files' encodings that can encode the whole template, checked in memory
+        context.outputEncoding = None
+        for encoding in encodings:
+            if canEncodeLines(inFile_strings, encoding):
+                context.outputEncoding = encoding
+                break
+
+        # If none of the encodings work, try utf-8.
+        if context.outputEncoding is None:
+            logging.warning(
+                "Warning! Failed to encode the codebook with any of the encodings "
+                "used for the template and any fragment files: %s. Going to try utf-8.",
+                context.inputEncodings,
+            )
+            context.outputEncoding = "utf-8"
+            if not canEncodeLines(inFile_strings, context.outputEncoding):
+                logging.error(
+                    "\nError! Failed to encode the codebook with any encoding (including "
+                    "utf-8).\nIf using fragment files, try converting all of the input "
+                    "files (i.e., the template and any fragments) into the same "
+                    "encoding."
+                )
+                return -65, None
+
+        if context.outputEncoding != locale.getpreferredencoding():
+            logging.info(
+                "Saving the codebook and all other outputs in an encoding (%s) that "
+                "is not the system default (%s) because the template and/or fragment "
+                "files used a different encoding.",
+                context.outputEncoding,
+                locale.getpreferredencoding(),
+            )
+        else:
+            logging.debug(
+                "Saving the codebook and all other outputs using system preferred "
+                "encoding (%s).",
+                context.outputEncoding,
+            )
+        # split the lines as if the template had been read from a file, since the last line of a fragment file may not end with a newline
+        inFile_strings = io.StringIO("".join(inFile_strings), newline=None).readlines()
+
+    return compileTemplate(inFile_strings)
+
+
+def readTemplateHeader(context, file_name):
+    """
+    Opens the template and reads its gui version, and whether it has random sections for Matched "pairs".
+
+    Returns the error code (negative on failure), the open template file, the gui version line, and whether it is matched.
+    """
+    success, inFile, encoding = openInputFile(file_name)
+    if not success:
+        logging.error("\nError! Failed to open the template file!")
+        return -67, None, None, False
+    context.inputEncodings = [(file_name, encoding)]
+    matchedPair = False
+    guiVersion = inFile.readline()
+    guiVersion_text = " ".join(guiVersion.split(" ")[1:4])
+    if guiVersion_text.rstrip("\n") != "gui version number":
+        logging.error(
+            "Error! The file selected as a template %s does not have the correct "
+            'text starting its first line: "%s gui version number"\n'
+            'Instead, the first line is "%s"',
+            file_name,
+            Version,
+            guiVersion,
+        )
+        return -53, None, None, False
+
+    for line in inFile:
+        if (
+            ("*matchDifferent*" in line)
+            or ("*matchSame*" in line)
+            or ("*matchOnlyOneEver*" in line)
+            or ("*matchMaxSelectionsPerSubPoint*" in line)
+        ):
+            matchedPair = True
+            break
+    return 1, inFile, guiVersion, matchedPair
+
+
+def loadTemplate(
+    context, cacheFilename, cachedTemplate, inFile, guiVersion, matchedPair
+):
+    """
+    Compiles the template opened by readTemplateHeader and saves it to the cache, or uses the cached template.
+
+    Returns the error code (negative on failure), the top-level node, the codebook text, and the collated csv columns.
+    """
+    if cachedTemplate is not None:
+        context.inputEncodings = cachedTemplate["inputEncodings"]
+        context.outputEncoding = cachedTemplate["outputEncoding"]
+        setOutputBytes(context, cachedTemplate["templateTree"])
+        return (
+            1,
+            cachedTemplate["templateTree"],
+            cachedTemplate["codebookText"],
+            cachedTemplate["columnSchema"],
+        )
+    returnVal, templateTree = prepareTemplate(context, inFile)
+    if returnVal < 0:
+        return returnVal, None, None, None
+    codebookText = makeCodebookText(templateTree)
+    columnSchema = makeColumnSchema(templateTree)
+    saveTemplateCache(
+        cacheFilename,
+        context,
+        guiVersion,
+        matchedPair,
+        templateTree,
+        codebookText,
+        columnSchema,
+    )
+    setOutputBytes(context, templateTree)
+    return 1, templateTree, codebookText, columnSchema
+
+
+def setOutputBytes(context, templateTree):
+    """
+    Chooses how the text files are encoded as bytes in the output encoding, and encodes the plain text of the Leaf sections once if it can be.
+    """
+    encoding = codecs.lookup(context.outputEncoding).name
+    context.outputByteOrderMark = b""
+    if encoding == "utf-8-sig":
+        encoding = "utf-8"
+        context.outputByteOrderMark = codecs.BOM_UTF8
+    elif encoding in ("utf-16", "utf-32"):
+        # written with a byte order mark, as open() writes them, then in this machine's byte order
+        context.outputByteOrderMark = "".encode(encoding)
+        encoding += "-le" if sys.byteorder == "little" else "-be"
+    context.outputBodyEncoding = encoding
+    # the bytes of a stateful encoding (e.g., iso2022_jp) depend on the text before them
+    encodeLeaves(templateTree, encoding, encoding not in statefulEncodings)
+
+
+def encodeLeaves(node, encoding, preEncode):
+    """
+    Sets encodedPieces of every Leaf in this section (and its subsections), or clears it if preEncode is false.
+    """
+    if isinstance(node, LeafNode):
+        node.encodedPieces = None
+        if preEncode:
+            node.encodedPieces = [
+                (
+                    piece.replace("\n", os.linesep).encode(encoding)
+                    if isinstance(piece, str)
+                    else piece
+                )
+                for piece in node.pieces
+            ]
+        return
+    for child in node.children:
+        encodeLeaves(child, encoding, preEncode)
+
+
+class EncodedOutput:
+    """
+    A text file that collects its text as bytes in the output encoding, and writes them all with a single write when it is closed.
+    """
+
+    def __init__(self, filename, context):
+        self.file = open(filename, "wb")
+        self.encoder = codecs.getincrementalencoder(context.outputBodyEncoding)()
+        self.byteOrderMark = context.outputByteOrderMark
+        self.chunks = []
+
+    def write(self, text):
+        if os.linesep != "\n":
+            text = text.replace("\n", os.linesep)
+        self.chunks.append(self.encoder.encode(text))
+
+    def writeEncoded(self, data):
+        """
+        Writes bytes already encoded in the output encoding (see encodeLeaves), which must not be stateful.
+        """
+        self.chunks.append(data)
+
+    def close(self):
+        if len(self.chunks) > 0:
+            self.file.write(self.byteOrderMark + b"".join(self.chunks))
+        self.file.close()
+
+
+class GenerationContext:
+    """
+    The state of one run: the template's encodings, the batch and resume being generated, their output files, and the choices made so far.
+
+    Nothing about a run is kept in module globals, so several runs can be generated at once, each with its own context.
+    """
+
+    def __init__(self):
+        # the run
+        self.templateFilename = ""
+        self.currentTime = ""
+        self.guiVersion = ""
+        self.templateTree = None
+        self.columnSchema = []
+        self.seed = 0  # every random stream of the run is derived from this seed
+        self.randomMode = "stream"  # "stream" or "counter", see RunSettings
+        self.choicesOnly = False  # only make the choices, see RunSettings
+        self.assignment = "greedy"  # "greedy" or "search", see RunSettings
+        self.conflictLabels = {}  # see makeConflictLabels
+        # whether to log each choice, which takes longer than making it
+        self.logChoices = True
+        # the setThreadLogLevel of the run, for its worker processes
+        self.threadLogLevel = logging.NOTSET
+        self.vectorizedSlots = {}  # label -> index in vectorizedPlan
+        self.vectorizedPlan = []  # see makeVectorizedPlan
+        self.inputEncodings = []  # (filename, encoding) of the template and fragments
+        self.outputEncoding = None
+        self.outputBodyEncoding = None  # see setOutputBytes
+        self.outputByteOrderMark = b""
+        self.columnIndex = {}  # collated csv column name -> column id
+        self.numberOfBatchesString = ""
+        self.numberOfResumesPerBatchString = ""
+        self.totalNumberOfResumesString = ""
+        # the batch
+        self.batchString = ""
+        self.batchPaddedString = ""
+        self.dictionaryMatchSame = {}
+        # the choices are kept as bitsets (bit i is choice i), so checking them does not depend on the number of resumes
+        self.dictionaryMatchDifferent = {}  # variable name -> bitset of the choices
+        # label -> [bitset of every resume's choices, bitset of choices made by more than one resume, dict of resume number -> bitset of its choices]
+        self.dictionaryMatchOnlyOneEver = {}
+        # label -> [list of the number of times each choice was made, bitset of the choices made the maximum number of times]
+        self.dictionaryMaxSelectionsPerSubPoint = {}
+        self.batchSeed = 0
+        self.search = None  # the BatchSearch of the batch, with --assignment search
+        self.ledgerFilename = None  # the --ledger, or None
+        self.ledger = None  # this process's connection to the ledger, once opened
+        self.ledgerKey = (
+            ""  # the template's filename, which the ledger's counts are kept under
+        )
+        self.ledgerSections = {}  # see makeLedgerSections
+        # label -> the counts of its choices in the ledger before this batch (see addLedgerCount)
+        self.ledgerSnapshot = {}
+        self.ledgerVersion = (
+            None  # the ledger's data_version when ledgerSnapshot was read
+        )
+        # label -> dict of choice -> the number of times this batch made it
+        self.ledgerSelections = {}
+        # the ledgerSelections of the last batch generated, once its files are written
+        self.ledgerReserved = None
+        self.vectorizedBlock = (
+            None  # the block of resumes drawn in vectorizedBlockChoices
+        )
+        self.vectorizedBlockChoices = (
+            []
+        )  # per slot, per resume in the block, the choices
+        # the resume
+        self.resumeSeed = 0
+        self.rng = (
+            None  # the random.Random stream of the resume, or of the choice being made
+        )
+        self.thisResumeNumber = 0
+        self.thisResumeNumberString = ""
+        self.thisResumeNumberPaddedString = ""
+        self.resumeCountOverBatchesString = ""
+        self.resumeCountOverBatchesPaddedString = ""
+        self.outFile = None
+        self.saveChoicesFile = None
+        self.txtChoicesFile = None
+        self.choiceRow = None
+        self.vectorizedChoices = []  # per slot, the resume's choices drawn in its block
+        self.vectorizedCursors = (
+            []
+        )  # per slot, how many of those choices have been used
+        self.replayRecord = None  # the ReplayRecord being replayed, instead of choosing
+        self.memory = {}  # store/recall variables
+        self.delayedWrite = None
+        self.dictRangeChoices = {}
+        self.dictionaryRepeatSame = {}
+        self.dictionaryRepeatNever = {}  # label -> bitset of the choices
+        self.dictionaryLastChoice = {}
+
+
+class RunSettings:
+    """
+    How many resumes to create, and how to name and save them.
+    """
+
+    def __init__(
+        self,
+        numberPerBatch=1,
+        numberOfBatches=1,
+        timeInFilename=True,
+        outputDirectory=None,
+        codebookPolicy="ask",
+        workers=1,
+        seed=None,
+        randomMode="stream",
+        regenerateBatches=None,
+        choicesOnly=False,
+        assignment="greedy",
+        ledgerFilename=None,
+    ):
+        self.numberPerBatch = numberPerBatch  # the number of matched resumes
+        self.numberOfBatches = numberOfBatches
+        self.timeInFilename = timeInFilename
+        self.outputDirectory = outputDirectory  # None is the template's folder
+        self.codebookPolicy = codebookPolicy  # "ask", "new", or "error"
+        self.workers = workers  # the number of processes generating batches
+        self.seed = seed  # None picks a new seed
+        # "stream" draws all of a resume's choices from its stream in turn; "counter" gives each choice its own stream, from the resume's stream and the choice's variable name; "vectorized" draws the choices of sections without constraints for a block of resumes at once (with numpy), and the other choices from the resume's stream
+        self.randomMode = randomMode
+        self.regenerateBatches = regenerateBatches  # None generates every batch
+        # only make the choices and save them in the collated csv, without writing any text (or any other files) for each resume
+        self.choicesOnly = choicesOnly
+        # "greedy" makes each choice in turn, stopping with an error if a choice cannot obey the Match and Repeat settings; "search" searches for choices that obey them for each batch, before writing its files
+        self.assignment = assignment
+        # a SQLite file counting the choices of the sections with Max Selections Per Sub-Point or Match Only One Ever across batches and runs, or None to count them within each batch
+        self.ledgerFilename = ledgerFilename
+
+
+def askRunSettings(matchedPair):
+    """
+    Asks the user how many resumes to create and whether to put the time in their filenames.
+
+    Returns the error code (-1 if the user cancels) and the RunSettings.
+    """
+    numDifferent = 1
+    if matchedPair:
+        while True:
+            try:
+                numDifferent = int(
+                    input(
+                        'This template file contains random sections for Matched "pairs".  How many files should be matched in each batch? (0 to cancel) '
+                    )
+                )
+            except ValueError:
+                logging.warning("Please enter a positive integer.")
+                continue
+            if numDifferent < 1:
+                logging.warning("Canceled")
+                return -1, None
+            break
+
+    while True:
+        try:
+            if matchedPair:
+                numToMake = int(
+                    input(
+                        "How many batches of matched resumes should be generated? (0 to cancel) "
+                    )
+                )
+            else:
+                numToMake = int(
+                    input("How many resumes should be generated? (0 to cancel) ")
+                )
+            break
+        except ValueError:
+            logging.warning("Please enter an integer.")
+            continue
+    if numToMake < 1:
+        logging.warning("Canceled")
+        return -1, None
+
+    timeInFilename = False
+    withTime = input(
+        "\nWould you like the date & time in each resume filename? (Y/n, anything else to cancel) "
+    )
+    if (not withTime) or (withTime.lower() == "y") or (withTime.lower() == "yes"):
+        timeInFilename = True
+    elif (withTime.lower() != "n") and (withTime.lower() != "no"):
+        logging.warning("Canceled")
+        return -1, None
+    logging.info("")
+    return 1, RunSettings(numDifferent, numToMake, timeInFilename)
+
+
+def createResumes(file_name, current_time, runSettings=None):
+    """
+    Creates resumes from the template filename.
+
+    Asks the user how many resumes to create unless runSettings is given.  The outputs are named after the template, in the template's folder unless runSettings has an output directory.
+    """
+    context = GenerationContext()
+    cacheFilename = templateCacheFilename(file_name)
+    cachedTemplate = loadTemplateCache(cacheFilename)
+    inFile = None
+    if cachedTemplate is None:
+        returnVal, inFile, guiVersion, matchedPair = readTemplateHeader(
+            context, file_name
+        )
+        if returnVal < 0:
+            return returnVal
+    else:
+        guiVersion = cachedTemplate["guiVersion"]
+        matchedPair = cachedTemplate["matchedPair"]
+    if runSettings is None:
+        returnVal, runSettings = askRunSettings(matchedPair)
+        if returnVal < 0:
+            return returnVal
+    elif (not matchedPair) and (runSettings.numberPerBatch != 1):
+        logging.warning(
+            'This template does not contain random sections for Matched "pairs", '
+            "so each batch has 1 resume instead of %d.",
+            runSettings.numberPerBatch,
+        )
+        runSettings.numberPerBatch = 1
+    if (
+        (runSettings.numberOfBatches < 1)
+        or (runSettings.numberPerBatch < 1)
+        or (runSettings.workers < 1)
+    ):
+        logging.warning("Canceled")
+        return -1
+    numDifferent = runSettings.numberPerBatch
+    numToMake = runSettings.numberOfBatches
+    time_in_file_name = "_" + current_time if runSettings.timeInFilename else ""
+    outputName = file_name
+    if runSettings.outputDirectory is not None:
+        try:
+            os.makedirs(runSettings.outputDirectory, exist_ok=True)
+        except OSError as e:
+            logging.error(
+                "\nError creating the output folder %s\n%s",
+                runSettings.outputDirectory,
+                e,
+            )
+            return -76
+        outputName = os.path.join(
+            runSettings.outputDirectory, os.path.basename(file_name)
+        )
+    logging.info("")
+
+    returnVal, templateTree, codebookText, columnSchema = loadTemplate(
+        context, cacheFilename, cachedTemplate, inFile, guiVersion, matchedPair
+    )
+    if returnVal < 0:
+        return returnVal
+
+    returnVal = printCodebook(
+        codebookText, outputName, context.outputEncoding, runSettings.codebookPolicy
+    )
+    if returnVal < 0:
+        return returnVal
+    logging.debug("The collated csv has %d columns.", len(columnSchema))
+    context.columnIndex = {name: i for i, name in enumerate(columnSchema)}
+
+    context.numberOfBatchesString = str(numToMake)
+    context.numberOfResumesPerBatchString = str(numDifferent)
+    context.totalNumberOfResumesString = str(numToMake * numDifferent)
+    context.templateFilename = file_name
+    context.currentTime = current_time
+    context.guiVersion = guiVersion
+    context.templateTree = templateTree
+    context.columnSchema = columnSchema
+    context.seed = runSettings.seed
+    context.randomMode = runSettings.randomMode
+    if context.randomMode == "vectorized":
+        if numpy is None:
+            logging.error(
+                "\nError! The vectorized random mode requires numpy.  Install numpy "
+                "(pip install numpy) or use a different random mode."
+            )
+            return -81
+        context.vectorizedPlan = makeVectorizedPlan(templateTree)
+        context.vectorizedSlots = {
+            section[0]: slot for slot, section in enumerate(context.vectorizedPlan)
+        }
+        logging.info(
+            "Drawing the choices of %d Random sections for %d resumes at a time.",
+            len(context.vectorizedPlan),
+            vectorizedBlockSize,
+        )
+    context.assignment = runSettings.assignment
+    if context.assignment == "search":
+        context.conflictLabels = makeConflictLabels(templateTree)
+    batchNumbers = range(1, numToMake + 1)
+    collatedSuffix = ""
+    if runSettings.regenerateBatches is not None:
+        if context.seed is None:
+            logging.error(
+                "\nError! Regenerating batches requires the random seed of the run "
+                "that first generated them."
+            )
+            return -77
+        batchNumbers = sorted(set(runSettings.regenerateBatches))
+        if (batchNumbers[0] < 1) or (batchNumbers[-1] > numToMake):
+            logging.error(
+                "\nError! Can only regenerate batches 1 through %d, not %d.",
+                numToMake,
+                batchNumbers[0] if batchNumbers[0] < 1 else batchNumbers[-1],
+            )
+            return -78
+        collatedSuffix = "_regenerated"
+    if runSettings.ledgerFilename is not None:
+        if runSettings.regenerateBatches is not None:
+            logging.error(
+                "\nError! Batches cannot be regenerated with a ledger, because their "
+                "choices depend on the choices counted in the ledger before them."
+            )
+            return -87
+        retval = createLedger(runSettings.ledgerFilename)
+        if retval < 0:
+            return retval
+        context.ledgerFilename = runSettings.ledgerFilename
+        context.ledgerKey = os.path.basename(file_name)
+        context.ledgerSections = makeLedgerSections(templateTree)
+        logging.info(
+            "Counting the choices of %d Random sections in the ledger %s.",
+            len(context.ledgerSections),
+            context.ledgerFilename,
+        )
+    if context.seed is None:
+        context.seed = random.getrandbits(64)
+    logging.info("The random seed is %d", context.seed)
+    context.choicesOnly = runSettings.choicesOnly
+    context.logChoices = threadLogsLevel(logging.DEBUG)
+    context.threadLogLevel = getThreadLogLevel()
+    if runSettings.choicesOnly:
+        # nothing is written for each resume, so its filenames (only saved in the collated csv) are not checked against existing files, and are only made as each batch is generated
+        batchFilenames = (
+            (
+                batchNumber,
+                list(
+                    zip(
+                        *makeNameArrays(
+                            numDifferent,
+                            outputName[:-4] + time_in_file_name,
+                            str(batchNumber).zfill(len(str(numToMake))),
+                            matchedPair,
+                        )
+                    )
+                ),
+            )
+            for batchNumber in batchNumbers
+        )
+    else:
+        batchFilenames = []
+        claimedFilenames = set()
+        for batchNumber in batchNumbers:
+            filenames = createFilenames(
+                outputName,
+                time_in_file_name,
+                len(str(numToMake)),
+                numDifferent,
+                matchedPair,
+                batchNumber,
+                claimedFilenames,
+            )
+            batchFilenames.append((batchNumber, filenames))
+
+    collatedFilename = (
+        outputName[:-4] + "_collated_" + current_time + collatedSuffix + ".csv"
+    )
+    logging.info("Saving the collated data in a file named %s", collatedFilename)
+    returnVal, collatedChoices = openCollatedCsv(columnSchema, collatedFilename)
+    if returnVal < 0:
+        return returnVal
+    if runSettings.workers > 1:
+        retval = generateBatchesInParallel(
+            context, batchFilenames, collatedChoices, runSettings.workers
+        )
+    else:
+        for batchNumber, filenames in batchFilenames:
+            retval, choiceRows = generateBatch(context, batchNumber, filenames)
+            for choiceRow in choiceRows:
+                addCollatedRow(collatedChoices, choiceRow)
+            if retval < 0:
+                break
+    if context.ledger is not None:
+        context.ledger.close()
+    elif (context.ledgerFilename is not None) and (runSettings.workers > 1):
+        # the workers do not close the ledger, so close it once here to fold the write-ahead log back into it
+        createLedger(context.ledgerFilename)
+    if retval < 0:
+        closeCollatedCsv(collatedChoices, False)
+        return retval
+    closeCollatedCsv(collatedChoices, True)
+    return 1
+
+
+def generateBatch(context, batchNumber, filenames):
+    """
+    Generates one batch of matched resumes, with their .sav, .txt, and .csv files.
+
+    Each resume draws from its own random stream, derived from the run's seed, the batch number, and the resume's index in the batch, so it does not matter which batches were generated before it, or in which process.
+    With context.choicesOnly, only the choices are made, and no files are written.
+    With --assignment search, the choices of the whole batch are searched for first (see searchBatch), and with --ledger they are counted in the ledger first (see reserveLedgerBatch), so nothing is written for a batch whose choices fail.
+    If the files of a batch counted in the ledger are not all written, its choices are subtracted from the ledger again; otherwise they are kept in context.ledgerReserved, in case the batch is removed later (see generateBatchesInParallel).
+    Returns the error code (negative on failure) and the ChoiceRow of each resume generated.
+    """
+    retval = 1
+    context.ledgerReserved = None
+    if context.ledgerFilename is not None:
+        retval = reserveLedgerBatch(context, batchNumber)
+    elif context.assignment == "search":
+        retval = searchBatch(context, batchNumber)
+    if retval < 0:
+        return retval, []
+    if context.ledgerFilename is None:
+        return writeBatch(context, batchNumber, filenames)
+    reserved = {
+        label: dict(selections)
+        for label, selections in context.ledgerSelections.items()
+    }
+    try:
+        retval, choiceRows = writeBatch(context, batchNumber, filenames)
+    except BaseException:
+        releaseLedgerBatches(context, [reserved])
+        raise
+    if retval < 0:
+        releaseLedgerBatches(context, [reserved])
+    else:
+        context.ledgerReserved = reserved
+    return retval, choiceRows
+
+
+def writeBatch(context, batchNumber, filenames):
+    """
+    Writes the files of one batch of matched resumes (see generateBatch), once any search or ledger has made its choices.
+
+    Returns the error code (negative on failure) and the ChoiceRow of each resume generated.
+    """
+    numDifferent = int(context.numberOfResumesPerBatchString)
+    firstRow = startBatch(context, batchNumber)
+    choiceRows = []
+    for resumeNumber, [
+        outputFilename,
+        saveChoicesFilename,
+        txtChoicesFilename,
+        csvChoicesFilename,
+    ] in enumerate(filenames, 1):
+        startResume(context, batchNumber, resumeNumber, firstRow)
+        csvFilename = outputFilename
+        if "," in csvFilename:
+            csvFilename = csvFilename.replace(",", "")
+            logging.warning(
+                "\nWarning! the filename contained a comma, which is a delimiter in "
+                "csv (comma-separated-variables) files.  So in the csv file (and "
+                "only inside the csv file), the comma has been removed from the "
+                "filename.\n\n"
+            )
+        context.choiceRow = ChoiceRow(
+            [
+                csvFilename,
+                context.batchString,
+                context.numberOfBatchesString,
+                context.thisResumeNumberString,
+                context.numberOfResumesPerBatchString,
+                context.currentTime,
+                str(context.seed),
+            ],
+            len(context.columnSchema),
+        )
+        if context.choicesOnly:
+            retval = generateResumeText(context)
+            if retval < 0:
+                print(
+                    "\nError! Problem with the template file.  Error code "
+                    + str(retval)
+                )
+                return retval, choiceRows
+            choiceRows.append(context.choiceRow)
+            continue
+        saveChoicesFile = open(
+            saveChoicesFilename, "wt", encoding=context.outputEncoding
+        )
+        print(
+            outputFilename + " is the text file that these choices created.",
+            file=saveChoicesFile,
+        )
+        print(
+            context.templateFilename + " is the template file being used.",
+            file=saveChoicesFile,
+        )
+        print(
+            context.currentTime
+            + " is the current time as year, month, day, hour (out of 24), minute, second.",
+            file=saveChoicesFile,
+        )
+        print(
+            str(Version) + " is the version of the Python program.",
+            file=saveChoicesFile,
+        )
+        print(context.guiVersion.rstrip("\n"), file=saveChoicesFile)
+        print(
+            str(numDifferent) + " is the number of text files being Matched.",
+            file=saveChoicesFile,
+        )
+        print(
+            context.numberOfBatchesString + " is the number of batches.",
+            file=saveChoicesFile,
+        )
+        print(
+            context.thisResumeNumberString
+            + " is the index of this text file within a matched set.",
+            file=saveChoicesFile,
+        )
+        print(
+            str(context.seed) + " is the random seed.",
+            file=saveChoicesFile,
+        )
+        print(
+            context.batchString
+            + " "
+            + context.thisResumeNumberString
+            + " is the random stream of this text file (its batch, and its index within the batch).",
+            file=saveChoicesFile,
+        )
+        print(
+            context.randomMode
+            + " is the random mode ("
+            + randomModeDescriptions[context.randomMode]
+            + ").",
+            file=saveChoicesFile,
+        )
+        print(
+            context.assignment
+            + " is the assignment of the choices ("
+            + assignmentDescriptions[context.assignment]
+            + ").",
+            file=saveChoicesFile,
+        )
+        print(
+            "Read the following lines in pairs.  The first line is the start tag (from the template file) that required a choice.  The start tag line contains the type of section that required a decision (currently only 'Random' sections require decisions), then the label of this section as shown in the outline in the web-based meta-program, then the number of subsections to choose from, and then any settings for this section (e.g., repeating or matched files).  The second line is the index of the subsection that was randomly chosen.  The indices run from 0 through n-1, inclusive, where n is the number of choices listed in the start tag line.  All of the choices are also stored in the .txt file, and in the .csv file with variable names based on the section IDs.",
+            file=saveChoicesFile,
+        )
+        txtChoicesFile = open(txtChoicesFilename, "wt", encoding=context.outputEncoding)
+        print(outputFilename, file=txtChoicesFile, end="")
+        csvChoicesFile = open(csvChoicesFilename, "wt", encoding=context.outputEncoding)
+        outputFile = EncodedOutput(outputFilename, context)
+        context.outFile = outputFile
+        context.saveChoicesFile = saveChoicesFile
+        context.txtChoicesFile = txtChoicesFile
+        retval = generateResumeText(context)
+        outputFile.close()
+        if retval < 0:
+            print(
+                str(retval) + " is the error code...this template file had a problem",
+                file=saveChoicesFile,
+            )
+            print("\t" + str(retval), file=txtChoicesFile)
+            print("\nError! Problem with the template file.  Error code " + str(retval))
+            saveChoicesFile.close()
+            txtChoicesFile.close()
+            csvChoicesFile.close()
+            return retval, choiceRows
+        saveChoicesFile.close()
+        txtChoicesFile.close()
+        writeChoiceRow(context.choiceRow, context.columnSchema, csvChoicesFile)
+        csvChoicesFile.close()
+        choiceRows.append(context.choiceRow)
+        logging.info("Done with resume %s", outputFilename)
+
+    return 1, choiceRows
+
+
+def startBatch(context, batchNumber):
+    """
+    Starts a batch with no choices made (except those counted in the --ledger by other batches), drawing its block of vectorized choices if it has not been drawn.
+
+    Returns the row of the batch's first resume in the block of vectorized choices.
+    """
+    context.batchSeed = deriveSeed(context.seed, batchNumber)
+    context.dictionaryMatchSame = {}
+    context.dictionaryMatchDifferent = {}
+    context.dictionaryMatchOnlyOneEver = {}
+    context.dictionaryMaxSelectionsPerSubPoint = {}
+    if context.ledgerFilename is not None:
+        startLedgerBatch(context)
+    if context.search is not None:
+        context.search.depth = 0
+    if len(context.vectorizedPlan) == 0:
+        return 0
+    numDifferent = int(context.numberOfResumesPerBatchString)
+    batchesPerBlock = max(1, vectorizedBlockSize // numDifferent)
+    if context.vectorizedBlock != (batchNumber - 1) // batchesPerBlock:
+        drawVectorizedBlock(context, (batchNumber - 1) // batchesPerBlock)
+    return ((batchNumber - 1) % batchesPerBlock) * numDifferent
+
+
+def startResume(context, batchNumber, resumeNumber, firstRow):
+    """
+    Starts a resume of the batch: its special text values, its random stream, and its vectorized choices.
+    """
+    setSpecialTextValues(context, batchNumber, resumeNumber)
+    context.resumeSeed = deriveSeed(context.batchSeed, context.thisResumeNumber)
+    context.rng = random.Random(context.resumeSeed)
+    if len(context.vectorizedPlan) > 0:
+        context.vectorizedChoices = [
+            blockChoices[firstRow + resumeNumber - 1]
+            for blockChoices in context.vectorizedBlockChoices
+        ]
+        context.vectorizedCursors = [0] * len(context.vectorizedPlan)
+
+
+def setSpecialTextValues(context, batchNumber, resumeNumber):
+    """
+    Sets the batch and resume numbers that the Leaf special texts (e.g., %batch% and %resumecountoverbatches%) are replaced with.
+    """
+    context.batchString = str(batchNumber)
+    context.batchPaddedString = context.batchString.zfill(
+        len(context.numberOfBatchesString)
+    )
+    context.thisResumeNumber = resumeNumber
+    context.thisResumeNumberString = str(resumeNumber)
+    context.thisResumeNumberPaddedString = context.thisResumeNumberString.zfill(
+        len(context.numberOfResumesPerBatchString)
+    )
+    context.resumeCountOverBatchesString = str(
+        (batchNumber - 1) * int(context.numberOfResumesPerBatchString) + resumeNumber
+    )
+    context.resumeCountOverBatchesPaddedString = (
+        context.resumeCountOverBatchesString.zfill(
+            len(context.totalNumberOfResumesString)
+        )
+    )
+
+
+def generateResumeText(context):
+    """
+    Writes the text of one resume to context.outFile, starting from empty store/recall variables and no choices made.
+
+    Returns the error code (negative on failure).
+    """
+    context.memory = {}
+    context.delayedWrite = DelayedWrite()
+    context.dictRangeChoices = {}
+    context.dictionaryRepeatSame = {}
+    context.dictionaryRepeatNever = {}
+    context.dictionaryLastChoice = {}
+    retval = recursiveGenerate(context, context.templateTree, "", "", "", "", "")
+    if (retval >= 0) and (len(context.delayedWrite.pendingLabels) > 0):
+        firstLabel = context.delayedWrite.pendingLabels[
+            min(context.delayedWrite.pendingLabels)
+        ]
+        logging.error(
+            'Error! A Leaf contains special text that refers to the "next" '
+            "value of a repeating section, but the section to which it refers "
+            "is not repeating:\n%s",
+            "%next%" + ("" if firstLabel is None else firstLabel + "%"),
+        )
+        retval = -40
+    return retval
+
+
+def makeConflictLabels(templateTree):
+    """
+    Finds, for each Random section, the labels of the Random sections whose choices can change whether it chooses, and which choices it can make: itself, the Random sections it is inside, and the sections that the Dependent sections it is inside depend on.
+
+    Returns a dictionary of label -> set of labels, for --assignment search.
+    """
+    conflictLabels = {}
+    makeConflictLabelsSection(templateTree, set(), conflictLabels)
+    return conflictLabels
+
+
+def makeConflictLabelsSection(node, parentLabels, conflictLabels):
+    """
+    Adds this section (and its subsections) to conflictLabels, given the labels whose choices can change whether this section is visited.
+    """
+    if isinstance(node, LeafNode):
+        return
+    if isinstance(node, RandomNode):
+        parentLabels = parentLabels | {node.label}
+        conflictLabels[node.label] = parentLabels
+    elif isinstance(node, DependentNode):
+        parentLabels = parentLabels | conflictLabels.get(
+            node.masterLabel, {node.masterLabel}
+        )
+    for child in node.children:
+        makeConflictLabelsSection(child, parentLabels, conflictLabels)
+
+
+class SearchDecision:
+    """
+    A choice made during a BatchSearch, with the choices it could have made instead.
+    """
+
+    def __init__(self, label, candidates, chosenSubelement):
+        self.label = label
+        self.candidates = candidates  # bitset of the choices that obeyed the settings
+        # bitset of the choices that led to a section that could not choose
+        self.tried = 0
+        self.chosenSubelement = chosenSubelement  # None until it is made again
+        # indexes of the earlier decisions that could have prevented those failures
+        self.conflicts = set()
+
+
+class BatchSearch:
+    """
+    The search for choices of a batch that obey all of the Match and Repeat settings (--assignment search).
+    """
+
+    def __init__(self, conflictLabels):
+        self.conflictLabels = conflictLabels  # see makeConflictLabels
+        self.decisions = []  # the SearchDecisions of the current attempt, in order
+        self.depth = 0  # how many of the decisions the current attempt has made
+        self.failedLabel = None  # the Random section that could not choose
+        self.attempts = 0
+
+
+def makeBatchChoices(context, batchNumber, quiet):
+    """
+    Makes the choices of every resume in the batch without writing anything, e.g., to check them before generateBatch makes the same choices again while writing the files.
+
+    With quiet, nothing is logged (not even errors).
+    Returns the error code (negative on failure).
+    """
+    numDifferent = int(context.numberOfResumesPerBatchString)
+    choicesOnly = context.choicesOnly
+    logChoices = context.logChoices
+    context.choicesOnly = True
+    logLevel = None
+    if quiet:
+        context.logChoices = False
+        logLevel = setThreadLogLevel(logging.CRITICAL)
+    try:
+        firstRow = startBatch(context, batchNumber)
+        for resumeNumber in range(1, numDifferent + 1):
+            startResume(context, batchNumber, resumeNumber, firstRow)
+            context.choiceRow = ChoiceRow([], len(context.columnSchema))
+            retval = generateResumeText(context)
+            if retval < 0:
+                break
+    finally:
+        if logLevel is not None:
+            setThreadLogLevel(logLevel)
+        context.choicesOnly = choicesOnly
+        context.logChoices = logChoices
+    return retval
+
+
+def searchBatch(context, batchNumber):
+    """
+    Searches for choices for every resume in the batch that obey all of the Match and Repeat settings, before any of the batch's files are written.
+
+    Each attempt makes the choices of the whole batch (see makeBatchChoices), drawing each choice as usual.  When a Random section cannot choose, the search jumps back to the latest choice that could have changed that (see makeConflictLabels) and draws one of its other choices, so the search only fails if no choices obey the settings.  The choices found are left in context.search, and generateBatch makes them again while writing the files.
+    Returns the error code (negative on failure).
+    """
+    search = BatchSearch(context.conflictLabels)
+    context.search = search
+    while True:
+        search.failedLabel = None
+        # the sections that cannot choose during the search log errors, but are only dead ends
+        retval = makeBatchChoices(context, batchNumber, True)
+        if retval >= 0:
+            break
+        if search.failedLabel is None:
+            # make the same choices again to log the error
+            retval = makeBatchChoices(context, batchNumber, False)
+            break
+        search.attempts += 1
+        if search.attempts >= searchMaxAttempts:
+            retval = -86
+            break
+        if not backjumpSearch(search):
+            retval = -85
+            break
+    if retval == -85:
+        logging.error(
+            "\nError! No choices for batch %s obey all of the Match and Repeat "
+            "settings.  However the other choices are made, the Random section %s "
+            "cannot make a choice.  Add more choices to it, reduce the number of "
+            "matched files, or reduce the number of repetitions (check for nested "
+            "repeating sections).",
+            batchNumber,
+            search.failedLabel,
+        )
+    elif retval == -86:
+        logging.error(
+            "\nError! Gave up searching for choices for batch %s that obey all of "
+            "the Match and Repeat settings, after %d attempts.  The last attempt "
+            "failed at the Random section %s.  Add more choices to it, reduce the "
+            "number of matched files, or reduce the number of repetitions (check for "
+            "nested repeating sections).",
+            batchNumber,
+            search.attempts,
+            search.failedLabel,
+        )
+    elif search.attempts > 0:
+        logging.info(
+            "Found choices for batch %s after %d dead ends.",
+            batchNumber,
+            search.attempts,
+        )
+    return retval
+
+
+def backjumpSearch(search):
+    """
+    Goes back to the latest decision that could have prevented search.failedLabel from choosing, and marks its choice as tried, so the next attempt draws one of its other choices.
+
+    If that decision has no other choices, goes back further, to the latest decision that could have prevented any of its failures (conflict-directed backjumping).
+    Returns False if there is no decision left to change, i.e., no choices obey the settings.
+    """
+    failedLabels = search.conflictLabels[search.failedLabel]
+    conflicts = {
+        i
+        for i, decision in enumerate(search.decisions)
+        if decision.label in failedLabels
+    }
+    while len(conflicts) > 0:
+        latest = max(conflicts)
+        conflicts.discard(latest)
+        decision = search.decisions[latest]
+        del search.decisions[latest + 1 :]
+        decision.conflicts |= conflicts
+        decision.tried |= 1 << decision.chosenSubelement
+        if decision.candidates & ~decision.tried:
+            decision.chosenSubelement = None
+            return True
+        # its candidates were also limited by the earlier decisions it conflicts with
+        decisionLabels = search.conflictLabels[decision.label]
+        conflicts = decision.conflicts | {
+            i for i in range(latest) if search.decisions[i].label in decisionLabels
+        }
+    return False
+
+
+def searchChoice(context, myLabel, myNumChoices, candidates, chosenSubelement, options):
+    """
+    Makes a choice during a BatchSearch: the choice of this decision in the current attempt, a choice it has not tried yet, or (for a new decision) the choice that was drawn.
+
+    candidates is the bitset of the choices that obey the section's settings.
+    """
+    search = context.search
+    if search.depth < len(search.decisions):
+        decision = search.decisions[search.depth]
+        if decision.chosenSubelement is None:
+            untried = decision.candidates & ~decision.tried
+            decision.chosenSubelement = sampleFreeChoice(
+                context.rng, myNumChoices, ((1 << myNumChoices) - 1) & ~untried, options
+            )
+        chosenSubelement = decision.chosenSubelement
+    else:
+        search.decisions.append(SearchDecision(myLabel, candidates, chosenSubelement))
+    search.depth += 1
+    return chosenSubelement
+
+
+def makeLedgerSections(templateTree):
+    """
+    Finds the Random sections whose choices are counted in the --ledger: those with Max Selections Per Sub-Point or Match Only One Ever.
+
+    Returns a dictionary of label -> RandomNode.
+    """
+    ledgerSections = {}
+    makeLedgerSectionsSection(templateTree, ledgerSections)
+    return ledgerSections
+
+
+def makeLedgerSectionsSection(node, ledgerSections):
+    """
+    Adds the Random sections counted in the ledger in this section (and its subsections) to ledgerSections.
+    """
+    if isinstance(node, LeafNode):
+        return
+    if isinstance(node, RandomNode) and (
+        node.options.matchMaxSelectionsPerSubPoint or node.options.matchOnlyOneEver
+    ):
+        ledgerSections[node.label] = node
+    for child in node.children:
+        makeLedgerSectionsSection(child, ledgerSections)
+
+
+def openLedger(ledgerFilename):
+    """
+    Opens the ledger, creating its table if it is new.  Transactions are started explicitly (see reserveLedgerBatch).
+    """
+    ledger = sqlite3.connect(
+        ledgerFilename, timeout=ledgerTimeout, isolation_level=None
+    )
+    # with write-ahead logging, committing a batch's counts does not wait for the whole file to be synced
+    ledger.execute("PRAGMA journal_mode=WAL")
+    ledger.execute("PRAGMA synchronous=NORMAL")
+    ledger.execute(
+        "CREATE TABLE IF NOT EXISTS selections (template TEXT NOT NULL, label TEXT "
+        "NOT NULL, choice INTEGER NOT NULL, count INTEGER NOT NULL, PRIMARY KEY "
+        "(template, label, choice)) WITHOUT ROWID"
+    )
+    return ledger
+
+
+def createLedger(ledgerFilename):
+    """
+    Checks that the ledger can be opened, creating it if needed, before any batch is generated.
+
+    Returns the error code (negative on failure).
+    """
+    try:
+        openLedger(ledgerFilename).close()
+    except sqlite3.Error as e:
+        logging.error("\nError opening the ledger named %s\n%s", ledgerFilename, e)
+        return -88
+    return 1
+
+
+def reserveLedgerBatch(context, batchNumber):
+    """
+    Makes the choices of the batch (searching for them with --assignment search) and adds them to the counts in the ledger, in one transaction.
+
+    The transaction keeps other processes from using the ledger until the batch's choices are counted, so every batch sees the choices of the batches counted before it, and a quota is never exceeded by batches generated at the same time.  Only the choices are made while the ledger is locked; the files are written afterwards, from the same counts (context.ledgerSnapshot), and the choices are subtracted again if the batch's files are not written or are removed (see releaseLedgerBatches).
+    Returns the error code (negative on failure).
+    """
+    try:
+        if context.ledger is None:
+            context.ledger = openLedger(context.ledgerFilename)
+        ledger = context.ledger
+        ledger.execute("BEGIN IMMEDIATE")
+        try:
+            # the counts are only read again if another process has changed them
+            version = ledger.execute("PRAGMA data_version").fetchone()[0]
+            if version != context.ledgerVersion:
+                readLedgerSnapshot(context)
+                context.ledgerVersion = version
+            else:
+                addLedgerSelections(context)
+            if context.assignment == "search":
+                retval = searchBatch(context, batchNumber)
+            else:
+                retval = makeBatchChoices(context, batchNumber, True)
+                if retval < 0:
+                    # make the same choices again to log the error
+                    retval = makeBatchChoices(context, batchNumber, False)
+            if retval >= 0:
+                ledger.executemany(
+                    "INSERT INTO selections (template, label, choice, count) VALUES "
+                    "(?, ?, ?, ?) ON CONFLICT (template, label, choice) DO UPDATE SET "
+                    "count = count + excluded.count",
+                    [
+                        (context.ledgerKey, label, choice, count)
+                        for label, selections in context.ledgerSelections.items()
+                        for choice, count in selections.items()
+                    ],
+                )
+                ledger.execute("COMMIT")
+            else:
+                ledger.execute("ROLLBACK")
+                context.ledgerSelections = {}
+        except BaseException:
+            if ledger.in_transaction:
+                ledger.execute("ROLLBACK")
+            context.ledgerVersion = None
+            raise
+    except sqlite3.Error as e:
+        logging.error(
+            "\nError updating the ledger named %s for batch %s\n%s",
+            context.ledgerFilename,
+            batchNumber,
+            e,
+        )
+        return -88
+    return retval
+
+
+def releaseLedgerBatches(context, batchSelections):
+    """
+    Subtracts the choices of batches that were counted in the ledger (see reserveLedgerBatch) but whose files were not written or were removed, so they do not use up the quotas.
+
+    batchSelections is a list of the ledgerSelections of each batch: label -> {choice: count}.
+    Returns the error code (negative on failure).
+    """
+    rows = [
+        (count, context.ledgerKey, label, choice)
+        for selections in batchSelections
+        for label, choices in selections.items()
+        for choice, count in choices.items()
+        if count > 0
+    ]
+    # this process's counts are read again before its next batch
+    context.ledgerVersion = None
+    context.ledgerSelections = {}
+    if len(rows) == 0:
+        return 1
+    try:
+        if context.ledger is None:
+            context.ledger = openLedger(context.ledgerFilename)
+        ledger = context.ledger
+        ledger.execute("BEGIN IMMEDIATE")
+        try:
+            ledger.executemany(
+                "UPDATE selections SET count = count - ? WHERE template = ? AND "
+                "label = ? AND choice = ?",
+                rows,
+            )
+            ledger.execute("COMMIT")
+        except BaseException:
+            if ledger.in_transaction:
+                ledger.execute("ROLLBACK")
+            raise
+    except sqlite3.Error as e:
+        logging.error(
+            "\nError subtracting the choices of %d batches that were not generated "
+            "from the ledger named %s\n%s",
+            len(batchSelections),
+            context.ledgerFilename,
+            e,
+        )
+        return -88
+    logging.info(
+        "Subtracted the choices of %d batches that were not generated from the "
+        "ledger.",
+        len(batchSelections),
+    )
+    return 1
+
+
+def readLedgerSnapshot(context):
+    """
+    Reads the counts of the choices of the template's sections from the ledger into context.ledgerSnapshot.
+    """
+    context.ledgerSnapshot = {
+        label: [[0] * node.numChoices, 0, 0]
+        for label, node in context.ledgerSections.items()
+    }
+    for label, choice, count in context.ledger.execute(
+        "SELECT label, choice, count FROM selections WHERE template = ?",
+        (context.ledgerKey,),
+    ):
+        if label in context.ledgerSnapshot:
+            addLedgerCount(context, label, choice, count)
+    context.ledgerSelections = {}
+
+
+def addLedgerSelections(context):
+    """
+    Adds the choices of the last batch this process counted in the ledger to context.ledgerSnapshot, instead of reading every count again.
+    """
+    for label, selections in context.ledgerSelections.items():
+        for choice, count in selections.items():
+            addLedgerCount(context, label, choice, count)
+    context.ledgerSelections = {}
+
+
+def addLedgerCount(context, label, choice, count):
+    """
+    Adds count choices of choice to the section's counts in context.ledgerSnapshot: [list of the number of times each choice was made, bitset of the choices made the maximum number of times, bitset of the choices made at all].
+    """
+    snapshot = context.ledgerSnapshot[label]
+    counts = snapshot[0]
+    if choice >= len(counts):
+        return
+    counts[choice] += count
+    options = context.ledgerSections[label].options
+    if options.matchMaxSelectionsPerSubPoint and (
+        counts[choice] >= options.maxSelectionsPerSubPointInteger
+    ):
+        snapshot[1] |= 1 << choice
+    if counts[choice] > 0:
+        snapshot[2] |= 1 << choice
+
+
+def startLedgerBatch(context):
+    """
+    Starts the counts of a batch from the counts in the ledger: a choice made the maximum number of times by other batches cannot be made again (Max Selections Per Sub-Point), and neither can any choice made by another batch (Match Only One Ever).
+    """
+    context.ledgerSelections = {}
+    for label, [counts, reachedMax, taken] in context.ledgerSnapshot.items():
+        context.ledgerSelections[label] = {}
+        options = context.ledgerSections[label].options
+        if options.matchMaxSelectionsPerSubPoint:
+            context.dictionaryMaxSelectionsPerSubPoint[label] = [
+                counts.copy(),
+                reachedMax,
+            ]
+        if options.matchOnlyOneEver and taken:
+            context.dictionaryMatchOnlyOneEver[label] = [taken, taken, {}]
+
+
+def initBatchWorker(context):
+    """
+    Keeps the run's context in a worker process, so it is sent to each worker only once.
+    """
+    global batchWorkerContext
+    batchWorkerContext = context
+    setThreadLogLevel(context.threadLogLevel)
+
+
+def generateBatchInWorker(batchNumber, filenames):
+    """
+    Generates one batch in a worker process, using the context from initBatchWorker.
+
+    Returns the error code, the ChoiceRows, and the choices the batch counted in the --ledger (see generateBatch).
+    """
+    retval, choiceRows = generateBatch(batchWorkerContext, batchNumber, filenames)
+    return retval, choiceRows, batchWorkerContext.ledgerReserved
+
+
+def deriveSeed(seed, streamId):
+    """
+    Returns the seed of an independent random stream, derived from a parent seed and the stream's number.
+
+    Hashing keeps the derived streams unrelated to each other, unlike seeds that just count up from the parent seed.
+    """
+    digest = hashlib.sha256((str(seed) + ":" + str(streamId)).encode("utf-8"))
+    return int.from_bytes(digest.digest()[:8], "big")
+
+
+def makeVectorizedPlan(templateTree):
+    """
+    Finds the Random sections whose choices do not depend on any other choice (no matching, and no repeat settings other than *repeat* itself), so their choices can be drawn for many resumes at once.
+
+    Returns the label, number of choices, *nonUniformFirstSubPoint* percentage (None if uniform), alias table of its *weights* (None if not weighted), and the most times it can be visited in one resume, of each such section.
+    """
+    plan = []
+    makeVectorizedPlanSection(templateTree, 1, plan)
+    return plan
+
+
+def makeVectorizedPlanSection(node, visits, plan):
+    """
+    Appends the unconstrained Random sections in this section (and its subsections) to the plan, given the most times this section can be visited.
+    """
+    if isinstance(node, LeafNode):
+        return
+    if isinstance(node, RandomNode):
+        options = node.options
+        if options.repeat:
+            visits *= len(options.repeatRange)
+        if (
+            (visits <= vectorizedMaxVisits)
+            and not (
+                options.repeatSame
+                or options.repeatNever
+                or options.repeatDifferentDouble
+                or options.matchSame
+                or options.matchDifferent
+                or options.matchOnlyOneEver
+                or options.matchMaxSelectionsPerSubPoint
+            )
+            and not (
+                options.repeat
+                and (
+                    (options.minimumNumberOfEntries > 0)
+                    or (options.maximumNumberOfEntries > 0)
+                )
+            )
+        ):
+            plan.append(
+                [
+                    node.label,
+                    node.numChoices,
+                    (
+                        options.nonUniformFirstSubPointPercentage
+                        if options.nonUniformFirstSubPoint
+                        else None
+                    ),
+                    options.aliasTable,
+                    visits,
+                ]
+            )
+    for child in node.children:
+        makeVectorizedPlanSection(child, visits, plan)
+
+
+def drawVectorizedBlock(context, blockNumber):
+    """
+    Draws the choices of the sections in context.vectorizedPlan for a block of resumes, one numpy call per section.
+
+    Each block has its own random stream, derived from the run's seed and the block number, so any batch can be generated on its own, in any process.
+    The choices follow sampleFreeChoice: the first sub-point is chosen with the *nonUniformFirstSubPoint* percentage, otherwise one of the rest, all equally likely, and weighted sections are drawn from their alias tables.
+    """
+    numDifferent = int(context.numberOfResumesPerBatchString)
+    numResumes = max(1, vectorizedBlockSize // numDifferent) * numDifferent
+    generator = numpy.random.Generator(
+        numpy.random.PCG64(deriveSeed(context.seed, "block" + str(blockNumber)))
+    )
+    context.vectorizedBlockChoices = []
+    for section in context.vectorizedPlan:
+        label, numChoices, firstPercentage, aliasTable, maxVisits = section
+        size = (numResumes, maxVisits)
+        if aliasTable is not None:
+            probabilities = numpy.asarray(aliasTable[0])
+            aliases = numpy.asarray(aliasTable[1])
+            columns = generator.integers(0, numChoices, size)
+            choices = numpy.where(
+                generator.random(size) < probabilities[columns],
+                columns,
+                aliases[columns],
+            )
+        elif firstPercentage is None:
+            choices = generator.integers(0, numChoices, size)
+        elif numChoices == 1:
+            choices = numpy.zeros(size, dtype=numpy.int64)
+        else:
+            choices = numpy.where(
+                generator.random(size) * 100.0 < firstPercentage,
+                0,
+                generator.integers(1, numChoices, size),
+            )
+        context.vectorizedBlockChoices.append(choices.tolist())
+    context.vectorizedBlock = blockNumber
+
+
+def generateBatchesInParallel(context, batchFilenames, collatedChoices, workers):
+    """
+    Generates the batches in a pool of worker processes, adding their rows to the collated csv in batch order.
+
+    Only a few batches per worker are queued at a time, so memory does not grow with the number of batches.
+    Returns the error code of the first batch that failed, or 1.  The batches after a failed batch are removed, as if they had never been generated, and their choices are subtracted from the --ledger.
+    """
+    logging.info("Generating the batches in %d worker processes.", workers)
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers, initializer=initBatchWorker, initargs=(context,)
+    ) as executor:
+        pending = collections.deque()
+        batches = iter(batchFilenames)
+        retval = 1
+        while retval >= 0:
+            while len(pending) < 4 * workers:
+                batch = next(batches, None)
+                if batch is None:
+                    break
+                pending.append(
+                    (executor.submit(generateBatchInWorker, *batch), batch[1])
+                )
+            if len(pending) == 0:
+                break
+            retval, choiceRows, reserved = pending.popleft()[0].result()
+            for choiceRow in choiceRows:
+                addCollatedRow(collatedChoices, choiceRow)
+        for future, filenames in pending:
+            future.cancel()
+    # a serial run stops at the batch that failed, so remove any later batches that were already generated
+    removedSelections = []
+    for future, filenames in pending:
+        for filename in itertools.chain.from_iterable(filenames):
+            if os.path.isfile(filename):
+                os.remove(filename)
+        if (not future.cancelled()) and (future.exception() is None):
+            batchRetval, choiceRows, reserved = future.result()
+            if (batchRetval >= 0) and (reserved is not None):
+                removedSelections.append(reserved)
+    if len(removedSelections) > 0:
+        releaseLedgerBatches(context, removedSelections)
+    return retval
+
+
+class CollatedChoices:
+    """
+    The collated csv being written.
+    """
+
+    def __init__(self, collatedFilename, collatedFile):
+        self.collatedFilename = collatedFilename
+        self.collatedFile = collatedFile
+        self.writer = csv.writer(collatedFile, lineterminator=os.linesep)
+
+
+def openCollatedCsv(columnSchema, collatedFilename):
+    """
+    Creates the collated csv and writes its header.
+
+    Returns the error code (negative on failure) and the CollatedChoices.
+    """
+    try:
+        collatedFile = open(collatedFilename, "wt", encoding="utf-8", newline="")
+    except IOError as e:
+        logging.error(
+            "\nError creating collated csv file named %s\n%s", collatedFilename, e
+        )
+        return -73, None
+    collatedChoices = CollatedChoices(collatedFilename, collatedFile)
+    collatedChoices.writer.writerow(columnSchema)
+    return 1, collatedChoices
+
+
+def addCollatedRow(collatedChoices, choiceRow):
+    """
+    Writes the choices of one resume as a row of the collated csv.
+
+    A choice that the resume did not make is left empty.
+    """
+    collatedChoices.writer.writerow(
+        choiceRow.prefix
+        + [
+            str(choice) if choice else ""
+            for choice in choiceRow.choices[len(collatedFirstColumns) :]
+        ]
+    )
+
+
+class ChoiceRow:
+    """
+    The choices made for one resume, indexed by collated csv column id.
+    """
+
+    def __init__(self, prefix, numColumns):
+        self.prefix = prefix  # the values of the filename and batch columns
+        self.choices = array("i", bytes(4 * numColumns))  # 0 until chosen
+        self.order = []  # column ids in the order the choices were made
+
+
+def saveChoice(context, node, myVariableName, chosenSubelement):
+    """
+    Saves a section's choice in the resume's .sav, .txt, and csv files (only the csv files with context.choicesOnly).  A replayed resume already has its choices saved, so nothing is written.
+    """
+    if context.replayRecord is not None:
+        return 1
+    if not context.choicesOnly:
+        print(node.startLine, file=context.saveChoicesFile, end="")
+        print(chosenSubelement, file=context.saveChoicesFile)
+        print("\t" + str(chosenSubelement), file=context.txtChoicesFile, end="")
+    return recordChoice(context, myVariableName, chosenSubelement)
+
+
+def recordChoice(context, myVariableName, chosenSubelement):
+    """
+    Records the (1-based) choice for this variable in the resume's ChoiceRow.
+    """
+    columnId = context.columnIndex.get("v" + myVariableName.replace("-", "_"))
+    if columnId is None:
+        logging.error(
+            "\nError! The variable %s is not one of the columns found in the "
+            "template for the collated csv.",
+            myVariableName,
+        )
+        return -74
+    context.choiceRow.choices[columnId] = chosenSubelement + 1
+    context.choiceRow.order.append(columnId)
+    return 1
+
+
+def writeChoiceRow(choiceRow, columnSchema, csvChoicesFile):
+    """
+    Writes the choices of one resume to its csv file, in the order they were made.
+    """
+    csvChoicesFile.writelines(
+        [
+            ",".join(
+                collatedFirstColumns
+                + [columnSchema[columnId] for columnId in choiceRow.order]
+            ),
+            "\n",
+            ",".join(
+                choiceRow.prefix
+                + [str(choiceRow.choices[columnId]) for columnId in choiceRow.order]
+            ),
+        ]
+    )
+
+
+def closeCollatedCsv(collatedChoices, success):
+    """
+    Closes the collated csv, deleting it if the resumes were not all generated.
+    """
+    collatedChoices.collatedFile.close()
+    if not success:
+        os.remove(collatedChoices.collatedFilename)
+
+
+def sortColumnName(text):
+    """
+    Given a column name in the collated csv, returns a key for sorting.
+    """
+    result = [text]
+    if len(text) > 2 and text[0:3] == "v1_":
+        # If it is a section id, separate the numbers from the underscores and "iter"
+        result = ["v"]
+        split = text[1:].split("_")
+        for token in split:
+            if token.startswith("iter"):
+                token = token[4:]
+            number = json.loads(token)
+            result.append(number)
+    return result
+
+
+class ReplayRecord:
+    """
+    The choices saved for one resume, read from its .sav or csv file or from a row of a collated csv.
+    """
+
+    def __init__(
+        self,
+        recordFilename,
+        filename,
+        batchNumber,
+        numberOfBatches,
+        resumeNumber,
+        numberPerBatch,
+    ):
+        self.recordFilename = recordFilename  # the file the choices were read from
+        self.filename = filename  # the text file that the choices created
+        self.batchNumber = batchNumber
+        self.numberOfBatches = numberOfBatches
+        self.resumeNumber = resumeNumber
+        self.numberPerBatch = numberPerBatch
+        # from a csv, the (1-based) choices by collated csv column id, 0 if not chosen
+        self.choices = None
+        # from a .sav, the start tag line and (0-based) choice of each section, in the order chosen
+        self.sequence = None
+
+
+def replayResumes(file_name, recordFilenames, outputDirectory=None):
+    """
+    Generates the text files again from the choices saved in their .sav files, csv files, or collated csv files, without making any random choices.
+
+    Each text file is saved in outputDirectory, or else next to the file its choices were read from.
+    """
+    context = GenerationContext()
+    cacheFilename = templateCacheFilename(file_name)
+    cachedTemplate = loadTemplateCache(cacheFilename)
+    inFile = None
+    if cachedTemplate is None:
+        returnVal, inFile, guiVersion, matchedPair = readTemplateHeader(
+            context, file_name
+        )
+        if returnVal < 0:
+            return returnVal
+    else:
+        guiVersion = cachedTemplate["guiVersion"]
+        matchedPair = cachedTemplate["matchedPair"]
+    returnVal, templateTree, codebookText, columnSchema = loadTemplate(
+        context, cacheFilename, cachedTemplate, inFile, guiVersion, matchedPair
+    )
+    if returnVal < 0:
+        return returnVal
+    context.templateFilename = file_name
+    context.guiVersion = guiVersion
+    context.templateTree = templateTree
+    context.columnSchema = columnSchema
+    context.columnIndex = {name: i for i, name in enumerate(columnSchema)}
+    if outputDirectory is not None:
+        try:
+            os.makedirs(outputDirectory, exist_ok=True)
+        except OSError as e:
+            logging.error(
+                "\nError creating the output folder %s\n%s", outputDirectory, e
+            )
+            return -76
+
+    numReplayed = 0
+    for recordFilename in recordFilenames:
+        if not os.path.isfile(recordFilename):
+            logging.error(
+                "\nError! There is no file named %s to replay.", recordFilename
+            )
+            return -79
+        for returnVal, record in readReplayRecords(context, recordFilename):
+            if returnVal < 0:
+                return returnVal
+            outputFilename = os.path.join(
+                (
+                    outputDirectory
+                    if outputDirectory is not None
+                    else os.path.dirname(recordFilename)
+                ),
+                os.path.basename(record.filename),
+            )
+            returnVal = replayResume(context, record, outputFilename)
+            if returnVal < 0:
+                return returnVal
+            numReplayed += 1
+    logging.info("Replayed %d text files.", numReplayed)
+    return 1
+
+
+def replayResume(context, record, outputFilename):
+    """
+    Writes the text file of one ReplayRecord.  The text file is removed if its choices do not fit the template.
+    """
+    context.numberOfBatchesString = str(record.numberOfBatches)
+    context.numberOfResumesPerBatchString = str(record.numberPerBatch)
+    context.totalNumberOfResumesString = str(
+        record.numberOfBatches * record.numberPerBatch
+    )
+    setSpecialTextValues(context, record.batchNumber, record.resumeNumber)
+    context.replayRecord = record
+    context.rng = None
+    try:
+        context.outFile = EncodedOutput(outputFilename, context)
+    except OSError as e:
+        logging.error("\nError creating the text file %s\n%s", outputFilename, e)
+        return -80
+    retval = generateResumeText(context)
+    if (retval >= 0) and (record.sequence is not None) and (len(record.sequence) > 0):
+        logging.error(
+            "\nError! The record %s has more choices than the template makes.  The "
+            "first extra choice is for the section\n%s",
+            record.recordFilename,
+            record.sequence[0][0],
+        )
+        retval = -79
+    context.outFile.close()
+    if retval < 0:
+        os.remove(outputFilename)
+        return retval
+    logging.info("Replayed resume %s", outputFilename)
+    return 1
+
+
+def readReplayRecords(context, recordFilename):
+    """
+    Reads the saved choices of the resumes in a .sav file, a resume's csv file, or a collated csv.
+
+    Yields the error code (negative on failure) and each ReplayRecord.  The rows of a csv are read one at a time, so a collated csv can have any number of rows.
+    """
+    if recordFilename.lower().endswith(".sav"):
+        success, recordFile, encoding = openInputFile(recordFilename)
+        if not success:
+            yield -79, None
+            return
+        with recordFile:
+            yield readSaveChoicesRecord(
+                recordFilename, recordFile.readlines(), encoding
+            )
+        return
+    # the collated csv is always utf-8, and a resume's csv is in the output encoding, which only matters if its filename is not ascii (so fails before the first row is read)
+    numRead = 0
+    try:
+        for returnVal, record in readCsvRecords(context, recordFilename, "utf-8"):
+            numRead += 1
+            yield returnVal, record
+    except UnicodeDecodeError:
+        if numRead > 0:
+            logging.error("\nError! The file %s is not utf-8 encoded.", recordFilename)
+            yield -79, None
+            return
+        yield from readCsvRecords(context, recordFilename, context.outputEncoding)
+
+
+def readSaveChoicesRecord(recordFilename, lines, encoding):
+    """
+    Reads the ReplayRecord saved in the lines of a .sav file.
+
+    The .sav files saved before version 34 do not have the batch or the number of batches, so the batch is read from the text file's name, and the number of batches from the csv file saved next to the .sav file.
+    Returns the error code (negative on failure) and the ReplayRecord.
+    """
+    headerSuffixes = {
+        " is the text file that these choices created.": "filename",
+        " is the number of text files being Matched.": "numberPerBatch",
+        " is the index of this text file within a matched set.": "resume",
+        " is the number of batches.": "numberOfBatches",
+        " is the random stream of this text file (its batch, and its index within "
+        "the batch).": "stream",
+    }
+    header = {}
+    for lineNumber in range(len(lines)):
+        theLine = lines[lineNumber].rstrip("\n")
+        if theLine.startswith("Read the following lines in pairs."):
+            break
+        for suffix, key in headerSuffixes.items():
+            if theLine.endswith(suffix):
+                header[key] = theLine[: -len(suffix)]
+    else:
+        logging.error(
+            "\nError! The file %s does not look like a .sav file saved by this "
+            "program.",
+            recordFilename,
+        )
+        return -79, None
+    if ("filename" not in header) or ("numberPerBatch" not in header):
+        logging.error(
+            "\nError! The .sav file %s does not have the name of its text file and "
+            "the number of text files being Matched.",
+            recordFilename,
+        )
+        return -79, None
+    if "stream" not in header:
+        # e.g., template_2012-07-10_3_1of2.doc (matched) or template_2012-07-10_3.doc
+        match_object = re.search(
+            r"_(\d+)(?:_(\d+)of\d+)?$", os.path.splitext(header["filename"])[0]
+        )
+        if match_object is None:
+            logging.error(
+                "\nError! The .sav file %s does not have the batch of its text "
+                "file, and the batch is not in the name of its text file %s.  Replay "
+                "its csv file instead.",
+                recordFilename,
+                header["filename"],
+            )
+            return -79, None
+        header["stream"] = (
+            match_object.group(1)
+            + " "
+            + header.get("resume", match_object.group(2) or "1")
+        )
+    if "numberOfBatches" not in header:
+        numberOfBatches = readCsvNumberOfBatches(
+            os.path.splitext(recordFilename)[0] + ".csv", encoding
+        )
+        if numberOfBatches is None:
+            numberOfBatches = header["stream"].split(" ")[0]
+            logging.warning(
+                "Warning! The .sav file %s does not have the number of batches, and "
+                "neither does a csv file next to it, so its text file is replayed as "
+                "if there were %s batches (which only matters if it uses special text "
+                "such as %%numberofbatches%%).",
+                recordFilename,
+                numberOfBatches,
+            )
+        header["numberOfBatches"] = numberOfBatches
+    pairLines = lines[lineNumber + 1 :]
+    try:
+        batchNumber, resumeNumber = [int(x) for x in header["stream"].split(" ")]
+        record = ReplayRecord(
+            recordFilename,
+            header["filename"],
+            batchNumber,
+            int(header["numberOfBatches"]),
+            resumeNumber,
+            int(header["numberPerBatch"]),
+        )
+        if len(pairLines) % 2 != 0:
+            raise ValueError("the choices do not come in pairs")
+        record.sequence = collections.deque(
+            (pairLines[i].rstrip("\n"), int(pairLines[i + 1]))
+            for i in range(0, len(pairLines), 2)
+        )
+    except ValueError as e:
+        logging.error(
+            "\nError! Failed to read the choices in the .sav file %s (if its text "
+            "file could not be generated, the last line is the error code).\n%s",
+            recordFilename,
+            e,
+        )
+        return -79, None
+    return 1, record
+
+
+def readCsvNumberOfBatches(csvFilename, encoding):
+    """
+    Returns the number of batches saved in the first row of a resume's csv file, or None if there is no such file or it does not have the number.
+    """
+    try:
+        with open(csvFilename, "rt", encoding=encoding, newline="") as csvFile:
+            reader = csv.reader(csvFile)
+            header = next(reader, [])
+            row = next(reader, [])
+            return parseCsvInteger(row[header.index("numberOfBatches")])
+    except (OSError, UnicodeError, ValueError, IndexError):
+        return None
+
+
+def parseCsvInteger(text):
+    """
+    Parses a whole number in a csv file, also written as a decimal number (e.g., 1.0) by the pandas of earlier versions.  Raises ValueError if it is not a whole number.
+    """
+    try:
+        return int(text)
+    except ValueError:
+        number = float(text)
+        if not number.is_integer():
+            raise ValueError("%s is not a whole number" % text)
+        return int(number)
+
+
+def readCsvRecords(context, recordFilename, encoding):
+    """
+    Reads a ReplayRecord from each row of a resume's csv file or a collated csv.
+
+    Yields the error code (negative on failure) and each ReplayRecord.
+    """
+    with open(recordFilename, "rt", encoding=encoding, newline="") as recordFile:
+        reader = csv.reader(recordFile)
+        header = next(reader, [])
+        for name in header:
+            if name not in context.columnIndex:
+                logging.error(
+                    "\nError! The column %s of %s is not one of the columns found in "
+                    "the template.  Is it from a different template?",
+                    name,
+                    recordFilename,
+                )
+                yield -79, None
+                return
+        if not set(collatedFirstColumns[:5]).issubset(header):
+            logging.error(
+                "\nError! The file %s does not have the columns %s, so it is not a "
+                "csv file saved by this program.",
+                recordFilename,
+                ", ".join(collatedFirstColumns[:5]),
+            )
+            yield -79, None
+            return
+        prefixIndexes = [header.index(name) for name in collatedFirstColumns[:5]]
+        choiceColumns = [
+            (i, context.columnIndex[name])
+            for i, name in enumerate(header)
+            if name not in collatedFirstColumns
+        ]
+        for row in reader:
+            if len(row) == 0:
+                continue
+            try:
+                if len(row) != len(header):
+                    raise ValueError(
+                        "%d values for %d columns" % (len(row), len(header))
+                    )
+                [filename, batch, numberOfBatches, resume, numberPerBatch] = [
+                    row[i] for i in prefixIndexes
+                ]
+                record = ReplayRecord(
+                    recordFilename,
+                    filename,
+                    parseCsvInteger(batch),
+                    parseCsvInteger(numberOfBatches),
+                    parseCsvInteger(resume),
+                    parseCsvInteger(numberPerBatch),
+                )
+                record.choices = array("i", bytes(4 * len(context.columnSchema)))
+                for i, columnId in choiceColumns:
+                    # empty (or nan, from pandas) if the section was not chosen
+                    if row[i] not in ("", "nan", "NaN"):
+                        record.choices[columnId] = parseCsvInteger(row[i])
+            except ValueError as e:
+                logging.error(
+                    "\nError! Failed to read line %d of the csv file %s\n%s",
+                    reader.line_num,
+                    recordFilename,
+                    e,
+                )
+                yield -79, None
+                return
+            yield 1, record
+
+
+def replayChoice(context, node, myVariableName):
+    """
+    Returns the (0-based) choice that the resume being replayed saved for this section, or a negative error code.
+    """
+    record = context.replayRecord
+    if record.sequence is not None:
+        if len(record.sequence) == 0:
+            logging.error(
+                "\nError! The record %s ends before the choice for the section\n%s",
+                record.recordFilename,
+                node.startLine,
+            )
+            return -79
+        startLine, chosenSubelement = record.sequence.popleft()
+        if startLine != node.startLine.rstrip("\n"):
+            logging.error(
+                "\nError! The record %s saved a choice for the section\n%s\nbut the "
+                "template's next choice is for the section\n%s\nIs it from a "
+                "different template?",
+                record.recordFilename,
+                startLine,
+                node.startLine,
+            )
+            return -79
+    else:
+        columnId = context.columnIndex.get("v" + myVariableName.replace("-", "_"))
+        chosenSubelement = -1 if columnId is None else record.choices[columnId] - 1
+        if chosenSubelement < 0:
+            logging.error(
+                "\nError! The record of %s in %s has no choice for the variable %s.",
+                record.filename,
+                record.recordFilename,
+                myVariableName,
+            )
+            return -79
+    if chosenSubelement >= node.numChoices:
+        logging.error(
+            "\nError! The record %s chose element #%d for the section %s, which only "
+            "has %d subsections.",
+            record.recordFilename,
+            chosenSubelement,
+            myVariableName,
+            node.numChoices,
+        )
+        return -79
+    return chosenSubelement
+
+
+def recursiveGenerate(
+    context,
+    node,
+    myVariableName,
+    startString,
+    endString,
+    currentString,
+    currentPlusIntervalString,
+):
+    """
+    Recersively generates a 'resume' file from the compiled template, making all decisions and generating all outputs.
+    """
+
+    if isinstance(node, LeafNode) and context.choicesOnly:
+        return 1
+    if context.logChoices:
+        logging.debug(node.startLine)
+    if not myVariableName:
+        myVariableName = node.label
+
+    if isinstance(node, LeafNode):
+        return writeLeaf(
+            context,
+            node,
+            startString,
+            endString,
+            currentString,
+            currentPlusIntervalString,
+        )
+
+    if isinstance(node, RandomNode):
+        return writeRandom(
+            context,
+            node,
+            myVariableName,
+            startString,
+            endString,
+            currentString,
+            currentPlusIntervalString,
+        )
+
+    if isinstance(node, DependentNode):
+        return writeDependent(
+            context,
+            node,
+            myVariableName,
+            startString,
+            endString,
+            currentString,
+            currentPlusIntervalString,
+        )
+
+    return writeConstant(
+        context,
+        node,
+        myVariableName,
+        startString,
+        endString,
+        currentString,
+        currentPlusIntervalString,
+    )
+
+
+def writeLeaf(
+    context, node, startString, endString, currentString, currentPlusIntervalString
+):
+    """
+    Writes out the text in a Leaf section.
+    """
+
+    values = None
+    encodedPieces = node.encodedPieces
+    for index, piece in enumerate(node.pieces):
+        if isinstance(piece, str):
+            if len(context.delayedWrite.pendingLabels) > 0:
+                delayWrite(context.delayedWrite, piece, context.outFile)
+            elif encodedPieces is not None:
+                context.outFile.writeEncoded(encodedPieces[index])
+            else:
+                context.outFile.write(piece)
+            continue
+        if values is None:
+            values = [
+                startString,
+                endString,
+                currentString,
+                currentPlusIntervalString,
+                context.batchString,
+                context.batchPaddedString,
+                context.numberOfBatchesString,
+                context.thisResumeNumberString,
+                context.thisResumeNumberPaddedString,
+                context.numberOfResumesPerBatchString,
+                context.resumeCountOverBatchesString,
+                context.resumeCountOverBatchesPaddedString,
+                context.totalNumberOfResumesString,
+            ]
+        for slot in piece.requiredSlots:
+            if values[slot] == "":
+                logging.error(
+                    "\nError!  In section %s, this line contains a special text "
+                    "(%%start%%, %%end%%, %%current%%, %%currentPlusInterval%%, or "
+                    "%%next%%), but it is not inside a Random section that Repeats:\n%s",
+                    node.label,
+                    piece.text,
+                )
+                return -29
+        tempString = "".join(
+            [
+                (values[segment] if isinstance(segment, int) else segment)
+                for segment in piece.segments
+            ]
+        )
+        hasNext = piece.hasNext
+        if piece.usesMemory:
+            retval, tempString = applyMemorySpecialTexts(
+                context.memory, tempString, node.label, piece.text
+            )
+            if retval < 0:
+                return retval
+            hasNext = "%next%" in tempString
+        if (len(context.delayedWrite.pendingLabels) > 0) or hasNext:
+            delayWrite(context.delayedWrite, tempString, context.outFile)
+        else:
+            context.outFile.write(tempString)
+
+    return 1
+
+
+def applyMemorySpecialTexts(memory, tempString, myLabel, theLine):
+    """
+    Stores and recalls the template-defined variables in a line of a Leaf section (%store% and %recall% special texts).
+
+    Returns the error code (negative on failure) and the line with the special texts replaced.
+    """
+    if "%store%" in tempString:
+        tempString_strings = tempString.split("%")
+        for temp_index in range(len(tempString_strings) - 3, -1, -1):
+            # must check length of the list because if the line only contains store commands they will all be stripped out, and the list will be empty on the last iteration (when temp_index is 0)
+            if (len(tempString_strings) > temp_index) and (
+                tempString_strings[temp_index] == "store"
+            ):
+                tempString_strings[temp_index + 2] = (
+                    tempString_strings[temp_index + 2]
+                    .replace("\\n", "\n")
+                    .replace("\\t", "\t")
+                )
+                memory[tempString_strings[temp_index + 1]] = tempString_strings[
+                    temp_index + 2
+                ]
+                logging.debug(
+                    "%%store%% special text.  %s --> %s",
+                    tempString_strings[temp_index + 1],
+                    tempString_strings[temp_index + 2],
+                )
+                # if the store special text comes at the beginning or end of the line, it will leave an empty string when splitting, which will make a '%' when joining
+                start_index = temp_index
+                if (temp_index == 1) and (tempString_strings[0] == ""):
+                    start_index = temp_index - 1
+                end_index = temp_index + 3
+                if (temp_index == len(tempString_strings) - 4) and (
+                    tempString_strings[temp_index + 3] == ""
+                ):
+                    end_index = temp_index + 4
+                tempString_strings = (
+                    tempString_strings[:start_index] + tempString_strings[end_index:]
+                )
+        tempString = "%".join(tempString_strings)
+    if "%recall%" in tempString:
+        tempString_strings = tempString.split("%")
+        for temp_index in range(len(tempString_strings) - 2, -1, -1):
+            if tempString_strings[temp_index] == "recall":
+                try:
+                    tempString = (
+                        "%".join(tempString_strings[:temp_index])
+                        + memory[tempString_strings[temp_index + 1]]
+                        + "%".join(tempString_strings[temp_index + 2 :])
+                    )
+                    logging.debug(
+                        "%%recall%% special text.  %s --> %s",
+                        tempString_strings[temp_index + 1],
+                        memory[tempString_strings[temp_index + 1]],
+                    )
+                except KeyError:
+                    logging.error(
+                        "\nError!  In section %s, this line contains a special text "
+                        '(%%recall%%), but the variable being recalled "%s" has not '
+                        "been stored (using %%store%%):\n%s",
+                        myLabel,
+                        tempString_strings[temp_index + 1],
+                        theLine,
+                    )
+                    return -34, None
+                tempString_strings = tempString.split("%")
+        tempString = "%".join(tempString_strings)
+    return 1, tempString
+
+
+def leafCodebookText(node):
+    """
+    Returns the text of a Leaf section as a single line for the codebook.
+    """
+    return " ".join([theLine.rstrip("\n").replace("\t", " ") for theLine in node.lines])
+
+
+def writeConstant(
+    context,
+    node,
+    myVariableName,
+    startString,
+    endString,
+    currentString,
+    currentPlusIntervalString,
+):
+    """
+    Writes out a Constant section, calling recursiveGenerate.
+    """
+
+    for i in range(len(node.children)):
+        retval = recursiveGenerate(
+            context,
+            node.children[i],
+            myVariableName + "-" + str(i + 1),
+            startString,
+            endString,
+            currentString,
+            currentPlusIntervalString,
+        )
+        if retval < 0:
+            return retval
+    return 1
+
+
+def writeRandom(
+    context,
+    node,
+    myVariableName,
+    startString,
+    endString,
+    currentString,
+    currentPlusIntervalString,
+):
+    """
+    Writes out a Random section, calling enterRandomSection.
+    """
+
+    options = node.options
+    if options.repeat:
+        if (options.minimumNumberOfEntries > 0) or (options.maximumNumberOfEntries > 0):
+            context.dictRangeChoices[node.label] = [len(options.repeatRange), 0, 0]
+        for myIteration in options.repeatRange:
+            startString = str(options.repeatStart)
+            endString = str(options.repeatEnd)
             currentString = str(myIteration)
-            currentPlusIntervalString = str(myIteration + repeatInterval)
-            logging.debug(
-                "In WriteRandom, repeating.  currentString: %s", currentString
-            )
+            currentPlusIntervalString = str(myIteration + options.repeatInterval)
+            if context.logChoices:
+                logging.debug(
+                    "In WriteRandom, repeating.  currentString: %s", currentString
+                )
             retval = enterRandomSection(
-                repeatSame,
-                repeatNever,
-                repeatNoDoubles,
-                repeatDifferentDouble,
-                repeatDifferentDoublePercentage,
-                nonUniformFirstSubPoint,
-                nonUniformFirstSubPointPercentage,
-                matchMaxSelectionsPerSubPoint,
-                maxSelectionsPerSubPointInteger,
-                matchSame,
-                matchDifferent,
-                matchOnlyOneEver,
+                context,
+                node,
                 myVariableName + "-iter" + str(myIteration),
-                myNumChoices,
-                currentLine,
-                saveChoicesFile,
-                txtChoicesFile,
-                inFile,
-                outFile,
-                myLabel,
-                dictionaryRepeatSame,
-                dictionaryRepeatNever,
-                dictionaryMatchSame,
-                dictionaryMatchDifferent,
-                dictionaryMatchOnlyOneEver,
-                dictionaryMaxSelectionsPerSubPoint,
                 startString,
                 endString,
                 currentString,
                 currentPlusIntervalString,
-                dictionaryLastChoice,
-                minimumNumberOfEntries,
-                maximumNumberOfEntries,
             )
             if retval < 0:
                 return retval
-        if len(globalDelayedWrite) > 0:
-            replaceNextString(endString, outFile, myLabel)
+        if len(context.delayedWrite.pendingLabels) > 0:
+            replaceNextString(
+                context.delayedWrite, endString, context.outFile, node.label
+            )
     else:
         retval = enterRandomSection(
-            repeatSame,
-            repeatNever,
-            repeatNoDoubles,
-            repeatDifferentDouble,
-            repeatDifferentDoublePercentage,
-            nonUniformFirstSubPoint,
-            nonUniformFirstSubPointPercentage,
-            matchMaxSelectionsPerSubPoint,
-            maxSelectionsPerSubPointInteger,
-            matchSame,
-            matchDifferent,
-            matchOnlyOneEver,
+            context,
+            node,
             myVariableName,
-            myNumChoices,
-            currentLine,
-            saveChoicesFile,
-            txtChoicesFile,
-            inFile,
-            outFile,
-            myLabel,
-            dictionaryRepeatSame,
-            dictionaryRepeatNever,
-            dictionaryMatchSame,
-            dictionaryMatchDifferent,
-            dictionaryMatchOnlyOneEver,
-            dictionaryMaxSelectionsPerSubPoint,
             startString,
             endString,
             currentString,
             currentPlusIntervalString,
-            dictionaryLastChoice,
-            minimumNumberOfEntries,
-            maximumNumberOfEntries,
         )
     return retval
 
 
 def writeDependent(
-    temp,
-    inFile,
+    context,
+    node,
     myVariableName,
-    myNumChoices,
-    currentLine,
-    saveChoicesFile,
-    txtChoicesFile,
-    outFile,
-    myLabel,
-    dictionaryRepeatSame,
-    dictionaryRepeatNever,
-    dictionaryMatchSame,
-    dictionaryMatchDifferent,
-    dictionaryMatchOnlyOneEver,
-    dictionaryMaxSelectionsPerSubPoint,
     startString,
     endString,
     currentString,
     currentPlusIntervalString,
-    dictionaryLastChoice,
 ):
     """
     Writes out a Dependend section, using recursiveGenerate.
     """
-    # find previous choice in dictionaryLastChoice
-    for countSplit in range(3, len(temp) - 1):
-        if temp[countSplit] == "*master*":
-            masterLabel = temp[countSplit + 1]
-    if masterLabel in dictionaryLastChoice:
-        chosenSubelement = dictionaryLastChoice[masterLabel]
+    # find previous choice in context.dictionaryLastChoice
+    masterLabel = node.masterLabel
+    if masterLabel in context.dictionaryLastChoice:
+        chosenSubelement = context.dictionaryLastChoice[masterLabel]
     else:
         logging.error(
             "\nError! This Dependent section %s depends upon the section labeled %s "
@@ -2044,12 +4214,12 @@ def writeDependent(
             "this Dependent section depends upon a Random section, and make sure "
             "that Random section must always be visited before this Dependent "
             "section.",
-            myLabel,
+            node.label,
             masterLabel,
-            currentLine,
+            node.startLine,
         )
         return -26
-    if chosenSubelement >= myNumChoices:
+    if chosenSubelement >= node.numChoices:
         logging.error(
             "\nError! This Dependent section does not have enough subsections.  The "
             "section it depends on chose element #%d but this Dependent section "
@@ -2058,99 +4228,170 @@ def writeDependent(
             "that the Random section and the Dependent section have the same number "
             "of subsections.",
             chosenSubelement,
-            myNumChoices,
-            currentLine,
+            node.numChoices,
+            node.startLine,
         )
         return -28
 
-    print(currentLine, file=saveChoicesFile, end="")
-    print(chosenSubelement, file=saveChoicesFile)
-    print("\t" + str(chosenSubelement), file=txtChoicesFile, end="")
-    global globalCsvNames, globalCsvData
-    globalCsvNames += ",v" + myVariableName.replace("-", "_")
-    globalCsvData += "," + str(chosenSubelement + 1)
-    for i in range(chosenSubelement):
-        retval = skipElement(inFile, currentLine)
-        if retval < 0:
-            return retval
-    retval = recursiveGenerate(
-        inFile,
-        outFile,
-        saveChoicesFile,
-        txtChoicesFile,
+    if context.replayRecord is not None:
+        recordedSubelement = replayChoice(context, node, myVariableName)
+        if recordedSubelement < 0:
+            return recordedSubelement
+        if recordedSubelement != chosenSubelement:
+            logging.error(
+                "\nError! The record %s chose element #%d for the Dependent section "
+                "%s, but the section it depends on chose element #%d.",
+                context.replayRecord.recordFilename,
+                recordedSubelement,
+                myVariableName,
+                chosenSubelement,
+            )
+            return -79
+    retval = saveChoice(context, node, myVariableName, chosenSubelement)
+    if retval < 0:
+        return retval
+    return recursiveGenerate(
+        context,
+        node.children[chosenSubelement],
         myVariableName + "-" + str(chosenSubelement + 1),
-        dictionaryRepeatSame,
-        dictionaryRepeatNever,
-        dictionaryMatchSame,
-        dictionaryMatchDifferent,
-        dictionaryMatchOnlyOneEver,
-        dictionaryMaxSelectionsPerSubPoint,
         startString,
         endString,
         currentString,
         currentPlusIntervalString,
-        dictionaryLastChoice,
     )
-    if retval < 0:
-        return retval
-    next_line = ""
-    while not "*end_dependent* " + myLabel + " " in next_line:
-        next_line = inFile.readline()
-        if not next_line:  # readline returns an empty string when it reaches EOF
-            logging.error(
-                "\nError!  Could not find *end_dependent* for the Dependent section "
-                "with the label: %s\nThe program finished following a subsection for "
-                "this Dependent section but was unable to find this Dependent "
-                "section's end tag.  Make sure the end tag is in the file.  Make sure "
-                "the Random and Constant and Dependent sections have the correct "
-                "number of subsections.",
-                myLabel,
-            )
-            return -27
-        next_line = next_line.rstrip("\n") + " "
-    return 1
 
 
-def intersection(list1, list2):
+def choiceBits(choices):
     """
-    Returns the intersection and then the items in list2 that are not in list 1.
+    Returns a bitset of the (0-based) choices: bit i is set if choice i is in the list.
     """
+    bits = 0
+    for choice in choices:
+        bits |= 1 << choice
+    return bits
 
-    int_dict = {}
-    not_int_dict = {}
-    list1_dict = {}
-    for e in list1:
-        list1_dict[e] = 1
-    for e in list2:
-        if e in list1_dict:
-            int_dict[e] = 1
-        else:
-            not_int_dict[e] = 1
-    return [list(int_dict.keys()), list(not_int_dict.keys())]
+
+def bitsChoices(bits):
+    """
+    Returns the list of the (0-based) choices in a bitset, e.g., for logging.
+    """
+    return [i for i in range(bits.bit_length()) if (bits >> i) & 1]
 
 
-def nonUniformShuffle(
-    freeToChoose, nonUniformFirstSubPoint, nonUniformFirstSubPointPercentage
-):
+def zeroWeightsNote(options):
+    """
+    Returns a sentence for the errors about running out of choices, naming the sub-points that are never chosen because their *weights* are zero, or "" if there are none.
     """
-    Shuffle the list, but obey any nonUniformFirstSubPoint percentage.
+    if options.zeroWeights == 0:
+        return ""
+    return (
+        "\nSub-points %s of this section have a weight of zero, so they are never "
+        "chosen and do not count as choices.  Giving them a weight greater than zero "
+        "also adds choices."
+        % ", ".join(str(i + 1) for i in bitsChoices(options.zeroWeights))
+    )
+
+
+def makeAliasTable(weights):
+    """
+    Returns the alias table [probabilities, aliases] for drawing a choice with probability proportional to its weight, with Vose's alias method.
+
+    Choice i is drawn by picking a column i uniformly, then keeping i with probabilities[i] or taking aliases[i] otherwise.  Choices with zero weight are never drawn.
     """
-    logging.debug("freeToChoose: %s", freeToChoose)
-    shuffle(freeToChoose)
-    if nonUniformFirstSubPoint and (0 in freeToChoose):
-        freeToChoose.remove(0)
-        if random() * 100.0 < nonUniformFirstSubPointPercentage:
-            freeToChoose.insert(0, 0)
+    myNumChoices = len(weights)
+    total = sum(weights)
+    scaled = [w * myNumChoices / total for w in weights]
+    probabilities = [0.0] * myNumChoices
+    aliases = list(range(myNumChoices))
+    small = [i for i in range(myNumChoices) if scaled[i] < 1.0]
+    large = [i for i in range(myNumChoices) if scaled[i] >= 1.0]
+    while small and large:
+        less = small.pop()
+        more = large[-1]
+        probabilities[less] = scaled[less]
+        aliases[less] = more
+        scaled[more] -= 1.0 - scaled[less]
+        if scaled[more] < 1.0:
+            small.append(large.pop())
+    heaviest = max(range(myNumChoices), key=lambda i: weights[i])
+    for i in large + small:
+        # whatever is left is (to rounding) a full column
+        if weights[i] > 0:
+            probabilities[i] = 1.0
         else:
-            freeToChoose.append(0)
+            aliases[i] = heaviest
+    return [probabilities, aliases]
+
+
+def sampleWeightedChoice(rng, myNumChoices, excluded, options, avoid=None):
+    """
+    Returns a choice that is not in the excluded bitset, with probability proportional to its *weights* weight among the choices left.
 
+    Draws from the section's alias table until a choice is not excluded, and if the first few draws are all excluded, picks from the weights of the choices left.  The choices with zero weight must be in the excluded bitset.  The avoid choice is only returned if no other choice is left.
+    """
+    if avoid is not None:
+        if excluded | (1 << avoid) == (1 << myNumChoices) - 1:
+            return avoid
+        excluded |= 1 << avoid
+    probabilities, aliases = options.aliasTable
+    for _ in range(weightedDrawAttempts):
+        chosenSubelement = rng.randrange(myNumChoices)
+        if rng.random() >= probabilities[chosenSubelement]:
+            chosenSubelement = aliases[chosenSubelement]
+        if not (excluded >> chosenSubelement) & 1:
+            return chosenSubelement
+    weights = options.weights
+    free = [i for i in range(myNumChoices) if not (excluded >> i) & 1]
+    remaining = rng.random() * sum(weights[i] for i in free)
+    for chosenSubelement in free:
+        remaining -= weights[chosenSubelement]
+        if remaining < 0:
+            return chosenSubelement
+    return free[-1]
+
+
+def sampleFreeChoice(rng, myNumChoices, excluded, options, avoid=None):
+    """
+    Returns the choice that would be first after shuffling the choices that are not in the excluded bitset, obeying any nonUniformFirstSubPoint percentage or weights, without shuffling every choice.
+
+    The avoid choice is only returned if no other choice is left, as if it were moved to the end of the shuffled choices.  At least one choice must not be excluded.
+    """
+    if options.weights is not None:
+        return sampleWeightedChoice(rng, myNumChoices, excluded, options, avoid)
+    fallback = avoid
+    if options.nonUniformFirstSubPoint and not (excluded & 1):
+        # the first sub-point goes either first or last
+        if (avoid != 0) and (
+            rng.random() * 100.0 < options.nonUniformFirstSubPointPercentage
+        ):
+            return 0
+        excluded |= 1
+        fallback = 0
+    if avoid is not None:
+        excluded |= 1 << avoid
+    numFree = myNumChoices - excluded.bit_count()
+    if numFree < 1:
+        return fallback
+    if 4 * numFree >= myNumChoices:
+        # rejection sampling takes fewer than 4 draws on average
+        while True:
+            chosenSubelement = rng.randrange(myNumChoices)
+            if not (excluded >> chosenSubelement) & 1:
+                return chosenSubelement
+    free = ~excluded & ((1 << myNumChoices) - 1)
+    for _ in range(rng.randrange(numFree)):
+        free &= free - 1  # clear the lowest free choice
+    return (free & -free).bit_length() - 1
 
-def getChoiceForRepeatSame(myLabel, dictionaryRepeatSame, freeToChoose, myVariableName):
+
+def getChoiceForRepeatSame(
+    myLabel, dictionaryRepeatSame, excluded, myVariableName, freeChoice
+):
     """
-    Get a Random section's choice if RepeatSame.
+    Get a Random section's choice if RepeatSame.  freeChoice is the choice to make if this section has not chosen before.
     """
     if myLabel in dictionaryRepeatSame:
-        if dictionaryRepeatSame[myLabel] in freeToChoose:
+        if not (excluded >> dictionaryRepeatSame[myLabel]) & 1:
             chosenSubelement = dictionaryRepeatSame[myLabel]
         else:
             logging.error(
@@ -2187,26 +4428,34 @@ def getChoiceForRepeatSame(myLabel, dictionaryRepeatSame, freeToChoose, myVariab
             )
             return -14
     else:
-        chosenSubelement = freeToChoose[0]
+        chosenSubelement = freeChoice
     return chosenSubelement
 
 
 def getChoiceForDifferentDouble(
-    repeatDifferentDoublePercentage, dictionaryLastChoice, myLabel, freeToChoose
+    rng,
+    repeatDifferentDoublePercentage,
+    dictionaryLastChoice,
+    myLabel,
+    myNumChoices,
+    excluded,
+    options,
 ):
     """
     Get a Random section's choice if RepeatDifferentDouble.
     """
 
-    if random() * 100.0 < repeatDifferentDoublePercentage:
+    if rng.random() * 100.0 < repeatDifferentDoublePercentage:
         chosenSubelement = dictionaryLastChoice[myLabel]
     else:
-        if dictionaryLastChoice[myLabel] in freeToChoose:
-            freeToChoose.remove(dictionaryLastChoice[myLabel])
-            freeToChoose += [
-                dictionaryLastChoice[myLabel]
-            ]  # needed in case there is only one choice
-        chosenSubelement = freeToChoose[0]
+        # the last choice is only chosen again if there is no other choice
+        chosenSubelement = sampleFreeChoice(
+            rng,
+            myNumChoices,
+            excluded,
+            options,
+            dictionaryLastChoice[myLabel],
+        )
     return chosenSubelement
 
 
@@ -2255,7 +4504,7 @@ def getChoiceForMatchSame(
     if (
         repeatNever
         and myLabel in dictionaryRepeatNever
-        and dictionaryMatchSame[myVariableName] in dictionaryRepeatNever[myLabel]
+        and (dictionaryRepeatNever[myLabel] >> dictionaryMatchSame[myVariableName]) & 1
     ):
         logging.error(
             "\nError! Cannot satisfy both Match Same and Repeat Never (aka "
@@ -2289,42 +4538,67 @@ def getChoiceForMatchSame(
     return chosenSubelement
 
 
-def getChosenSubElement(
-    repeatSame,
-    repeatNever,
-    repeatNoDoubles,
-    repeatDifferentDouble,
-    repeatDifferentDoublePercentage,
-    nonUniformFirstSubPoint,
-    nonUniformFirstSubPointPercentage,
-    matchMaxSelectionsPerSubPoint,
-    maxSelectionsPerSubPointInteger,
-    matchSame,
-    matchDifferent,
-    matchOnlyOneEver,
-    myVariableName,
-    myNumChoices,
+def getSearchCandidates(
+    options,
     myLabel,
-    dictionaryRepeatSame,
-    dictionaryRepeatNever,
+    myVariableName,
+    freeChoices,
     dictionaryMatchSame,
-    dictionaryMatchDifferent,
-    dictionaryMatchOnlyOneEver,
-    dictionaryMaxSelectionsPerSubPoint,
+    dictionaryRepeatSame,
     dictionaryLastChoice,
-    minimumNumberOfEntries,
-    maximumNumberOfEntries,
+    repeatDifferentDouble,
+    repeatDifferentDoublePercentage,
 ):
+    """
+    Get the bitset of the choices a Random section could make during a BatchSearch, or 0 if its choice is copied from an earlier choice.
+    """
+    if options.matchSame and myVariableName in dictionaryMatchSame:
+        return 0
+    if options.repeatSame and myLabel in dictionaryRepeatSame:
+        return 0
+    if repeatDifferentDouble and myLabel in dictionaryLastChoice:
+        lastChoice = 1 << dictionaryLastChoice[myLabel]
+        if not freeChoices & lastChoice:
+            return freeChoices
+        if repeatDifferentDoublePercentage >= 100.0:
+            return 0
+        if (repeatDifferentDoublePercentage < 0.0) and (freeChoices & ~lastChoice):
+            # needed to reach the Minimum Number of Entries
+            return freeChoices & ~lastChoice
+    return freeChoices
+
+
+def getChosenSubElement(context, options, myVariableName, myNumChoices, myLabel):
     """
     Get a Random section's chosen subelement based on RepeatNever, MatchOnlyOneEver, MatchSame, etc.
     """
-
-    freeToChoose = list(range(myNumChoices))
+    repeatSame = options.repeatSame
+    repeatNever = options.repeatNever
+    repeatDifferentDouble = options.repeatDifferentDouble
+    repeatDifferentDoublePercentage = options.repeatDifferentDoublePercentage
+    matchMaxSelectionsPerSubPoint = options.matchMaxSelectionsPerSubPoint
+    maxSelectionsPerSubPointInteger = options.maxSelectionsPerSubPointInteger
+    matchSame = options.matchSame
+    matchDifferent = options.matchDifferent
+    matchOnlyOneEver = options.matchOnlyOneEver
+    minimumNumberOfEntries = options.minimumNumberOfEntries
+    maximumNumberOfEntries = options.maximumNumberOfEntries
+    dictionaryRepeatSame = context.dictionaryRepeatSame
+    dictionaryRepeatNever = context.dictionaryRepeatNever
+    dictionaryMatchSame = context.dictionaryMatchSame
+    dictionaryMatchDifferent = context.dictionaryMatchDifferent
+    dictionaryMatchOnlyOneEver = context.dictionaryMatchOnlyOneEver
+    dictionaryMaxSelectionsPerSubPoint = context.dictionaryMaxSelectionsPerSubPoint
+    dictionaryLastChoice = context.dictionaryLastChoice
+    thisResumeNumber = context.thisResumeNumber
+    logChoices = context.logChoices
+
+    # bit i is set if choice i cannot be made, starting with any choices weighted zero
+    excluded = options.zeroWeights
+    allChoices = (1 << myNumChoices) - 1
     if matchDifferent and myVariableName in dictionaryMatchDifferent:
-        [alreadyTaken, freeToChoose] = intersection(
-            dictionaryMatchDifferent[myVariableName], freeToChoose
-        )
-        if len(freeToChoose) < 1:
+        excluded |= dictionaryMatchDifferent[myVariableName]
+        if excluded == allChoices:
             logging.error(
                 "\nError! Disobeying Match Different.  Not enough choices.\nThe label "
                 'for this Random section: %s\nThe "key" which contains the label and '
@@ -2335,25 +4609,24 @@ def getChosenSubElement(
                 "the repetition.  The program was not able to satisfy that "
                 "requirement.  Add more choices, reduce the number of matched files, "
                 "or reduce the number of repetitions (check for nested repeating "
-                "sections).",
+                "sections).%s",
                 myLabel,
                 myVariableName,
+                zeroWeightsNote(options),
             )
             return [-19, -1]
-        logging.debug("matchDifferent.  freeToChoose: %s", freeToChoose)
+        if logChoices:
+            logging.debug(
+                "matchDifferent.  alreadyTaken: %s",
+                bitsChoices(dictionaryMatchDifferent[myVariableName]),
+            )
 
     if matchMaxSelectionsPerSubPoint and (
         myLabel in dictionaryMaxSelectionsPerSubPoint
     ):
-        [reachedMax, freeToChoose] = intersection(
-            [
-                i
-                for i, j in enumerate(dictionaryMaxSelectionsPerSubPoint[myLabel])
-                if j >= maxSelectionsPerSubPointInteger
-            ],
-            freeToChoose,
-        )
-        if len(freeToChoose) < 1:
+        reachedMax = dictionaryMaxSelectionsPerSubPoint[myLabel][1]
+        excluded |= reachedMax
+        if excluded == allChoices:
             logging.error(
                 "\nError! Disobeying Max Selections Per Sub-Point.  Not enough "
                 'choices.\nThe label for this Random section: %s\nThe "key" which '
@@ -2362,24 +4635,30 @@ def getChosenSubElement(
                 "select the same sub-point more than %d times throughout an entire "
                 "batch. The Program was not able to satisfy that requirement.  Add "
                 "more choices, reduce the number of matched files, or reduce the "
-                "number of repetitions (check for nested repeating sections).",
+                "number of repetitions (check for nested repeating sections).%s",
                 myLabel,
                 myVariableName,
                 maxSelectionsPerSubPointInteger,
+                zeroWeightsNote(options),
             )
             return [-39, -1]
-        logging.debug("matchMaxSelectionsPerSubPoint.  freeToChoose: %s", freeToChoose)
+        if logChoices:
+            logging.debug(
+                "matchMaxSelectionsPerSubPoint.  reachedMax: %s",
+                bitsChoices(reachedMax),
+            )
 
-    global globalThisResumeNumber
     if matchOnlyOneEver and myLabel in dictionaryMatchOnlyOneEver:
-        dictOfResumeToChoices = dictionaryMatchOnlyOneEver[myLabel]
-        for aResumeNumber in dictOfResumeToChoices:
-            if aResumeNumber != globalThisResumeNumber:
-                [alreadyTaken, freeToChoose] = intersection(
-                    dictOfResumeToChoices[aResumeNumber], freeToChoose
-                )
-        if len(freeToChoose) < 1:
-            logging.erorr(
+        [allTaken, takenTwice, dictOfResumeToChoices] = dictionaryMatchOnlyOneEver[
+            myLabel
+        ]
+        # the choices of the other resumes, without looking at each of them
+        takenByOthers = (
+            allTaken & ~dictOfResumeToChoices.get(thisResumeNumber, 0)
+        ) | takenTwice
+        excluded |= takenByOthers
+        if excluded == allChoices:
+            logging.error(
                 "\nError! Disobeying Match One Only Ever (possibly combined with Match "
                 "Different and/or Max Selections Per Sub-Point).  Not enough choices.\n"
                 'The label for this Random section: %s\nThe "key" which contains the '
@@ -2389,35 +4668,37 @@ def getChosenSubElement(
                 "same result as any of the text files it is matched with.  The "
                 "program was not able to satisfy that requirement.  Add more choices, "
                 "reduce the number of matched files, or reduce the number of "
-                "repetitions (check for nested repeating sections).",
+                "repetitions (check for nested repeating sections).%s",
                 myLabel,
                 myVariableName,
-                globalThisResumeNumber,
+                thisResumeNumber,
+                zeroWeightsNote(options),
             )
             return [-36, -1]
-        logging.debug("matchOnlyOneEver.  freeToChoose: %s", freeToChoose)
+        if logChoices:
+            logging.debug(
+                "matchOnlyOneEver.  alreadyTaken: %s", bitsChoices(takenByOthers)
+            )
 
     if myLabel in dictionaryRepeatNever:
         ###If matchDifferent and repeatNever, we would need to precompute all results to prevent a locking situation (or test for inevitable locking), but then what about nested repeats?
         ###This is a complicated possibility.  If the results for each text file were determined randomly, just avoiding previous choices (for this file and others), then it is possible to enter a blocking situation (e.g., files a and b choose between results 0,1,2 for three repeats.  'a' chooses 201, 'b' randomly chooses 02 and then has no valid third choice).  Furthermore, if this section is nested within a Repeat section, then it is possible that not all of the text files will be making this choice on the same repeat iteration, complicating the generation of optimal permutations across all text files.
         ###We have decided to do this the dumb/simple way.  The code will take each text file as it comes and each choice as it comes, obeying the rules for Match Different and Repeat Never (aka 'Always different when repeat').  If it runs into a blocking situation, it will error out.
-        [alreadyTaken, freeToChoose] = intersection(
-            dictionaryRepeatNever[myLabel], freeToChoose
-        )
-        if len(freeToChoose) < 1:
-            [alreadyTaken, freeToChoose] = intersection(
-                dictionaryRepeatNever[myLabel], list(range(myNumChoices))
-            )
-            if len(freeToChoose) < 1:
+        ###With --assignment search, searchBatch searches for choices that avoid any blocking situation, backing up to the choices that caused it, before the batch's files are written.
+        alreadyTaken = dictionaryRepeatNever[myLabel]
+        if excluded | alreadyTaken == allChoices:
+            if alreadyTaken | options.zeroWeights == allChoices:
                 logging.error(
                     '\nError! Disobeying Repeat Never (aka "Always different when repeat"'
                     "), which says that a section should not be chosen more than once "
                     "in a single text file.  To alleviate this problem: add more "
                     "choices or reduce the number of repetitions.\nThe label for this "
                     'Random section: %s\nThe "key" which contains the label and also a '
-                    "concatenated list of the iterations for any ongoing repetitions: %s",
+                    "concatenated list of the iterations for any ongoing repetitions: "
+                    "%s%s",
                     myLabel,
                     myVariableName,
+                    zeroWeightsNote(options),
                 )
                 return [-24, -1]
             else:
@@ -2430,25 +4711,32 @@ def getChosenSubElement(
                     "It failed.  To alleviate this problem: add more choices, reduce the "
                     "number of matched files, or reduce the number of repetitions.  This "
                     "error may occur even if there exists a set of permutations of the "
-                    "choices that obeys both restrictions.\nThe label for this Random "
+                    "choices that obeys both restrictions (use --assignment search to "
+                    "search for such permutations).\nThe label for this Random "
                     'section: %s\nThe "key" which contains the label and also a '
-                    "concatenated list of the iterations for any ongoing repetitions: %s",
+                    "concatenated list of the iterations for any ongoing repetitions: "
+                    "%s%s",
                     myLabel,
                     myVariableName,
+                    zeroWeightsNote(options),
                 )
                 return [-15, -1]
-        logging.debug("repeatNever.  freeToChoose: %s", freeToChoose)
+        excluded |= alreadyTaken
+        if logChoices:
+            logging.debug(
+                "repeatNever.  alreadyTaken: %s",
+                bitsChoices(dictionaryRepeatNever[myLabel]),
+            )
 
     # deal with minimum and maximum numbers of different subelements
-    global globalDictRangeChoices
     if (
-        myLabel in globalDictRangeChoices
+        myLabel in context.dictRangeChoices
     ):  # this should only happen if this label repeats and either minimumNumberOfEntries or maximumNumberOfEntries is set
         [
             rangeLength,
             numChoicesAlreadyMade,
             numTimesChoiceWasDifferentFromLast,
-        ] = globalDictRangeChoices[myLabel]
+        ] = context.dictRangeChoices[myLabel]
         # do we have enough choices left to exactly satisfy the minimum?
         if (
             minimumNumberOfEntries - numTimesChoiceWasDifferentFromLast
@@ -2460,10 +4748,6 @@ def getChosenSubElement(
             repeatDifferentDouble = True
             repeatDifferentDoublePercentage = 101.0
 
-    nonUniformShuffle(
-        freeToChoose, nonUniformFirstSubPoint, nonUniformFirstSubPointPercentage
-    )
-
     if matchSame and myVariableName in dictionaryMatchSame:
         chosenSubelement = getChoiceForMatchSame(
             repeatSame,
@@ -2476,20 +4760,58 @@ def getChosenSubElement(
         )
     elif repeatSame:
         chosenSubelement = getChoiceForRepeatSame(
-            myLabel, dictionaryRepeatSame, freeToChoose, myVariableName
+            myLabel,
+            dictionaryRepeatSame,
+            excluded,
+            myVariableName,
+            sampleFreeChoice(
+                context.rng,
+                myNumChoices,
+                excluded,
+                options,
+            ),
         )
     elif (
         repeatDifferentDouble
         and myLabel in dictionaryLastChoice
-        and dictionaryLastChoice[myLabel] in freeToChoose
+        and not (excluded >> dictionaryLastChoice[myLabel]) & 1
     ):
         chosenSubelement = getChoiceForDifferentDouble(
-            repeatDifferentDoublePercentage, dictionaryLastChoice, myLabel, freeToChoose
+            context.rng,
+            repeatDifferentDoublePercentage,
+            dictionaryLastChoice,
+            myLabel,
+            myNumChoices,
+            excluded,
+            options,
         )
     else:
-        chosenSubelement = freeToChoose[0]
+        chosenSubelement = sampleFreeChoice(
+            context.rng,
+            myNumChoices,
+            excluded,
+            options,
+        )
+
+    if (context.search is not None) and (chosenSubelement >= 0):
+        candidates = getSearchCandidates(
+            options,
+            myLabel,
+            myVariableName,
+            allChoices & ~excluded,
+            dictionaryMatchSame,
+            dictionaryRepeatSame,
+            dictionaryLastChoice,
+            repeatDifferentDouble,
+            repeatDifferentDoublePercentage,
+        )
+        if candidates:
+            chosenSubelement = searchChoice(
+                context, myLabel, myNumChoices, candidates, chosenSubelement, options
+            )
 
-    logging.debug("getChosenSubelement chose: %s", chosenSubelement)
+    if logChoices:
+        logging.debug("getChosenSubelement chose: %s", chosenSubelement)
     if chosenSubelement < 0:
         return [chosenSubelement, -1]
 
@@ -2497,34 +4819,27 @@ def getChosenSubElement(
         dictionaryRepeatSame[myLabel] = chosenSubelement
     if matchSame:
         dictionaryMatchSame[myVariableName] = chosenSubelement
+    chosenBit = 1 << chosenSubelement
     if matchDifferent:
-        if myVariableName in dictionaryMatchDifferent:
-            dictionaryMatchDifferent[myVariableName] += [chosenSubelement]
-        else:
-            dictionaryMatchDifferent[myVariableName] = [chosenSubelement]
+        dictionaryMatchDifferent[myVariableName] = (
+            dictionaryMatchDifferent.get(myVariableName, 0) | chosenBit
+        )
 
     if repeatNever:
-        if myLabel in dictionaryRepeatNever:
-            dictionaryRepeatNever[myLabel] += [chosenSubelement]
-        else:
-            dictionaryRepeatNever[myLabel] = [chosenSubelement]
+        dictionaryRepeatNever[myLabel] = (
+            dictionaryRepeatNever.get(myLabel, 0) | chosenBit
+        )
 
     if matchOnlyOneEver:
-        if myLabel in dictionaryMatchOnlyOneEver:
-            if globalThisResumeNumber in dictionaryMatchOnlyOneEver[myLabel]:
-                dictionaryMatchOnlyOneEver[myLabel][globalThisResumeNumber] += [
-                    chosenSubelement
-                ]
-            else:
-                dictionaryMatchOnlyOneEver[myLabel][globalThisResumeNumber] = [
-                    chosenSubelement
-                ]
-
-        else:
-            dictionaryMatchOnlyOneEver[myLabel] = {}
-            dictionaryMatchOnlyOneEver[myLabel][globalThisResumeNumber] = [
-                chosenSubelement
-            ]
+        if myLabel not in dictionaryMatchOnlyOneEver:
+            dictionaryMatchOnlyOneEver[myLabel] = [0, 0, {}]
+        onlyOneEver = dictionaryMatchOnlyOneEver[myLabel]
+        ownChoices = onlyOneEver[2].get(thisResumeNumber, 0)
+        if (onlyOneEver[0] & chosenBit) and not (ownChoices & chosenBit):
+            # another resume has made this choice too (e.g., with Match Same)
+            onlyOneEver[1] |= chosenBit
+        onlyOneEver[0] |= chosenBit
+        onlyOneEver[2][thisResumeNumber] = ownChoices | chosenBit
 
     if (
         myLabel in dictionaryLastChoice
@@ -2535,186 +4850,419 @@ def getChosenSubElement(
         sameChoiceAsLastTime = False
 
     dictionaryLastChoice[myLabel] = chosenSubelement
-    if myLabel in globalDictRangeChoices:
-        globalDictRangeChoices[myLabel][1] += 1
+    if myLabel in context.dictRangeChoices:
+        context.dictRangeChoices[myLabel][1] += 1
         if not sameChoiceAsLastTime:
-            globalDictRangeChoices[myLabel][2] += 1
+            context.dictRangeChoices[myLabel][2] += 1
+
+    ledgerSelections = context.ledgerSelections.get(myLabel)
+    if ledgerSelections is not None:
+        ledgerSelections[chosenSubelement] = (
+            ledgerSelections.get(chosenSubelement, 0) + 1
+        )
 
     if matchMaxSelectionsPerSubPoint:
         if myLabel not in dictionaryMaxSelectionsPerSubPoint:
-            dictionaryMaxSelectionsPerSubPoint[myLabel] = [0] * myNumChoices
-
-        dictionaryMaxSelectionsPerSubPoint[myLabel][chosenSubelement] += 1
+            dictionaryMaxSelectionsPerSubPoint[myLabel] = [[0] * myNumChoices, 0]
+        [selections, reachedMax] = dictionaryMaxSelectionsPerSubPoint[myLabel]
+        selections[chosenSubelement] += 1
+        if selections[chosenSubelement] >= maxSelectionsPerSubPointInteger:
+            dictionaryMaxSelectionsPerSubPoint[myLabel][1] = reachedMax | chosenBit
 
     return [chosenSubelement, sameChoiceAsLastTime]
 
 
 def enterRandomSection(
-    repeatSame,
-    repeatNever,
-    repeatNoDoubles,
-    repeatDifferentDouble,
-    repeatDifferentDoublePercentage,
-    nonUniformFirstSubPoint,
-    nonUniformFirstSubPointPercentage,
-    matchMaxSelectionsPerSubPoint,
-    maxSelectionsPerSubPointInteger,
-    matchSame,
-    matchDifferent,
-    matchOnlyOneEver,
+    context,
+    node,
     myVariableName,
-    myNumChoices,
-    currentLine,
-    saveChoicesFile,
-    txtChoicesFile,
-    inFile,
-    outFile,
-    myLabel,
-    dictionaryRepeatSame,
-    dictionaryRepeatNever,
-    dictionaryMatchSame,
-    dictionaryMatchDifferent,
-    dictionaryMatchOnlyOneEver,
-    dictionaryMaxSelectionsPerSubPoint,
     startString,
     endString,
     currentString,
     currentPlusIntervalString,
-    dictionaryLastChoice,
-    minimumNumberOfEntries,
-    maximumNumberOfEntries,
 ):
     """
     For a Random section: get which subelement to enter, update outputs, then call recursiveGenerate.
     """
-    [chosenSubelement, sameChoiceAsLastTime] = getChosenSubElement(
-        repeatSame,
-        repeatNever,
-        repeatNoDoubles,
-        repeatDifferentDouble,
-        repeatDifferentDoublePercentage,
-        nonUniformFirstSubPoint,
-        nonUniformFirstSubPointPercentage,
-        matchMaxSelectionsPerSubPoint,
-        maxSelectionsPerSubPointInteger,
-        matchSame,
-        matchDifferent,
-        matchOnlyOneEver,
-        myVariableName,
-        myNumChoices,
-        myLabel,
-        dictionaryRepeatSame,
-        dictionaryRepeatNever,
-        dictionaryMatchSame,
-        dictionaryMatchDifferent,
-        dictionaryMatchOnlyOneEver,
-        dictionaryMaxSelectionsPerSubPoint,
-        dictionaryLastChoice,
-        minimumNumberOfEntries,
-        maximumNumberOfEntries,
-    )
-    if chosenSubelement < 0:
-        return chosenSubelement
-    if len(globalDelayedWrite) > 0 and not sameChoiceAsLastTime:
-        replaceNextString(currentString, outFile, myLabel)
-    print(currentLine, file=saveChoicesFile, end="")
-    print(chosenSubelement, file=saveChoicesFile)
-    print("\t" + str(chosenSubelement), file=txtChoicesFile, end="")
-    global globalCsvNames, globalCsvData
-    globalCsvNames += ",v" + myVariableName.replace("-", "_")
-    globalCsvData += "," + str(chosenSubelement + 1)
-    for i in range(chosenSubelement):
-        retval = skipElement(inFile, currentLine)
-        if retval < 0:
-            return retval
-    if not repeatNoDoubles or not sameChoiceAsLastTime:
+    options = node.options
+    vectorizedSlot = context.vectorizedSlots.get(node.label)
+    if context.replayRecord is not None:
+        chosenSubelement = replayChoice(context, node, myVariableName)
+        if chosenSubelement < 0:
+            return chosenSubelement
+        sameChoiceAsLastTime = (
+            context.dictionaryLastChoice.get(node.label) == chosenSubelement
+        )
+        context.dictionaryLastChoice[node.label] = chosenSubelement
+    elif vectorizedSlot is not None:
+        chosenSubelement = context.vectorizedChoices[vectorizedSlot][
+            context.vectorizedCursors[vectorizedSlot]
+        ]
+        context.vectorizedCursors[vectorizedSlot] += 1
+        if context.search is not None:
+            chosenSubelement = searchChoice(
+                context,
+                node.label,
+                node.numChoices,
+                ((1 << node.numChoices) - 1) & ~options.zeroWeights,
+                chosenSubelement,
+                options,
+            )
+        if context.logChoices:
+            logging.debug("Vectorized choice: %s", chosenSubelement)
+        sameChoiceAsLastTime = (
+            context.dictionaryLastChoice.get(node.label) == chosenSubelement
+        )
+        context.dictionaryLastChoice[node.label] = chosenSubelement
+    else:
+        if context.randomMode == "counter":
+            context.rng = random.Random(deriveSeed(context.resumeSeed, myVariableName))
+        [chosenSubelement, sameChoiceAsLastTime] = getChosenSubElement(
+            context, options, myVariableName, node.numChoices, node.label
+        )
+        if chosenSubelement < 0:
+            if context.search is not None:
+                context.search.failedLabel = node.label
+            return chosenSubelement
+    if (len(context.delayedWrite.pendingLabels) > 0) and not sameChoiceAsLastTime:
+        replaceNextString(
+            context.delayedWrite, currentString, context.outFile, node.label
+        )
+    retval = saveChoice(context, node, myVariableName, chosenSubelement)
+    if retval < 0:
+        return retval
+    if not options.repeatNoDoubles or not sameChoiceAsLastTime:
         retval = recursiveGenerate(
-            inFile,
-            outFile,
-            saveChoicesFile,
-            txtChoicesFile,
+            context,
+            node.children[chosenSubelement],
             myVariableName + "-" + str(chosenSubelement + 1),
-            dictionaryRepeatSame,
-            dictionaryRepeatNever,
-            dictionaryMatchSame,
-            dictionaryMatchDifferent,
-            dictionaryMatchOnlyOneEver,
-            dictionaryMaxSelectionsPerSubPoint,
             startString,
             endString,
             currentString,
             currentPlusIntervalString,
-            dictionaryLastChoice,
         )
         if retval < 0:
             return retval
-    next_line = ""
-    while not "*end_random* " + myLabel + " " in next_line:
-        next_line = inFile.readline()
-        if not next_line:  # readline returns an empty string when it reaches EOF
-            logging.error(
-                "\nError!  Could not find *end_random* for the Random section with the "
-                "label: %s\nThe program finished following a subsection for this "
-                "Random section but was unable to find this Random section's end tag.  "
-                "Make sure the end tag is in the file.  Make sure the Random and "
-                "Constant sections have the correct number of subsections.",
-                myLabel,
-            )
-            return -18
-        next_line = next_line.rstrip("\n") + " "
     return 1
 
 
-def replaceNextString(currentString, outFile, myLabel):
+def delayWrite(delayed, text, outFile):
+    """
+    Adds text to the DelayedWrite, recording where each of its %next% special texts is, then writes out whatever text is no longer waiting.
+    """
+    splitText = text.split("%next%")
+    if splitText[0] != "":
+        delayed.pieces.append(splitText[0])
+    for nextText in splitText[1:]:
+        position = delayed.start + len(delayed.pieces)
+        labelEnd = nextText.find("%")
+        if labelEnd < 0:
+            # %next% without a label can never be replaced
+            myLabel = None
+            nextText = "%next%" + nextText
+        else:
+            myLabel = nextText[:labelEnd]
+            nextText = nextText[labelEnd + 1 :]
+            delayed.slots.setdefault(myLabel, []).append(position)
+        delayed.pieces.append(None)
+        delayed.pendingLabels[position] = myLabel
+        if nextText != "":
+            delayed.pieces.append(nextText)
+    flushDelayedWrite(delayed, outFile)
+
+
+def flushDelayedWrite(delayed, outFile):
+    """
+    Writes out the delayed text up to the first %next% special text that is not yet replaced.
+    """
+    end = delayed.start + len(delayed.pieces)
+    while (delayed.flushed < end) and (
+        delayed.pieces[delayed.flushed - delayed.start] is not None
+    ):
+        outFile.write(delayed.pieces[delayed.flushed - delayed.start])
+        delayed.flushed += 1
+    # drop the written text once it is most of the list, so each piece is only moved a few times
+    if 2 * (delayed.flushed - delayed.start) >= len(delayed.pieces):
+        del delayed.pieces[: delayed.flushed - delayed.start]
+        delayed.start = delayed.flushed
+
+
+def replaceNextString(delayed, currentString, outFile, myLabel):
     """
     Replace the special *next* string with the actual value that would be next.
 
-    If we do not yet know the next value, just store the text in globalDelayedWrite.
+    Only the %next% special texts for this label are replaced, then any text that is no longer waiting is written out.
     """
-    global globalDelayedWrite
-    tempList = []
-    readyToPrint = True
-    for line in globalDelayedWrite:
-        if "%next%" + myLabel + "%" in line:
-            replacedLine = line.replace("%next%" + myLabel + "%", currentString)
-        else:
-            replacedLine = line
-        if "%next%" in replacedLine:
-            readyToPrint = False
-        tempList += [replacedLine]
-    if readyToPrint:
-        for line in tempList:
-            print(line, file=outFile, end="")
-        globalDelayedWrite = []
-    else:
-        globalDelayedWrite = tempList
+    positions = delayed.slots.pop(myLabel, None)
+    if positions is None:
+        return
+    for position in positions:
+        delayed.pieces[position - delayed.start] = currentString
+        del delayed.pendingLabels[position]
+    flushDelayedWrite(delayed, outFile)
 
 
 def isTemplateFile(file_name):
     """
     Check if filename is a valid template.
+
+    Only the file's size and modification time are checked if it has not changed since it was last read (see inputFileCache).  A file that cannot be read is not a template.
     """
-    logging.debug(
-        "Going to try and open %s to check if it is a template file.", file_name
-    )
-    success, inFile, encoding = openInputFile(file_name)
-    if not success:
-        logging.warning('Warning! Failed to open the file named "%s"', file_name)
+    try:
+        info = inputFileCache.get(inputFileKey(file_name))
+        if (info is None) or (info.firstLine is None):
+            logging.debug(
+                "Going to try and open %s to check if it is a template file.", file_name
+            )
+            text, info = readInputFile(file_name)
+            if text is None:
+                logging.warning(
+                    'Warning! Failed to open the file named "%s"', file_name
+                )
+                return False
+    except OSError as e:
+        # e.g., the file was removed after the folder was listed, or cannot be read
+        logging.warning('Warning! Failed to open the file named "%s": %s', file_name, e)
+        return False
+    if info.firstLine.find("*fragment*") == 0:
         return False
-    with inFile:
-        first_line = inFile.readline()
-        if first_line.find("*fragment*") == 0:
-            return False
     return True
 
 
-def main() -> int:
+def parseArguments(argv):
+    """
+    Parses the command line.  Without a template, the program asks the user for everything instead.
+    """
+    parser = argparse.ArgumentParser(
+        description="Generates random text files (e.g., resumes) from a template "
+        "file created by resume-randomizer.html.  Without a template, asks which "
+        "template to use and how many files to generate."
+    )
+    parser.add_argument("template", nargs="?", help="the template (.rtf) file")
+    parser.add_argument(
+        "-m",
+        "--matched",
+        type=parsePositiveInt,
+        default=1,
+        metavar="N",
+        help="the number of matched files in each batch, for templates with matched "
+        "random sections (default: 1)",
+    )
+    parser.add_argument(
+        "-n",
+        "--batches",
+        type=parsePositiveInt,
+        default=1,
+        metavar="N",
+        help="the number of batches (or of files, if not matched) to generate "
+        "(default: 1)",
+    )
+    parser.add_argument(
+        "--no-time",
+        dest="timeInFilename",
+        action="store_false",
+        help="leave the date & time out of each generated filename",
+    )
+    parser.add_argument(
+        "-o",
+        "--output-dir",
+        metavar="DIR",
+        help="the folder to save the generated files in (default: the template's "
+        "folder)",
+    )
+    parser.add_argument(
+        "-j",
+        "--workers",
+        type=parsePositiveInt,
+        default=1,
+        metavar="N",
+        help="generate the batches in N processes at once (default: 1)",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        help="the random seed, to generate the same files as an earlier run with "
+        "this seed (default: a new seed, which is saved in each .sav file and in "
+        "the csv files)",
+    )
+    parser.add_argument(
+        "--random-mode",
+        choices=["stream", "counter", "vectorized"],
+        default="stream",
+        help='"counter" draws each choice from its own random stream (from the seed, '
+        "batch, text file, and variable name), so changing one part of the template "
+        'does not change the choices in the other parts; "vectorized" draws the '
+        "choices of the Random sections without Match or Repeat settings for "
+        '%d resumes at once, which is faster but needs numpy (default: "stream")'
+        % vectorizedBlockSize,
+    )
+    parser.add_argument(
+        "--assignment",
+        choices=["greedy", "search"],
+        default="greedy",
+        help='"search" searches for choices of each batch that obey all of the Match '
+        "and Repeat settings (e.g., Match Different with Repeat Never) before writing "
+        "its files, and reports any batch for which there are none, instead of "
+        'stopping at the first choice that cannot obey them (default: "greedy")',
+    )
+    parser.add_argument(
+        "--ledger",
+        metavar="FILE",
+        help="a SQLite file that counts the choices of the Random sections with Max "
+        "Selections Per Sub-Point or Match Only One Ever, so those settings apply "
+        "across every batch of every run (and process) that uses it, instead of "
+        "within each batch; it is created if needed, and cannot be used with "
+        "--regenerate",
+    )
+    parser.add_argument(
+        "--regenerate",
+        type=parseBatchNumbers,
+        metavar="BATCHES",
+        help="generate only these batches of an earlier run, e.g., 3,40000-40100; "
+        "needs the same --seed, --random-mode, --assignment, --matched, --batches, "
+        "and --time as that run",
+    )
+    parser.add_argument(
+        "--time",
+        metavar="TIME",
+        help="the date & time to use in the filenames instead of now, e.g., "
+        "2026-10-18-09-30-00 from an earlier run",
+    )
+    parser.add_argument(
+        "--replay",
+        nargs="+",
+        metavar="RECORD",
+        help="instead of generating new files, generate the text files saved in "
+        "these .sav files, csv files, or collated csv files (every row) again, "
+        "from their saved choices; each text file is saved in --output-dir, or "
+        "else next to its RECORD",
+    )
+    parser.add_argument(
+        "--choices-only",
+        dest="choicesOnly",
+        action="store_true",
+        help="only make the random choices and save them in the collated csv, "
+        "without writing the text (or the .sav, .txt, and csv files) of each "
+        "resume; the text can be generated later with --replay or --regenerate",
+    )
+    parser.add_argument(
+        "--codebook",
+        choices=["new", "error"],
+        default="new",
+        help="when the template no longer matches the latest codebook, save a new "
+        'codebook ("new", the default) or stop with an error ("error")',
+    )
+    return parser.parse_args(argv)
+
+
+def parsePositiveInt(text):
+    """
+    Parses a whole number that is 1 or greater, e.g., for --matched, --batches, and --workers.
+    """
+    try:
+        number = int(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected a whole number, not " + text)
+    if number < 1:
+        raise argparse.ArgumentTypeError("expected 1 or more, not " + text)
+    return number
+
+
+def parseBatchNumbers(text):
+    """
+    Parses a list of batch numbers and ranges of batch numbers, e.g., "3,7-9".
+    """
+    batchNumbers = []
+    try:
+        for part in text.split(","):
+            first, dash, last = part.partition("-")
+            batchNumbers.extend(range(int(first), int(last if dash else first) + 1))
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "expected batch numbers and ranges like 3,7-9, not " + text
+        )
+    if len(batchNumbers) == 0:
+        raise argparse.ArgumentTypeError("no batch numbers in " + text)
+    return batchNumbers
+
+
+def runCommandLine(args):
+    """
+    Creates resumes from the template given on the command line, without asking the user anything.
+    """
+    logging.info(
+        "\nResumeRandomizer program, version %d, last updated %s.\n", Version, Date
+    )
+    file_name = args.template
+    if not os.path.isfile(file_name):
+        logging.error("\nError! There is no template file named %s", file_name)
+        return -67
+    current_time = strftime("_%Y-%m-%d-%H-%M-%S")
+    if args.time is not None:
+        current_time = "_" + args.time.lstrip("_")
+    runSettings = RunSettings(
+        args.matched,
+        args.batches,
+        args.timeInFilename,
+        args.output_dir,
+        args.codebook,
+        args.workers,
+        args.seed,
+        args.random_mode,
+        args.regenerate,
+        args.choicesOnly,
+        args.assignment,
+        args.ledger,
+    )
+    logName = file_name
+    if args.output_dir is not None:
+        logName = os.path.join(args.output_dir, os.path.basename(file_name))
+    file_handler = None
+    try:
+        if args.output_dir is not None:
+            os.makedirs(args.output_dir, exist_ok=True)
+        file_handler = logging.FileHandler(
+            logName + current_time + ".log", encoding="utf8"
+        )
+        file_handler.setLevel(logging.DEBUG)
+        logging.getLogger().addHandler(file_handler)
+    except OSError as e:
+        logging.warning("Warning! Failed to create the log file: %s", e)
+    logging.info("Using template " + file_name)
+    logging.info("")
+    logLevel = None
+    if args.choicesOnly:
+        # the debugging info for millions of choices would take longer to log than making the choices, and fill the disk
+        logLevel = setThreadLogLevel(logging.INFO)
+    if args.replay is not None:
+        retval = replayResumes(file_name, args.replay, args.output_dir)
+    else:
+        retval = createResumes(file_name, current_time, runSettings)
+    if logLevel is not None:
+        setThreadLogLevel(logLevel)
+    if file_handler is not None:
+        logging.getLogger().removeHandler(file_handler)
+        file_handler.close()
+    if retval < -1:
+        logging.warning(
+            "\nResumeRandomizer has exited with a return code of %d.\nThere may have "
+            "been an error.",
+            retval,
+        )
+    return retval
+
+
+def main(argv=None) -> int:
     """Handles user interface for creating resumes."""
+    args = parseArguments(sys.argv[1:] if argv is None else argv)
     stdout_handler = logging.StreamHandler(sys.stdout)
     stdout_handler.setLevel(logging.INFO)
     logging.basicConfig(
         format="%(message)s", level=logging.DEBUG, handlers=[stdout_handler]
     )
+    if args.template is not None:
+        return runCommandLine(args)
+
     retval = 1
     while retval >= 0:
         logging.info(
@@ -2788,5 +5336,15 @@ def main() -> int:
     return retval
 
 
+def exitStatus(retval):
+    """
+    Returns the exit status of the program for the return code of main: 0 on success, or else the error code without its minus sign (e.g., 79 for -79).
+    """
+    if retval >= 0:
+        return 0
+    return min(-retval, 255)
+
+
 if __name__ == '__main__':
-    sys.exit(main())
+    multiprocessing.freeze_support()
+    sys.exit(exitStatus(main()))
@@ -0,0 +1,61 @@
+import importlib.util
+import os
+
+import pytest
+
+scriptFilename = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "resume-randomizer.py"
+)
+
+
+@pytest.fixture(scope="module")
+def randomizer():
+    spec = importlib.util.spec_from_file_location("resume_randomizer", scriptFilename)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def compileWithFragment(randomizer, tmp_path, weightsText):
+    fragmentFilename = tmp_path / "fragment.rtf"
+    fragmentFilename.write_text(
+        "*fragment*\n\n*leaf*\nB1\n*end_leaf*\n\n*leaf*\nB2\n*end_leaf*\n",
+        encoding="utf-8",
+    )
+    template = [
+        "32 gui version number\n",
+        "*constant* 1 2\n",
+        "*leaf* 1-1\n",
+        "Start\n",
+        "*end_leaf* 1-1\n",
+        "*random* 1-2 3 *weights* " + weightsText + "\n",
+        "*leaf* 1-2-1\n",
+        "A\n",
+        "*end_leaf* 1-2-1\n",
+        "*leaf* 1-2-2\n",
+        "%file%" + str(fragmentFilename) + "%\n",
+        "*end_leaf* 1-2-2\n",
+        "*leaf* 1-2-3\n",
+        "C\n",
+        "*end_leaf* 1-2-3\n",
+        "*end_random* 1-2 3\n",
+        "*end_constant* 1 2\n",
+    ]
+    retval, lines, numFragments = randomizer.replaceFragments(
+        template, [("template.rtf", "utf-8")]
+    )
+    assert (retval, numFragments) == (1, 1)
+    return randomizer.compileTemplate(lines)
+
+
+def test_fragment_shares_its_weight(randomizer, tmp_path):
+    retval, tree = compileWithFragment(randomizer, tmp_path, "1 2 3")
+    assert retval == 1
+    randomNode = tree.children[1]
+    assert len(randomNode.children) == 4
+    assert randomNode.options.weights == [1.0, 1.0, 1.0, 3.0]
+
+
+def test_missing_weights_are_still_reported(randomizer, tmp_path):
+    retval, tree = compileWithFragment(randomizer, tmp_path, "1 2")
+    assert retval == -82
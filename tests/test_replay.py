@@ -0,0 +1,97 @@
+import importlib.util
+import os
+
+import pytest
+
+scriptFilename = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "resume-randomizer.py"
+)
+
+template = (
+    "32 gui version number\n"
+    "*random* 1 2\n"
+    "*leaf* 1-1\n"
+    "A\n"
+    "*end_leaf* 1-1\n"
+    "*random* 1-2 2\n"
+    "*leaf* 1-2-1\n"
+    "B\n"
+    "*end_leaf* 1-2-1\n"
+    "*leaf* 1-2-2\n"
+    "C\n"
+    "*end_leaf* 1-2-2\n"
+    "*end_random* 1-2 2\n"
+    "*end_random* 1 2\n"
+)
+
+
+@pytest.fixture(scope="module")
+def randomizer():
+    spec = importlib.util.spec_from_file_location("resume_randomizer", scriptFilename)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_replay_pandas_collated_csv(randomizer, tmp_path):
+    # the pandas of earlier versions wrote columns with empty cells as decimal numbers
+    templateFilename = tmp_path / "t.rtf"
+    templateFilename.write_text(template, encoding="utf-8")
+    collatedFilename = tmp_path / "t_collated__T.csv"
+    collatedFilename.write_text(
+        "filename,batch,numberOfBatches,resume,numberOfResumesPerBatch,"
+        "yearMonthDayHourMinuteSecond,v1,v1_2\n"
+        "t_1.doc,1,2,1,1,_T,1,\n"
+        "t_2.doc,2,2,1,1,_T,2,2.0\n",
+        encoding="utf-8",
+    )
+    outputDirectory = tmp_path / "out"
+    assert (
+        randomizer.replayResumes(
+            str(templateFilename), [str(collatedFilename)], str(outputDirectory)
+        )
+        == 1
+    )
+    assert (outputDirectory / "t_1.doc").read_text(encoding="utf-8") == "A"
+    assert (outputDirectory / "t_2.doc").read_text(encoding="utf-8") == "C"
+
+
+def test_replay_sav_without_batch(randomizer, tmp_path):
+    # the .sav files of earlier versions do not have the batch or the number of batches
+    templateFilename = tmp_path / "t.rtf"
+    templateFilename.write_text(template, encoding="utf-8")
+    saveFilename = tmp_path / "t_3.sav"
+    saveFilename.write_text(
+        "t_3.doc is the text file that these choices created.\n"
+        "t.rtf is the template file being used.\n"
+        "_T is the current time as year, month, day, hour (out of 24), minute, "
+        "second.\n"
+        "33 is the version of the Python program.\n"
+        "32 gui version number\n"
+        "1 is the number of text files being Matched.\n"
+        "1 is the index of this text file within a matched set.\n"
+        "Read the following lines in pairs.\n"
+        "*random* 1 2\n"
+        "1\n"
+        "*random* 1-2 2\n"
+        "0\n",
+        encoding="utf-8",
+    )
+    (tmp_path / "t_3.csv").write_text(
+        "filename,batch,numberOfBatches,resume,numberOfResumesPerBatch,"
+        "yearMonthDayHourMinuteSecond,v1,v1_2\n"
+        "t_3.doc,3,5,1,1,_T,2,1",
+        encoding="utf-8",
+    )
+    returnVal, record = next(randomizer.readReplayRecords(None, str(saveFilename)))
+    assert returnVal == 1
+    assert (record.batchNumber, record.resumeNumber) == (3, 1)
+    assert record.numberOfBatches == 5
+    outputDirectory = tmp_path / "out"
+    assert (
+        randomizer.replayResumes(
+            str(templateFilename), [str(saveFilename)], str(outputDirectory)
+        )
+        == 1
+    )
+    assert (outputDirectory / "t_3.doc").read_text(encoding="utf-8") == "B"
@@ -0,0 +1,41 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+
+scriptFilename = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "resume-randomizer.py"
+)
+
+
+@pytest.fixture(scope="module")
+def randomizer():
+    spec = importlib.util.spec_from_file_location("resume_randomizer", scriptFilename)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_cache_is_not_next_to_the_template(randomizer, tmp_path, monkeypatch):
+    # pickle finds the compiled template classes through their module
+    monkeypatch.setitem(sys.modules, randomizer.__name__, randomizer)
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    monkeypatch.setenv("LOCALAPPDATA", str(tmp_path / "cache"))
+    templateFolder = tmp_path / "templates"
+    templateFolder.mkdir()
+    templateFilename = templateFolder / "t.rtf"
+    templateFilename.write_text(
+        "32 gui version number\n*leaf* 1\nA\n*end_leaf* 1\n", encoding="utf-8"
+    )
+    cacheFilename = randomizer.templateCacheFilename(str(templateFilename))
+    assert not cacheFilename.startswith(str(templateFolder))
+    runSettings = randomizer.RunSettings(
+        timeInFilename=False,
+        outputDirectory=str(tmp_path / "out"),
+        codebookPolicy="new",
+        seed=1,
+    )
+    assert randomizer.createResumes(str(templateFilename), "_T", runSettings) >= 0
+    assert os.listdir(templateFolder) == ["t.rtf"]
+    assert randomizer.loadTemplateCache(cacheFilename) is not None
@@ -0,0 +1,90 @@
+import importlib.util
+import logging
+import os
+
+import pytest
+
+scriptFilename = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "resume-randomizer.py"
+)
+
+
+@pytest.fixture(scope="module")
+def randomizer():
+    spec = importlib.util.spec_from_file_location("resume_randomizer", scriptFilename)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def writeTemplate(tmp_path, randomOptions):
+    templateFilename = tmp_path / "t.rtf"
+    templateFilename.write_text(
+        "32 gui version number\n"
+        "*random* 1 3 " + randomOptions + "\n"
+        "*leaf* 1-1\n"
+        "A\n"
+        "*end_leaf* 1-1\n"
+        "*leaf* 1-2\n"
+        "B\n"
+        "*end_leaf* 1-2\n"
+        "*leaf* 1-3\n"
+        "C\n"
+        "*end_leaf* 1-3\n"
+        "*end_random* 1 3\n",
+        encoding="utf-8",
+    )
+    return templateFilename
+
+
+def compileOptions(randomizer, randomOptions):
+    currentLine = "*random* 1 3 " + randomOptions
+    return randomizer.parseRandomOptions(currentLine.split(" "), "1", currentLine)
+
+
+def createResumes(randomizer, templateFilename, numberPerBatch, numberOfBatches):
+    outputDirectory = templateFilename.parent / "out"
+    runSettings = randomizer.RunSettings(
+        numberPerBatch=numberPerBatch,
+        numberOfBatches=numberOfBatches,
+        timeInFilename=False,
+        outputDirectory=str(outputDirectory),
+        codebookPolicy="new",
+        seed=1,
+    )
+    retval = randomizer.createResumes(str(templateFilename), "_T", runSettings)
+    return retval, outputDirectory
+
+
+def test_negative_or_all_zero_weights_are_reported(randomizer):
+    assert compileOptions(randomizer, "*weights* 1 -1 1")[0] == -83
+    assert compileOptions(randomizer, "*weights* 0 0 0")[0] == -83
+
+
+def test_weights_and_non_uniform_first_sub_point_are_exclusive(randomizer):
+    retval, options = compileOptions(
+        randomizer, "*nonUniformFirstSubPoint* 50 *weights* 1 1 1"
+    )
+    assert retval == -84
+
+
+def test_zero_weight_is_excluded_under_match_different(randomizer, tmp_path):
+    templateFilename = writeTemplate(tmp_path, "*matchDifferent* *weights* 1 1 0")
+    retval, outputDirectory = createResumes(randomizer, templateFilename, 2, 20)
+    assert retval >= 0
+    for batchNumber in range(1, 21):
+        texts = {
+            (outputDirectory / ("t_%02d_%dof2.doc" % (batchNumber, resume))).read_text(
+                encoding="utf-8"
+            )
+            for resume in (1, 2)
+        }
+        assert texts == {"A", "B"}
+
+
+def test_running_out_of_choices_mentions_zero_weights(randomizer, tmp_path, caplog):
+    templateFilename = writeTemplate(tmp_path, "*matchDifferent* *weights* 1 1 0")
+    with caplog.at_level(logging.ERROR):
+        retval, outputDirectory = createResumes(randomizer, templateFilename, 3, 1)
+    assert retval == -19
+    assert "Sub-points 3 of this section have a weight of zero" in caplog.text